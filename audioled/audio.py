@@ -35,9 +35,15 @@ def numInputChannels(device_index=None):
 
 class GlobalAudio():
     device_index = None
-    buffer = None
+    buffer = None  # view on the latest chunk
     chunk_rate = None
     sample_rate = None
+    # Ring buffer holding the latest samples (channels interleaved).
+    # Every sample is stored twice (at i and i + ring_capacity), so every window is a contiguous view.
+    ring_buffer = None
+    ring_capacity = 0
+    write_index = 0  # total number of samples written, never decreases
+    chunk_size = 0
 
     def __init__(self, device_index=None, chunk_rate=60, num_channels=1):
         GlobalAudio.device_index = device_index
@@ -46,10 +52,71 @@ class GlobalAudio():
         self.global_stream, GlobalAudio.sample_rate = self.stream_audio(device_index, chunk_rate, num_channels)
 
     def _audio_callback(self, in_data, frame_count, time_info, status):
-        chunk = np.fromstring(in_data, np.float32).astype(np.float)
-        GlobalAudio.buffer = chunk
+        GlobalAudio.writeSamples(np.frombuffer(in_data, dtype=np.float32))
         return (None, pyaudio.paContinue)
 
+    @staticmethod
+    def initRingBuffer(capacity):
+        """Allocates the ring buffer for the given number of samples"""
+        GlobalAudio.ring_buffer = np.zeros(2 * capacity, dtype=np.float32)
+        GlobalAudio.ring_capacity = capacity
+        GlobalAudio.write_index = 0
+        GlobalAudio.chunk_size = 0
+        GlobalAudio.buffer = None
+
+    @staticmethod
+    def writeSamples(samples):
+        """Appends samples to the ring buffer
+
+        There must be only one writer. Readers don't need a lock, since the write index
+        is only increased after the samples have been written.
+        """
+        ring = GlobalAudio.ring_buffer
+        capacity = GlobalAudio.ring_capacity
+        write_index = GlobalAudio.write_index
+        if len(samples) > capacity:
+            write_index += len(samples) - capacity
+            samples = samples[-capacity:]
+        n = len(samples)
+        start = write_index % capacity
+        end = start + n
+        ring[start:end] = samples
+        # mirror
+        if end <= capacity:
+            ring[start + capacity:end + capacity] = samples
+        else:
+            ring[start + capacity:] = samples[:capacity - start]
+            ring[:end - capacity] = samples[capacity - start:]
+        GlobalAudio.chunk_size = n
+        GlobalAudio.buffer = ring[start:end]
+        GlobalAudio.write_index = write_index + n
+
+    @staticmethod
+    def getLatest(num_samples):
+        """Returns a view on the latest num_samples samples"""
+        if GlobalAudio.ring_buffer is None:
+            return None
+        write_index = GlobalAudio.write_index
+        num_samples = min(num_samples, write_index, GlobalAudio.ring_capacity)
+        start = (write_index - num_samples) % GlobalAudio.ring_capacity
+        return GlobalAudio.ring_buffer[start:start + num_samples]
+
+    @staticmethod
+    def read(cursor):
+        """Returns a view on all samples written since cursor and the cursor for the next read
+
+        If cursor is None, only the latest chunk is returned.
+        If the reader fell behind by more than the ring capacity, the oldest samples are lost.
+        """
+        if GlobalAudio.ring_buffer is None:
+            return None, cursor
+        write_index = GlobalAudio.write_index
+        if cursor is None:
+            cursor = write_index - GlobalAudio.chunk_size
+        cursor = max(cursor, write_index - GlobalAudio.ring_capacity)
+        start = cursor % GlobalAudio.ring_capacity
+        return GlobalAudio.ring_buffer[start:start + write_index - cursor], write_index
+
     def _open_input_stream(self, chunk_length, device_index=None, channels=1, retry=0):
         """Opens a PyAudio audio input stream
 
@@ -74,6 +141,8 @@ class GlobalAudio():
 
         try:
             frameRate = int(device_info['defaultSampleRate'])
+            # keep one second of audio, at least two chunks
+            GlobalAudio.initRingBuffer(max(frameRate, 2 * chunk_length) * channels)
             stream = p.open(
                 format=pyaudio.paFloat32,
                 channels=channels,
@@ -138,6 +207,7 @@ class AudioInput(Effect):
     def __initstate__(self):
         super(AudioInput, self).__initstate__()
         self._buffer = []
+        self._cursor = None
         print("Virtual audio input created. {} {}".format(GlobalAudio.device_index, GlobalAudio.chunk_rate))
         
         # increase cur_gain by percentage
@@ -197,12 +267,16 @@ class AudioInput(Effect):
 
     async def update(self, dt):
         await super(AudioInput, self).update(dt)
-        self._buffer = GlobalAudio.buffer
+        # all samples since the last update, empty if there is no new chunk
+        self._buffer, self._cursor = GlobalAudio.read(self._cursor)
 
     def process(self):
         if self._inputBuffer is None or self._outputBuffer is None:
             return
         if self._buffer is None or len(self._buffer) <= 0:
+            # no new chunk since the last frame: output empty arrays, so consumers don't analyse the old chunk again
+            for i in range(0, self.num_channels):
+                self._outputBuffer[i] = np.zeros(0, dtype=np.float32)
             return
         if self.autogain:
             # determine max value -> in range 0,1
@@ -2,20 +2,36 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 
 import colorsys
 import math
-import random
 from collections import OrderedDict
 
 import matplotlib as mpl
 import numpy as np
 import scipy as sp
 from scipy.ndimage.filters import gaussian_filter1d
-from scipy.signal import lfilter
 
 import audioled.colors as colors
 import audioled.dsp as dsp
+import audioled.generative as generative
 from audioled.effects import Effect
 from audioled.audio import GlobalAudio
 
+# Analysis for effects that are not part of a filter graph
+_audioAnalysis = dsp.AudioAnalysis()
+
+
+def _getAudioAnalysis(effect):
+    """Returns the audio analysis shared within the effect's filter graph and the current frame"""
+    if effect._filterGraph is not None:
+        return effect._filterGraph._audioAnalysis, effect._filterGraph._frameCount
+    return _audioAnalysis, None
+
+
+def _bandpass(effect, audio, lowcut_hz, highcut_hz, fs):
+    """Returns the band-passed audio of input channel 0, shared with all effects filtering the same input"""
+    analysis, frame = _getAudioAnalysis(effect)
+    return analysis.bandpass(effect._getInputSource(0), frame, np.asarray(audio, dtype=float), lowcut_hz, highcut_hz,
+                             fs)
+
 
 class Spectrum(Effect):
     """
@@ -52,11 +68,11 @@ class Spectrum(Effect):
         self._fft_dist = np.linspace(0, 1, self.fft_bins)
         self._max_filter = np.ones(8)
         self._min_feature_win = np.hamming(8)
-        self._fs_ds = 0.0
         self._bass_rms = None
         self._melody_rms = None
-        self._lastAudioChunk = None
-        self._gen = None
+        # spectrum of the latest audio chunk
+        self._bass = None
+        self._melody = None
         super(Spectrum, self).__initstate__()
 
     def numInputChannels(self):
@@ -100,14 +116,6 @@ class Spectrum(Effect):
                                                  ] + [x for x in colors.blend_modes if x != self.col_blend]
         return definition
 
-    def _audio_gen(self, audio_gen):
-        audio, self._fs_ds = dsp.preprocess(audio_gen, self.fs, self.fmax, self.n_overlaps)
-        return audio
-
-    def buffer_coroutine(self):
-        while True:
-            yield self._lastAudioChunk
-
     async def update(self, dt):
         if self._norm_dist is None or len(self._norm_dist) != self._num_pixels:
             self._norm_dist = np.linspace(0, 1, self._num_pixels)
@@ -120,22 +128,22 @@ class Spectrum(Effect):
             col_bass = self._inputBuffer[2]
             if col_melody is None:
                 # default color: all white
-                col_melody = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+                col_melody = self._getDefaultColor()
             if col_bass is None:
                 # default color: all white
-                col_bass = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
-            if audio is not None:
-                if self._gen is None:
-                    g = self.buffer_coroutine()
-                    next(g)
-                    self._lastAudioChunk = audio
-                    self._gen = self._audio_gen(g)
-                self._lastAudioChunk = audio
-                y = next(self._gen)
-                bass = dsp.warped_psd(y, self.fft_bins, self._fs_ds, [32.7, 261.0], 'bark')
-                melody = dsp.warped_psd(y, self.fft_bins, self._fs_ds, [261.0, self.fmax], 'bark')
-                bass = self.process_line(bass)
-                melody = self.process_line(melody)
+                col_bass = self._getDefaultColor()
+            if audio is not None and len(audio) > 0:
+                # power spectrum is shared with all effects analysing the same input
+                analysis, frame = _getAudioAnalysis(self)
+                pow_spectrum, n_fft, fs_ds = analysis.powerSpectrum(self._getInputSource(0), frame, audio, self.fs,
+                                                                    self.fmax, self.n_overlaps)
+                self._bass = dsp.warp_power_spectrum(pow_spectrum, n_fft, self.fft_bins, fs_ds, [32.7, 261.0], 'bark')
+                self._melody = dsp.warp_power_spectrum(pow_spectrum, n_fft, self.fft_bins, fs_ds, [261.0, self.fmax],
+                                                       'bark')
+            if audio is not None and self._bass is not None:
+                # without a new audio chunk the previous spectrum is shown
+                bass = self.process_line(self._bass)
+                melody = self.process_line(self._melody)
                 pixels = colors.blend(1. / 255.0 * np.multiply(col_bass, bass),
                                       1. / 255. * np.multiply(col_melody, melody), self.col_blend)
                 self._outputBuffer[0] = pixels.clip(0, 255).astype(int)
@@ -245,18 +253,22 @@ class VUMeterRMS(Effect):
             color = self._default_color
 
         y = self._inputBuffer[0]
-        rms = dsp.rms(y)
-        # calculate rms over hold_time
-        while len(self._hold_values) > self.n_overlaps:
-            self._hold_values.pop()
-        self._hold_values.insert(0, rms)
-        rms = dsp.rms(self._hold_values)
+        if len(y) > 0:
+            analysis, frame = _getAudioAnalysis(self)
+            rms = analysis.rms(self._getInputSource(0), frame, y)
+            # calculate rms over hold_time
+            while len(self._hold_values) > self.n_overlaps:
+                self._hold_values.pop()
+            self._hold_values.insert(0, rms)
+        # without a new audio chunk the previous level is shown
+        rms = dsp.rms(self._hold_values) if self._hold_values else 0.0
         db = 20 * math.log10(max(rms, 1e-16))
         scal_value = (self.db_range + db) / self.db_range
-        bar = np.zeros(self._num_pixels) * np.array([[0], [0], [0]])
+        bar = self._getOutBuffer()
         index = int(self._num_pixels * scal_value)
         index = np.clip(index, 0, self._num_pixels - 1)
         bar[0:3, 0:index] = color[0:3, 0:index]
+        bar[0:3, index:] = 0
         self._outputBuffer[0] = bar
 
 
@@ -362,19 +374,21 @@ class VUMeterPeak(Effect):
 
         y = self._inputBuffer[0]
 
-        peak = np.max(y)
-        # calculate max over hold_time
-        while len(self._hold_values) > self.n_overlaps:
-            self._hold_values.pop()
-        self._hold_values.insert(0, peak)
-        peak = np.max(self._hold_values)
+        if len(y) > 0:
+            # calculate max over hold_time
+            while len(self._hold_values) > self.n_overlaps:
+                self._hold_values.pop()
+            self._hold_values.insert(0, np.max(y))
+        # without a new audio chunk the previous level is shown
+        peak = np.max(self._hold_values) if self._hold_values else 0.0
 
         db = (20 * (math.log10(max(peak, 1e-16))))
         scal_value = (self.db_range + db) / self.db_range
-        bar = np.zeros(self._num_pixels) * np.array([[0], [0], [0]])
+        bar = self._getOutBuffer()
         index = int(self._num_pixels * scal_value)
         index = np.clip(index, 0, self._num_pixels - 1)
         bar[0:3, 0:index] = color[0:3, 0:index]
+        bar[0:3, index:] = 0
         self._outputBuffer[0] = bar
 
 
@@ -415,9 +429,10 @@ class MovingLight(Effect):
     def __initstate__(self):
         # state
         self._pixel_state = None
-        self._filter_b, self._filter_a, self._filter_zi = dsp.design_filter(self.lowcut_hz, self.highcut_hz, self.fs, 3)
         self._last_t = 0.0
         self._last_move_t = 0.0
+        # peak of the latest audio chunk
+        self._peak = 0.0
         super(MovingLight, self).__initstate__()
 
     def numInputChannels(self):
@@ -488,11 +503,13 @@ class MovingLight(Effect):
         color = self._inputBuffer[1]
         if color is None:
             # default color: all white
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         if buffer is not None:
             audio = self._inputBuffer[0]
-            # apply bandpass to audio
-            y, self._filter_zi = lfilter(b=self._filter_b, a=self._filter_a, x=np.array(audio), zi=self._filter_zi)
+            if len(audio) > 0:
+                # apply bandpass to audio
+                y = _bandpass(self, audio, self.lowcut_hz, self.highcut_hz, self.fs)
+                self._peak = np.max(y) * 1.0
             # move in speed
             dt_move = self._t - self._last_move_t
             if dt_move * self.speed > 1:
@@ -510,8 +527,8 @@ class MovingLight(Effect):
             self._pixel_state *= (1.0 - dt / self.dim_time)
             self._pixel_state = gaussian_filter1d(self._pixel_state, sigma=0.5, axis=1)
             self._pixel_state = gaussian_filter1d(self._pixel_state, sigma=0.5, axis=1)
-            # new color at origin
-            peak = np.max(y) * 1.0
+            # new color at origin, without a new audio chunk the previous peak is used
+            peak = self._peak
             try:
                 peak = peak**self.peak_filter
             except Exception:
@@ -548,7 +565,8 @@ class Bonfire(Effect):
         self.__initstate__()
 
     def __initstate__(self):
-        self._filter_b, self._filter_a, self._filter_zi = dsp.design_filter(self.lowcut_hz, self.highcut_hz, self.fs, 3)
+        # peak of the latest audio chunk
+        self._peak = 0.0
         super(Bonfire, self).__initstate__()
 
     def numInputChannels(self):
@@ -601,9 +619,11 @@ class Bonfire(Effect):
             return
 
         audiobuffer = self._inputBuffer[0]
-
-        y, self._filter_zi = lfilter(b=self._filter_b, a=self._filter_a, x=np.array(audiobuffer), zi=self._filter_zi)
-        peak = np.max(y) * 1.0
+        if len(audiobuffer) > 0:
+            y = _bandpass(self, audiobuffer, self.lowcut_hz, self.highcut_hz, self.fs)
+            self._peak = np.max(y) * 1.0
+        # without a new audio chunk the previous peak is used
+        peak = self._peak
 
         pixelbuffer[0] = sp.ndimage.interpolation.shift(
             pixelbuffer[0], -self.spread * peak, mode='wrap', prefilter=True)
@@ -643,12 +663,14 @@ class FallingStars(Effect):
         self.__initstate__()
 
     def __initstate__(self):
-        # state
-        self._t0Array = []
-        self._spawnArray = []
-        self._peakArray = []
+        # state, stars are stored in ring buffers
+        self._t0Array = np.zeros(generative.max_stars)
+        self._spawnArray = np.zeros(generative.max_stars, dtype=np.int64)
+        self._peakArray = np.zeros(generative.max_stars)
+        self._starIndex = 0
         self._starCounter = 0
-        self._filter_b, self._filter_a, self._filter_zi = dsp.design_filter(self.lowcut_hz, self.highcut_hz, self.fs, 3)
+        # peak of the latest audio chunk
+        self._peak = 0.0
         super(FallingStars, self).__initstate__()
 
     @staticmethod
@@ -715,37 +737,25 @@ class FallingStars(Effect):
     def numOutputChannels(self):
         return 1
 
-    def spawnStar(self, peak):
-        self._starCounter += 1
-        self._t0Array.append(self._t)
-        self._spawnArray.append(random.randint(0, self._num_pixels - self.thickness))
-        self._peakArray.append(peak)
-        if self._starCounter > 100:
-            self._starCounter -= 1
-            self._t0Array.pop(0)
-            self._spawnArray.pop(0)
-            self._peakArray.pop(0)
+    def spawnStar(self, peak, num_stars=1):
+        index = (self._starIndex + np.arange(num_stars)) % generative.max_stars
+        self._t0Array[index] = self._t
+        self._spawnArray[index] = np.random.randint(0, max(0, self._num_pixels - self.thickness) + 1, num_stars)
+        self._peakArray[index] = peak
+        self._starIndex = (self._starIndex + num_stars) % generative.max_stars
+        self._starCounter = min(self._starCounter + num_stars, generative.max_stars)
 
     def allStars(self, t, dim_speed, thickness, t0, spawnSpot, peak):
-        controlArray = []
-        for i in range(0, self._starCounter):
-            oneStarArray = np.zeros(self._num_pixels)
-            for j in range(0, thickness):
-                if i < len(spawnSpot):
-                    index = spawnSpot[i] + j
-                    if index < self._num_pixels:
-                        oneStarArray[index] = math.exp(-(100 / dim_speed) * (self._t - t0[i])) * max(
-                            self.min_brightness, peak[i])
-            controlArray.append(oneStarArray)
-        return controlArray
+        brightness = np.exp(-(100 / dim_speed) * (t - t0[:self._starCounter])) * np.maximum(
+            self.min_brightness, peak[:self._starCounter])
+        return generative.renderStars(self._num_pixels, thickness, spawnSpot[:self._starCounter], brightness)
 
     def starControl(self, prob, peak):
-        for i in range(int(self.max_spawns)):
-            if random.random() <= prob:
-                self.spawnStar(peak)
-        outputArray = self.allStars(self._t, self.dim_speed, self.thickness, self._t0Array, self._spawnArray,
-                                    self._peakArray)
-        return np.sum(outputArray, axis=0)
+        num_stars = np.count_nonzero(np.random.rand(int(self.max_spawns)) <= prob)
+        if num_stars > 0:
+            self.spawnStar(peak, num_stars)
+        return self.allStars(self._t, self.dim_speed, self.thickness, self._t0Array, self._spawnArray,
+                             self._peakArray)
 
     async def update(self, dt):
         await super().update(dt)
@@ -758,25 +768,26 @@ class FallingStars(Effect):
         if self._inputBufferValid(1):
             color = self._inputBuffer[1]
         else:
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         
         audio = self._inputBuffer[0]
-        # apply bandpass to audio
-        y, self._filter_zi = lfilter(b=self._filter_b, a=self._filter_a, x=np.array(audio), zi=self._filter_zi)
+        if len(audio) > 0:
+            # apply bandpass to audio
+            y = _bandpass(self, audio, self.lowcut_hz, self.highcut_hz, self.fs)
+            self._peak = np.max(y) * 1.0
 
-        # adjust probability according to peak of audio
-        peak = np.max(y) * 1.0
+        # adjust probability according to peak of audio, without a new audio chunk the previous peak is used
+        peak = self._peak
         try:
             peak = peak**self.peak_filter
         except Exception:
             peak = peak
         prob = min(self.probability + peak, 1.0)
         if self._outputBuffer is not None:
-            self._output = np.multiply(
-                color,
-                self.starControl(prob, peak) * np.array([[self.peak_scale * 1.0], [self.peak_scale * 1.0],
-                                                         [self.peak_scale * 1.0]]))
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._output = np.multiply(color,
+                                       self.starControl(prob, peak) * self.peak_scale,
+                                       out=self._getOutBuffer('output'))
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class Oscilloscope(Effect):
@@ -794,8 +805,9 @@ class Oscilloscope(Effect):
         self.__initstate__()
     
     def __initstate__(self):
+        # band-passed audio of the latest chunk
+        self._audio = None
         super().__initstate__()
-        self._filter_b, self._filter_a, self._filter_zi = dsp.design_filter(self.lowcut_hz, max(self.highcut_hz, self.lowcut_hz), GlobalAudio.sample_rate, 3)
 
     @staticmethod
     def getParameterDefinition():
@@ -852,26 +864,26 @@ class Oscilloscope(Effect):
         if self._inputBufferValid(1):
             color = self._inputBuffer[1]
         else:
-            color = np.ones(cols) * np.array([[255], [255], [255]])
+            color = self._getDefaultColor()
         
-        # apply bandpass to audio
-        audio, self._filter_zi = lfilter(b=self._filter_b, a=self._filter_a, x=np.array(audio), zi=self._filter_zi)
-
-        output = np.zeros((3, self._num_rows, cols))
-        # First downsample to half the cols
-        decimation_ratio = np.round(len(audio) / cols * 2)
-        downsampled_audio = sp.signal.decimate(audio, int(decimation_ratio), ftype='fir', zero_phase=True)
-        # Then resample to the number of cols -> prevents jumping between positive and negative values
-        downsampled_audio = sp.signal.resample(downsampled_audio, cols)
-        for i in range(0, cols):
-            # determine index in audio array
-            valIdx = i
-            # get value
-            val = downsampled_audio[valIdx]
-            # convert to row idx
-            rowIdx = max(0, min(int(self._num_rows / 2 + val * self._num_rows / 2), self._num_rows - 1))
-            # set value for this col
-            output[:, rowIdx, i] = color[:, i]
+        if len(audio) > 0:
+            # apply bandpass to audio
+            self._audio = _bandpass(self, audio, self.lowcut_hz, max(self.highcut_hz, self.lowcut_hz),
+                                    GlobalAudio.sample_rate)
+        if self._audio is None:
+            return
+        # without a new audio chunk the previous wave is shown
+        audio = self._audio
+
+        # Resample to the number of cols, only keep half of the bandwidth
+        # -> prevents jumping between positive and negative values
+        downsampled_audio = dsp.resample(audio, cols, smoothing=2.0)
+        # convert to row idx
+        rowIdx = np.clip((self._num_rows / 2 + downsampled_audio * self._num_rows / 2).astype(int), 0,
+                         self._num_rows - 1)
+        output = self._getOutBuffer('output', (3, self._num_rows, cols))
+        output.fill(0.0)
+        output[:, rowIdx, np.arange(cols)] = color[:, :cols]
         self._outputBuffer[0] = output.reshape((3, -1))
 
         
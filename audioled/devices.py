@@ -3,6 +3,7 @@ from __future__ import division
 from __future__ import unicode_literals
 from __future__ import absolute_import
 from collections import OrderedDict
+import threading
 import time
 import numpy as np
 from audioled.effect import Effect
@@ -19,7 +20,7 @@ _GAMMA_TABLE = [
     202, 204, 206, 207, 209, 211, 213, 215, 217, 218, 220, 222, 224, 226, 228, 230, 232, 233, 235, 237, 239, 241, 243,
     245, 247, 249, 251, 253, 255
 ]
-_GAMMA_TABLE = np.array(_GAMMA_TABLE)
+_GAMMA_TABLE = np.array(_GAMMA_TABLE, dtype=np.uint8)
 
 
 class LEDController:
@@ -164,7 +165,7 @@ class FadeCandy(LEDController):
             print('Ensure that fcserver is running and try again.')
 
     def show(self, pixels):
-        self.client.put_pixels((pixels * self.getBrightness()).T.clip(0, 255).astype(int).tolist())
+        self.client.put_pixels_array(pixels * self.getBrightness())
 
 
 class BlinkStick(LEDController):
@@ -185,23 +186,10 @@ class BlinkStick(LEDController):
         This function updates the LED strip with new values.
         """
         # Truncate values and cast to integer
-        n_pixels = pixels.shape[1]
-        pixels = (pixels * self.getBrightness()).clip(0, 255).astype(int)
+        pixels = (pixels * self.getBrightness()).clip(0, 255).astype(np.uint8)
         pixels = _GAMMA_TABLE[pixels]
-        # Read the rgb values
-        r = pixels[0][:].astype(int)
-        g = pixels[1][:].astype(int)
-        b = pixels[2][:].astype(int)
-
-        # Create array in which we will store the led states
-        newstrip = [None] * (n_pixels * 3)
-
-        for i in range(n_pixels):
-            # Blinkstick uses GRB format
-            newstrip[i * 3] = g[i]
-            newstrip[i * 3 + 1] = r[i]
-            newstrip[i * 3 + 2] = b[i]
-        # Send the data to the blinkstick
+        # Blinkstick uses GRB format, interleave the rows to g0, r0, b0, g1, r1, b1, ...
+        newstrip = pixels[[1, 0, 2]].T.ravel().tolist()
         self.stick.set_led_data(0, newstrip)
 
 
@@ -236,6 +224,7 @@ class RaspberryPi(LEDController):
         self.__initstate__()
 
     def __initstate__(self):
+        self._ledBuffer = None
         try:
             import rpi_ws281x
             print('init')
@@ -247,6 +236,7 @@ class RaspberryPi(LEDController):
                 invert=self.invert,
                 brightness=self.brightness)
             self._strip.begin()
+            self._ledBuffer = self._createLedBuffer()
         except ImportError:
             url = 'learn.adafruit.com/neopixels-on-raspberry-pi/software'
             print('Could not import the neopixel library')
@@ -277,6 +267,21 @@ class RaspberryPi(LEDController):
         self.__dict__.update(state)
         self.__initstate__()
 
+    def _createLedBuffer(self):
+        """Returns a numpy view on the LED buffer of the ws281x channel
+
+        Returns None if the buffer is not accessible, pixels are set one by one then.
+        """
+        try:
+            import ctypes
+            import _rpi_ws281x as ws
+            leds = ws.ws2811_channel_t_leds_get(self._strip._channel)
+            buffer = (ctypes.c_uint32 * self._strip.numPixels()).from_address(int(leds))
+            return np.frombuffer(buffer, dtype=np.uint32)
+        except Exception as e:
+            print('Could not access LED buffer, falling back to setPixelColor: {}'.format(e))
+            return None
+
     def show(self, pixels):
         """Writes new LED values to the Raspberry Pi's LED strip
 
@@ -286,18 +291,21 @@ class RaspberryPi(LEDController):
 
         # Truncate values and cast to integer
         n_pixels = pixels.shape[1]
-        pixels = (pixels * self.getBrightness()).clip(0, 255).astype(int)
+        pixels = (pixels * self.getBrightness()).clip(0, 255).astype(np.uint8)
         # Optional gamma correction
         pixels = _GAMMA_TABLE[pixels]
         # Encode 24-bit LED values in 32 bit integers
-        r = np.left_shift(pixels[0][:].astype(int), 16)
-        g = np.left_shift(pixels[1][:].astype(int), 8)
-        b = pixels[2][:].astype(int)
+        r = np.left_shift(pixels[0].astype(np.uint32), 16)
+        g = np.left_shift(pixels[1].astype(np.uint32), 8)
+        b = pixels[2].astype(np.uint32)
         rgb = np.bitwise_or(np.bitwise_or(g, r), b)
         # Update the pixels
-
-        for i in range(n_pixels):
-            self._strip.setPixelColor(i, int(rgb[i]))
+        if self._ledBuffer is not None:
+            n_pixels = min(n_pixels, len(self._ledBuffer))
+            self._ledBuffer[:n_pixels] = rgb[:n_pixels]
+        else:
+            for i in range(n_pixels):
+                self._strip.setPixelColor(i, int(rgb[i]))
         self._strip.show()
 
 
@@ -451,7 +459,7 @@ class PanelWrapper(LEDController):
     def show(self, pixels):
         mapped_pixels = pixels
         if self.pixel_mapping is not None:
-            mapped_pixels = pixels[self.pixel_mapping[:, :, 0], self.pixel_mapping[:, :, 1]]
+            mapped_pixels = np.take(pixels, self.pixel_mapping, axis=1)
         self.device.show(mapped_pixels)
     
     def _createPixelMapping(self, mappingJson):
@@ -459,7 +467,7 @@ class PanelWrapper(LEDController):
             return row * num_cols + col
         num_rows = mappingJson['num_rows']
         num_cols = mappingJson['num_cols']
-        mapping = np.zeros((3, num_rows * num_cols, 2), dtype=np.int64)
+        mapping = np.zeros(num_rows * num_cols, dtype=np.int32)
 
         for substrip in mappingJson['substrips']:
             start_index = substrip['start_index']
@@ -471,9 +479,7 @@ class PanelWrapper(LEDController):
             cur_col = col
             for i in range(num_pixels):
                 index = start_index + i
-                mapping[0, index, :] = [0, toIdx(cur_row, cur_col, num_cols)]
-                mapping[1, index, :] = [1, toIdx(cur_row, cur_col, num_cols)]
-                mapping[2, index, :] = [2, toIdx(cur_row, cur_col, num_cols)]
+                mapping[index] = toIdx(cur_row, cur_col, num_cols)
                 if dir == 'L':
                     cur_col = cur_col - 1
                 elif dir == 'R':
@@ -484,6 +490,116 @@ class PanelWrapper(LEDController):
                     cur_row = cur_row + 1
         return mapping
 
+
+class AsyncDeviceWrapper(LEDController):
+    """Device Wrapper for sending frames on a separate thread
+
+    show() copies the frame into a free buffer and hands it over to a sender
+    thread that writes it to the wrapped device. Rendering of the next frame
+    can start while the previous one is still being sent.
+    If a new frame arrives before the pending one was picked up by the
+    sender thread, the pending frame is dropped.
+    Errors of the wrapped device are raised by the next call to show().
+    """
+
+    def __init__(self, device):
+        self.device = device
+        # three buffers: one being sent, one pending and one to write the next frame to
+        self._buffers = []
+        self._pending = None
+        self._sending = None
+        self._numDropped = 0
+        self._stopped = False
+        self._error = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def num_pixels(self):
+        return self.device.num_pixels
+
+    @num_pixels.setter
+    def num_pixels(self, num_pixels):
+        self.device.num_pixels = num_pixels
+
+    @property
+    def num_rows(self):
+        return self.device.num_rows
+
+    @num_rows.setter
+    def num_rows(self, num_rows):
+        self.device.num_rows = num_rows
+
+    def getBrightness(self):
+        return self.device.getBrightness()
+
+    def setBrightness(self, value):
+        self.device.setBrightness(value)
+
+    def getNumPixels(self):
+        return self.device.getNumPixels()
+
+    def setNumPixels(self, num_pixels):
+        self.device.setNumPixels(num_pixels)
+
+    def getNumRows(self):
+        return self.device.getNumRows()
+
+    def setNumRows(self, num_rows):
+        self.device.setNumRows(num_rows)
+
+    def getNumDroppedFrames(self):
+        return self._numDropped
+
+    def show(self, pixels):
+        with self._condition:
+            if self._error is not None:
+                # report the error of a previous frame to the render loop
+                error = self._error
+                self._error = None
+                raise error
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sendLoop, name='AsyncDeviceWrapper', daemon=True)
+                self._thread.start()
+            if not self._buffers or self._buffers[0].shape != np.shape(pixels):
+                self._buffers = [np.zeros(np.shape(pixels)) for i in range(3)]
+            buffer = next(b for b in self._buffers if b is not self._pending and b is not self._sending)
+        # buffer is neither pending nor being sent, so it can be written without lock
+        np.copyto(buffer, pixels)
+        with self._condition:
+            if self._pending is not None:
+                self._numDropped += 1
+            self._pending = buffer
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sendLoop(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                self._sending = self._pending
+                self._pending = None
+            error = None
+            try:
+                self.device.show(self._sending)
+            except Exception as e:
+                print("Error sending frame to device: {}".format(e))
+                error = e
+            with self._condition:
+                self._sending = None
+                if error is not None:
+                    self._error = error
+
+
 # # Execute this file to run a LED strand test
 # # If everything is working, you should see a red, green, and blue pixel scroll
 # # across the LED strip continously
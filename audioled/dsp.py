@@ -3,9 +3,12 @@ from __future__ import (absolute_import, division, print_function,
 
 import itertools
 import math
+import threading
+from functools import lru_cache
 
 import numpy as np
-from scipy.signal import butter, lfilter_zi
+from scipy.signal import butter, firwin, lfilter_zi, resample_poly, sosfilt, sosfilt_zi
+from scipy.sparse import csr_matrix
 
 
 def rollwin(signal, n_overlaps):
@@ -136,26 +139,13 @@ def preemphasis(signal, coeff=0.97):
     return np.append(signal[0], signal[1:] - coeff * signal[:-1])
 
 
-def memoize(function):
-    """Provides a decorator for memoizing functions"""
-    from functools import wraps
-    memo = {}
-
-    @wraps(function)
-    def wrapper(*args):
-        if args in memo:
-            return memo[args]
-        else:
-            rv = function(*args)
-            memo[args] = rv
-            return rv
-
-    return wrapper
-
-
-@memoize
+@lru_cache(maxsize=32)
 def filter_bank(n_filters, n_fft, fs, fmin_hz, fmax_hz, scale):
-    """Returns an overlapping triangular filterbank"""
+    """Returns an overlapping triangular filterbank
+
+    The filterbank is a sparse matrix of shape (n_filters, n_fft // 2 + 1).
+    Only the most recently used filterbanks are cached.
+    """
     if scale == 'mel':
         fmin_mel = 2595. * np.log10(1 + fmin_hz / 700.)
         fmax_mel = 2595. * np.log10(1 + fmax_hz / 700.)
@@ -167,30 +157,39 @@ def filter_bank(n_filters, n_fft, fs, fmin_hz, fmax_hz, scale):
         f_bark = np.linspace(fmin_bark, fmax_bark, n_filters + 2)
         f_hz = 600.0 * np.sinh(f_bark / 6.0)
     # Convert from Hz points to FFT bin number
-    bins = np.floor((n_fft + 1.) * f_hz / fs)
+    bins = np.floor((n_fft + 1.) * f_hz / fs).astype(int)
+    left, center, right = bins[:-2], bins[1:-1], bins[2:]
+    # Every filter covers the FFT bins from left to right (exclusive)
+    lengths = np.maximum(right - left, 0)
+    rows = np.repeat(np.arange(n_filters), lengths)
+    offsets = np.arange(np.sum(lengths)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    l, c, r = np.repeat(left, lengths), np.repeat(center, lengths), np.repeat(right, lengths)
+    k = l + offsets
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where(k < c, (k - l) / (c - l), (r - k) / (r - c))
     # Construct the filter bank
-    filters = np.zeros((n_filters, n_fft // 2 + 1))
-    for m in range(1, n_filters + 1):
-        f_m_minus = int(bins[m - 1])  # left
-        f_m = int(bins[m])  # center
-        f_m_plus = int(bins[m + 1])  # right
-        for k in range(f_m_minus, f_m):
-            filters[m - 1, k] = (k - bins[m - 1]) / (bins[m] - bins[m - 1])
-        for k in range(f_m, f_m_plus):
-            filters[m - 1, k] = (bins[m + 1] - k) / (bins[m + 1] - bins[m])
+    filters = csr_matrix((values, (rows, k)), shape=(n_filters, n_fft // 2 + 1))
+    filters.eliminate_zeros()
     return filters, f_hz[1:-1]
 
 
-def warped_psd(y, bins, fs, frange, scale):
-    """Returns the power spectrum mapped to a perceptual scale"""
+def power_spectrum(y):
+    """Returns the power spectrum of the real signal y"""
     N = len(y)
-    # Transform to frequency domain
-    pow_spectrum = np.absolute(np.fft.rfft(y))**2 * (2 / N)
+    return np.absolute(np.fft.rfft(y))**2 * (2 / N)
+
+
+def warp_power_spectrum(pow_spectrum, n_fft, bins, fs, frange, scale):
+    """Maps a power spectrum of a signal with n_fft samples to a perceptual scale"""
     # Construct triangular filter bank
-    output, f = filter_bank(bins, N, fs, frange[0], frange[1], scale)
-    # Apply filter bank to power spectrum
-    output = np.dot(pow_spectrum, output.T)
-    return output
+    output, f = filter_bank(bins, n_fft, fs, frange[0], frange[1], scale)
+    # Apply sparse filter bank to power spectrum
+    return output.dot(pow_spectrum)
+
+
+def warped_psd(y, bins, fs, frange, scale):
+    """Returns the power spectrum mapped to a perceptual scale"""
+    return warp_power_spectrum(power_spectrum(y), len(y), bins, fs, frange, scale)
 
 
 def preprocess(audio, fs, fmax, n_overlaps):
@@ -210,7 +209,7 @@ def preprocess(audio, fs, fmax, n_overlaps):
 
 def rms(normalized_sample_points):
     N = len(normalized_sample_points)
-    sum_squares = sum(s**2 for s in normalized_sample_points)
+    sum_squares = np.dot(normalized_sample_points, normalized_sample_points)
     return math.sqrt(sum_squares / (N / 2))
 
 
@@ -220,3 +219,190 @@ def design_filter(lowcut, highcut, fs, order=3):
     high = highcut / nyq
     b, a = butter(order, [low, high], btype='band')
     return b, a, lfilter_zi(b, a)
+
+
+@lru_cache(maxsize=64)
+def design_sos(lowcut, highcut, fs, order=3):
+    """Returns second-order sections and their initial state of a Butterworth band-pass"""
+    nyq = 0.5 * fs
+    sos = butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+    return sos, sosfilt_zi(sos)
+
+
+@lru_cache(maxsize=32)
+def design_resample_filter(up, down, smoothing=1.0):
+    """Returns the low-pass taps of a polyphase resampler with the given (reduced) ratio
+
+    The cutoff is the Nyquist frequency of the lower rate divided by smoothing.
+    """
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    return firwin(2 * half_len + 1, 1. / (max_rate * smoothing), window=('kaiser', 5.0))
+
+
+def resample(x, num, smoothing=1.0):
+    """Resamples x to num samples with a polyphase filter, the filter taps are cached"""
+    g = math.gcd(num, len(x))
+    up, down = num // g, len(x) // g
+    if up == down:
+        return np.array(x, dtype=float)
+    return resample_poly(x, up, down, window=design_resample_filter(up, down, smoothing))
+
+
+class BandSplit(object):
+    """Splits a signal into band-passed signals
+
+    The filter state of all bands is kept in one stacked array of shape (n_bands, n_sections, 2),
+    so the bands are filtered continuously across chunks.
+    """
+
+    def __init__(self, fs, order=3):
+        self.fs = fs
+        self.order = order
+        self._bands = []
+        self._sos = []
+        self._zi = None
+        # bookkeeping for sharing the output within a frame
+        self.frame = None
+        self.used = set()
+        self.output = None
+
+    def numBands(self):
+        return len(self._bands)
+
+    def getBandIndex(self, lowcut, highcut):
+        """Returns the index of the band, the band is added if it doesn't exist yet"""
+        band = (lowcut, highcut)
+        if band in self._bands:
+            return self._bands.index(band)
+        sos, zi = design_sos(lowcut, highcut, self.fs, self.order)
+        self._bands.append(band)
+        self._sos.append(sos)
+        if self._zi is None:
+            self._zi = zi[np.newaxis].copy()
+        else:
+            self._zi = np.concatenate((self._zi, zi[np.newaxis]))
+        return len(self._bands) - 1
+
+    def removeBands(self, indices):
+        """Removes the bands with the given indices"""
+        keep = [i for i in range(len(self._bands)) if i not in indices]
+        self._bands = [self._bands[i] for i in keep]
+        self._sos = [self._sos[i] for i in keep]
+        self._zi = self._zi[keep] if keep else None
+
+    def process(self, x, indices=None):
+        """Filters the chunk x with the given bands (default: all bands)
+
+        Returns an array of shape (len(indices), len(x))
+        """
+        if indices is None:
+            indices = range(len(self._bands))
+        output = np.empty((len(indices), len(x)))
+        for row, i in enumerate(indices):
+            output[row], self._zi[i] = sosfilt(self._sos[i], x, zi=self._zi[i])
+        return output
+
+
+class _AnalysisStream(object):
+    """Rolling window analysis of one audio source, same steps as preprocess()"""
+
+    def __init__(self, chunk_length, fs, fmax, n_overlaps):
+        if fs < 2 * fmax:
+            raise ValueError('Sampling frequency fs must be at least 2 * fmax')
+        self.downsample = max(1, int(fs / (2 * fmax)))
+        self.fs = int(fs // self.downsample)
+        N = len(range(0, chunk_length, self.downsample)) * max(1, n_overlaps)
+        self.window = np.zeros(N)
+        self.hanning_window = np.hanning(N)
+        self.padded = np.zeros(int(2**np.ceil(np.log2(N))))
+        self.frame = None
+        self.pow_spectrum = None
+
+    def push(self, chunk):
+        data = chunk[::self.downsample]
+        S = min(len(data), len(self.window))
+        self.window[:-S] = self.window[S:]
+        self.window[-S:] = data[len(data) - S:]
+        self.pow_spectrum = None
+
+
+class AudioAnalysis(object):
+    """Shared per-frame analysis of audio sources
+
+    Effects request the analysis of an audio source with a key identifying the source
+    (e.g. the output channel of the upstream node) and the current frame number.
+    The rolling window, FFT and RMS of a source are computed only once per frame,
+    no matter how many effects use them.
+    If frame is None, the audio is treated as a new chunk on every call.
+    """
+
+    def __init__(self):
+        self._streams = {}
+        self._rms = {}
+        self._bandSplits = {}
+        self._lock = threading.Lock()
+
+    def powerSpectrum(self, source, frame, audio, fs, fmax, n_overlaps):
+        """Returns the power spectrum of the hanning windowed, zero padded last n_overlaps chunks
+
+        Returns
+        -------
+        (pow_spectrum, n_fft, fs): Power spectrum, length of the transformed signal and sample rate after downsampling
+        """
+        with self._lock:
+            key = (source, fs, fmax, n_overlaps)
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = _AnalysisStream(len(audio), fs, fmax, n_overlaps)
+                self._streams[key] = stream
+            if frame is None or stream.frame != frame:
+                stream.frame = frame
+                stream.push(audio)
+            if stream.pow_spectrum is None:
+                N = len(stream.window)
+                np.multiply(stream.window, stream.hanning_window, out=stream.padded[:N])
+                stream.pow_spectrum = power_spectrum(stream.padded)
+            return stream.pow_spectrum, len(stream.padded), stream.fs
+
+    def rms(self, source, frame, audio):
+        """Returns the RMS value of the current chunk"""
+        with self._lock:
+            cached = self._rms.get(source)
+            if frame is not None and cached is not None and cached[0] == frame:
+                return cached[1]
+            value = rms(audio)
+            self._rms[source] = (frame, value)
+            return value
+
+    def bandpass(self, source, frame, audio, lowcut, highcut, fs, order=3):
+        """Returns the band-passed audio chunk
+
+        All bands requested for a source are filtered together once per frame.
+        Bands that were not requested during the last frame are removed.
+        """
+        with self._lock:
+            key = (source, fs, order)
+            split = self._bandSplits.get(key)
+            if split is None:
+                split = BandSplit(fs, order)
+                self._bandSplits[key] = split
+            if frame is None or split.frame != frame:
+                split.removeBands(set(range(split.numBands())) - split.used)
+                index = split.getBandIndex(lowcut, highcut)
+                split.frame = frame
+                split.used = set()
+                split.output = list(split.process(audio))
+            else:
+                index = split.getBandIndex(lowcut, highcut)
+                if index >= len(split.output):
+                    # band was added during this frame
+                    split.output.extend(split.process(audio, [index]))
+            split.used.add(index)
+            return split.output[index]
+
+    def clear(self):
+        with self._lock:
+            self._streams = {}
+            self._rms = {}
+            self._bandSplits = {}
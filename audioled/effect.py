@@ -1,5 +1,50 @@
 import inspect
 
+import numpy as np
+
+
+class BufferPool(object):
+    """
+    Pool of preallocated pixel buffers
+
+    Buffers are owned by an effect and identified by a key. As long as the requested shape
+    doesn't change, the same buffer is returned on every call, so effects can write their
+    output in place instead of allocating new arrays for each frame.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, owner, key, shape):
+        buffer = self._buffers.get((owner, key))
+        if buffer is None or buffer.shape != shape:
+            buffer = np.zeros(shape)
+            self._buffers[(owner, key)] = buffer
+        return buffer
+
+    def release(self, owner):
+        for k in [k for k in self._buffers if k[0] is owner]:
+            del self._buffers[k]
+
+    def clear(self):
+        self._buffers = {}
+
+
+_constantColors = {}
+
+
+def constantColor(num_pixels, r=255.0, g=255.0, b=255.0):
+    """
+    Returns a shared, read-only color array of shape (3, num_pixels)
+    """
+    key = (num_pixels, float(r), float(g), float(b))
+    color = _constantColors.get(key)
+    if color is None:
+        color = np.ones(num_pixels) * np.array([[r], [g], [b]], dtype=float)
+        color.setflags(write=False)
+        _constantColors[key] = color
+    return color
+
 
 class Effect(object):
     """
@@ -10,6 +55,9 @@ class Effect(object):
 
     Input values can be accessed by self._inputBuffer[channelNumber], output values
     are to be written into self_outputBuffer[channelNumber].
+
+    Output arrays can be taken from self._getOutBuffer() and filled in place (e.g. with out=),
+    the buffer is reused for the next frame.
     """
 
     def __init__(self):
@@ -40,6 +88,10 @@ class Effect(object):
             self._outputBuffer
         except AttributeError:
             self._outputBuffer = None
+        try:
+            self._inputSources
+        except AttributeError:
+            self._inputSources = None
         # make sure all default values are set (basic backwards compatibility)
         argspec = inspect.getargspec(self.__init__)
         if argspec.defaults is not None:
@@ -82,6 +134,24 @@ class Effect(object):
         """
         raise NotImplementedError('process() was not implemented')
 
+    def getGatherMap(self, num_pixels):
+        """
+        Returns the input pixel index of every output pixel, if the effect only reorders
+        the pixels of input channel 0 into output channel 0, otherwise None.
+
+        num_pixels is the number of pixels of input channel 0, the map has to match the output
+        of process() for an input of this size.
+        Consecutive gather effects are combined by the FilterGraph and applied as one index.
+        All indices have to be smaller than the number of input pixels.
+        """
+        return None
+
+    def close(self):
+        """
+        Releases resources like threads or sockets, called when the effect isn't used anymore
+        """
+        pass
+
     async def update(self, dt):
         """
         Update timing, can be used to precalculate stuff that doesn't depend on input values
@@ -136,6 +206,34 @@ class Effect(object):
             return False
         return True
 
+    def _getOutBuffer(self, key=0, shape=None):
+        """
+        Returns a preallocated buffer of the given shape, by default (3, num_pixels).
+
+        The buffer is owned by this effect and will be overwritten in the next frame.
+        """
+        if shape is None:
+            shape = (3, self._num_pixels)
+        if self._filterGraph is not None:
+            return self._filterGraph._bufferPool.get(self, key, shape)
+        return np.zeros(shape)
+
+    def _getInputSource(self, channel):
+        """
+        Returns a key identifying the output that is connected to the given input channel.
+
+        Effects connected to the same output get the same key, so analysis results can be shared.
+        """
+        if self._inputSources is not None and self._inputSources[channel] is not None:
+            return self._inputSources[channel]
+        return (id(self), channel)
+
+    def _getDefaultColor(self, r=255.0, g=255.0, b=255.0):
+        """
+        Returns a shared, read-only color array for the current number of pixels
+        """
+        return constantColor(self._num_pixels, r, g, b)
+
     def setNumOutputPixels(self, num_pixels):
         self._num_pixels = num_pixels
         if num_pixels is not None:
@@ -314,16 +314,21 @@ class AfterGlow(Effect):
             self._outputBuffer[0] = None
             return
 
+        # the input may be an upstream buffer or a read-only color, never modify it
+        output = self._getOutBuffer(shape=np.shape(y))
+        np.copyto(output, y)
         if self._pixel_state is not None and np.size(self._pixel_state) == np.size(y):
             # keep previous state if new color is too dark
             diff = np.nan_to_num((y - self._pixel_state).max(axis=0))
             mask = diff < 10
 
-            y[:, mask] = self._pixel_state[:, mask]
+            output[:, mask] = self._pixel_state[:, mask]
 
-        self._pixel_state = y.clip(0.0, 255.0)
+        np.clip(output, 0.0, 255.0, out=output)
+        # the output buffer is reused in the next frame
+        self._pixel_state = output.copy()
 
-        self._outputBuffer[0] = y.clip(0.0, 255.0)
+        self._outputBuffer[0] = output
 
 
 class Mirror(Effect):
@@ -386,61 +391,62 @@ class Mirror(Effect):
             self._outputBuffer[0] = None
             return
         num_pixels = np.size(self._inputBuffer[0], 1)
-        if self._mirrorLower is None or np.size(self._mirrorLower, 1) != num_pixels:
-            self._mirrorLower = self._genMirrorLowerMap(num_pixels, self.recursion)
-        if self._mirrorUpper is None or np.size(self._mirrorUpper, 1) != num_pixels:
-            self._mirrorUpper = self._genMirrorUpperMap(num_pixels, self.recursion)
-        buffer = self._inputBuffer[0]
         # 0 .. h .. n
         #   h    n-h
+        self._outputBuffer[0] = np.take(self._inputBuffer[0], self._getMirrorMap(num_pixels), axis=1)
+
+    def getGatherMap(self, num_pixels):
+        # the output has as many pixels as the input, see process()
+        return self._getMirrorMap(num_pixels)
+
+    def _getMirrorMap(self, num_pixels):
         if self.mirror_lower:
-            self._outputBuffer[0] = buffer[self._mirrorLower[:, :, 0], self._mirrorLower[:, :, 1]]
-        else:
-            self._outputBuffer[0] = buffer[self._mirrorUpper[:, :, 0], self._mirrorUpper[:, :, 1]]
+            if self._mirrorLower is None or np.size(self._mirrorLower) != num_pixels:
+                self._mirrorLower = self._genMirrorLowerMap(num_pixels, self.recursion)
+            return self._mirrorLower
+        if self._mirrorUpper is None or np.size(self._mirrorUpper) != num_pixels:
+            self._mirrorUpper = self._genMirrorUpperMap(num_pixels, self.recursion)
+        return self._mirrorUpper
 
     def _genMirrorLowerMap(self, n, recursion):
-        mapMask = np.array(
-            [[[0, i] for i in range(0, n)], [[1, i] for i in range(0, n)], [[2, i] for i in range(0, n)]],
-            dtype=np.int64)
+        mapMask = np.arange(n, dtype=np.int32)
         mapMask = self._genMirrorLower(mapMask, recursion)
         return mapMask
 
     def _genMirrorLower(self, mask, recurse=0):
         mapMask = mask.copy()
-        n = mapMask.shape[1]
+        n = np.size(mapMask)
         if n % 2 == 1:
             n = n - 1
         h = int(n / 2)
-        temp = mapMask[:, 0:h, :]
-        temp = temp[:, ::-1, :]
-        mapMask[:, h:n, :] = temp[:, 0:h, :]
+        temp = mapMask[0:h]
+        temp = temp[::-1]
+        mapMask[h:n] = temp[0:h]
         if recurse > 0:
-            mapMask[:, 0:h, :] = self._genMirrorLower(mapMask[:, 0:h, :], recurse - 1)
-            mapMask[:, h:n, :] = self._genMirrorUpper(mapMask[:, h:n, :], recurse - 1)
+            mapMask[0:h] = self._genMirrorLower(mapMask[0:h], recurse - 1)
+            mapMask[h:n] = self._genMirrorUpper(mapMask[h:n], recurse - 1)
         return mapMask
 
     def _genMirrorUpperMap(self, n, recursion):
-        mapMask = np.array(
-            [[[0, i] for i in range(0, n)], [[1, i] for i in range(0, n)], [[2, i] for i in range(0, n)]],
-            dtype=np.int64)
+        mapMask = np.arange(n, dtype=np.int32)
         mapMask = self._genMirrorUpper(mapMask, recursion)
         return mapMask
 
     def _genMirrorUpper(self, mask, recurse=0):
         mapMask = mask.copy()
-        n = mapMask.shape[1]
+        n = np.size(mapMask)
         if n % 2 == 1:
             n = n - 1
         h = int(n / 2)
         # take upper part
-        temp = mapMask[:, h:n, :]
+        temp = mapMask[h:n]
         # revert
-        temp = temp[:, ::-1, :]
+        temp = temp[::-1]
         # assign to lower part
-        mapMask[:, 0:n - h, :] = temp[:, 0:n - h, :]
+        mapMask[0:n - h] = temp[0:n - h]
         if recurse > 0:
-            mapMask[:, 0:h, :] = self._genMirrorUpper(mapMask[:, 0:h, :], recurse - 1)
-            mapMask[:, h:n, :] = self._genMirrorLower(mapMask[:, h:n, :], recurse - 1)
+            mapMask[0:h] = self._genMirrorUpper(mapMask[0:h], recurse - 1)
+            mapMask[h:n] = self._genMirrorLower(mapMask[h:n], recurse - 1)
         return mapMask
 
 
@@ -1,10 +1,16 @@
 import asyncio
 import uuid
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from timeit import default_timer as timer
 
+import numpy as np
+
 from audioled import devices
+from audioled import dsp
 from audioled import generative
+from audioled.effect import BufferPool, Effect
 
 
 class NodeException(Exception):
@@ -33,6 +39,7 @@ class Node(object):
         self._outputBuffer = [None for i in range(0, self.effect.numOutputChannels())]
         self._inputBuffer = [None for i in range(0, self.effect.numInputChannels())]
         self._incomingConnections = []
+        self._outgoingConnections = []
 
         self.effect.setOutputBuffer(self._outputBuffer)
         self.effect.setInputBuffer(self._inputBuffer)
@@ -127,17 +134,105 @@ class Updateable(object):
         raise NotImplementedError("Process not implemented")
 
 
+class GatherChain(object):
+    """Consecutive gather effects (see Effect.getGatherMap), processed with one combined index
+
+    The combined index is rebuilt whenever one of the effects returns a different map.
+    If an effect provides no map, the effects are processed one after another.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self._maps = None
+        self._index = None
+
+    def process(self):
+        head = self.nodes[0]
+        tail = self.nodes[-1]
+        buffer = head._inputBuffer[0]
+        if buffer is None:
+            self._processNodes()
+            return
+        maps = self._getMaps(np.size(buffer, 1))
+        if self._maps is None or len(maps) != len(self._maps) or any(m is not c for m, c in zip(maps, self._maps)):
+            self._maps = maps
+            self._index = self._combine(maps)
+        if self._index is None or np.size(buffer, 1) <= self._index[1]:
+            self._processNodes()
+            return
+        tail._outputBuffer[0] = np.take(buffer, self._index[0], axis=1)
+
+    def _getMaps(self, num_pixels):
+        # every effect gets the number of pixels the previous effect outputs
+        maps = []
+        for node in self.nodes:
+            m = node.effect.getGatherMap(num_pixels)
+            maps.append(m)
+            if m is None:
+                break
+            num_pixels = np.size(m)
+        return maps
+
+    def _processNodes(self):
+        # inputs of the first node are already set
+        head = self.nodes[0]
+        try:
+            head.effect.process()
+        except Exception as e:
+            traceback.print_exc()
+            raise NodeException("{}".format(e), head, e)
+        for node in self.nodes[1:]:
+            node.process()
+
+    def _combine(self, maps):
+        # output pixel i of the chain is input pixel index[i] of the first effect
+        if any(m is None for m in maps):
+            return None
+        index = maps[-1]
+        for m in reversed(maps[:-1]):
+            if np.size(index) > 0 and np.max(index) >= np.size(m):
+                return None
+            index = m[index]
+        if np.size(index) == 0:
+            return None
+        return (index, int(np.max(index)))
+
+
+_executors = {}
+
+
+def _getExecutor(numWorkers):
+    """Returns a shared thread pool with the given number of workers"""
+    executor = _executors.get(numWorkers)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=numWorkers)
+        _executors[numWorkers] = executor
+    return executor
+
+
 class FilterGraph(Updateable):
+    # Number of worker threads for processing independent nodes in parallel, 0 processes all nodes sequentially
+    numProcessWorkers = 0
+    # Combine consecutive gather effects (e.g. Mirror, MakeSquare, FlipRows) into one index
+    fuseGatherEffects = True
+
     def __init__(self, recordTimings=False, asyncUpdate=True):
         self.recordTimings = recordTimings
         self.asyncUpdate = asyncUpdate
         self._filterConnections = []
         self._filterNodes = []
+        self._filterNodesByUid = {}
         self._processOrder = []
         self._updateTimings = {}
         self._processTimings = {}
         self._outputNode = None
         self._project = None
+        self._processPlan = None
+        self._processLevels = None
+        self._gatherChains = {}
+        self._bufferPool = BufferPool()
+        self._audioAnalysis = dsp.AudioAnalysis()
+        self._frameCount = 0
 
     def update(self, dt, event_loop=asyncio.get_event_loop()):
         if self._outputNode is None:
@@ -166,19 +261,144 @@ class FilterGraph(Updateable):
                     self.updateUpdateTiming(str(node.effect), timer() - time)
 
     def process(self):
-        time = None
-
         if self._outputNode is None:
             # Pass the process, since no num_pixels can be provided to the effects
             return
 
-        for node in self._processOrder:
+        self._frameCount += 1
+        if self._processPlan is None:
+            self._processPlan = self._compileProcessPlan()
+            self._processLevels = self._compileProcessLevels(self._processPlan)
 
-            if self.recordTimings:
-                time = timer()
-            node.process()
-            if self.recordTimings:
-                self.updateProcessTiming(node, timer() - time)
+        if self.numProcessWorkers > 1:
+            self._processParallel(_getExecutor(self.numProcessWorkers))
+            return
+
+        for step in self._processPlan:
+            self._processStep(step)
+
+    def _processParallel(self, executor):
+        for level in self._processLevels:
+            # dispatch all but the first node to the pool, process the first one in this thread
+            futures = [executor.submit(self._processStep, step) for step in level[1:]]
+            error = None
+            try:
+                self._processStep(level[0])
+            except NodeException as e:
+                error = e
+            # join before dependent nodes are processed
+            for future in futures:
+                try:
+                    future.result()
+                except NodeException as e:
+                    error = error or e
+            if error is not None:
+                raise error
+
+    def _processStep(self, step):
+        node, effectProcess, inputBuffer, unconnectedChannels, wiring = step
+        time = None
+        if self.recordTimings:
+            time = timer()
+        # reset unconnected inputs, propagate values for connected ones
+        for channel in unconnectedChannels:
+            inputBuffer[channel] = None
+        for toChannel, fromBuffer, fromChannel in wiring:
+            inputBuffer[toChannel] = fromBuffer[fromChannel]
+        try:
+            effectProcess()
+        except Exception as e:
+            traceback.print_exc()
+            raise NodeException("{}".format(e), node, e)
+        if self.recordTimings:
+            self.updateProcessTiming(node, timer() - time)
+
+    def _compileProcessPlan(self):
+        """Builds the flat execution schedule for the current process order
+
+        Each step is a tuple (node, effect.process, inputBuffer, unconnectedChannels, wiring),
+        where wiring holds (toChannel, fromNode._outputBuffer, fromChannel) for every incoming
+        connection. The schedule only depends on the topology and is rebuilt lazily after
+        the topology changed.
+
+        Chains of gather effects are processed in one step at the position of the last node,
+        with the inputs of the first node.
+        """
+        self._gatherChains = self._findGatherChains() if self.fuseGatherEffects else {}
+        chainedNodes = set(node for chain in self._gatherChains.values() for node in chain.nodes[:-1])
+        plan = []
+        for node in self._processOrder:
+            # identify the source of every input, so effects can share analysis of the same input
+            inputSources = [None] * node.numInputChannels
+            for con in node._incomingConnections:
+                inputSources[con.toChannel] = (con.fromNode.uid, con.fromChannel)
+            node.effect._inputSources = inputSources
+            if node in chainedNodes:
+                continue
+            process = node.effect.process
+            inputNode = node
+            if node in self._gatherChains:
+                process = self._gatherChains[node].process
+                inputNode = self._gatherChains[node].nodes[0]
+            wiring = tuple((con.toChannel, con.fromNode._outputBuffer, con.fromChannel)
+                           for con in inputNode._incomingConnections)
+            connectedChannels = set(con.toChannel for con in inputNode._incomingConnections)
+            unconnectedChannels = tuple(i for i in range(inputNode.numInputChannels) if i not in connectedChannels)
+            plan.append((node, process, inputNode._inputBuffer, unconnectedChannels, wiring))
+        return tuple(plan)
+
+    def _findGatherChains(self):
+        """Returns chains of at least two gather effects by their last node
+
+        Within a chain, every node but the last one is only connected to the next node.
+        """
+        def isGather(node):
+            getGatherMap = getattr(type(node.effect), 'getGatherMap', Effect.getGatherMap)
+            return (getGatherMap is not Effect.getGatherMap and node.numInputChannels == 1
+                    and node.numOutputChannels == 1)
+
+        def nextInChain(node):
+            if node is self._outputNode or len(node._outgoingConnections) != 1:
+                return None
+            con = node._outgoingConnections[0]
+            if len(con.toNode._incomingConnections) != 1 or not isGather(con.toNode):
+                return None
+            return con.toNode
+
+        processNodes = set(self._processOrder)
+        nextNodes = {}
+        for node in self._processOrder:
+            if isGather(node):
+                nextNode = nextInChain(node)
+                if nextNode is not None and nextNode in processNodes:
+                    nextNodes[node] = nextNode
+        chains = {}
+        for head in nextNodes:
+            if head in nextNodes.values():
+                continue
+            nodes = [head]
+            while nodes[-1] in nextNodes:
+                nodes.append(nextNodes[nodes[-1]])
+            chains[nodes[-1]] = GatherChain(nodes)
+        return chains
+
+    def _compileProcessLevels(self, plan):
+        """Groups the steps of the process plan by their dependency level
+
+        Sources are on level 0, every other node is one level above its highest predecessor.
+        Nodes on the same level don't depend on each other and can be processed in parallel.
+        """
+        nodeLevels = {}
+        levels = []
+        for step in plan:
+            node = step[0]
+            inputNode = self._gatherChains[node].nodes[0] if node in self._gatherChains else node
+            level = max([nodeLevels.get(con.fromNode, -1) for con in inputNode._incomingConnections], default=-1) + 1
+            nodeLevels[node] = level
+            if level == len(levels):
+                levels.append([])
+            levels[level].append(step)
+        return tuple(tuple(level) for level in levels)
 
     def updateProcessTiming(self, node, timing):
         if node not in self._processTimings:
@@ -217,9 +437,14 @@ class FilterGraph(Updateable):
         filterNode: node to add
         """
         #print("add node {}".format(effect))
+        node = self._addEffectNode(effect, uuid.uuid4().hex)
+        self._updateProcessOrder()
+        return node
+
+    def _addEffectNode(self, effect, uid):
         effect._filterGraph = self
         node = Node(effect)
-        node.uid = uuid.uuid4().hex
+        node.uid = uid
         if isinstance(effect, devices.LEDOutput):
             if self._outputNode is None:
                 self._outputNode = node
@@ -227,7 +452,7 @@ class FilterGraph(Updateable):
                 raise RuntimeError("Filtergraph can only have one LED Output")
 
         self._filterNodes.append(node)
-        self._updateProcessOrder()
+        self._filterNodesByUid[uid] = node
         return node
 
     def removeEffectNode(self, effect):
@@ -237,21 +462,21 @@ class FilterGraph(Updateable):
         ----------
         filterNode: node to remove
         """
+        node = next(node for node in self._filterNodes if node.effect == effect)
         # Remove connections
-        connections = [
-            con for con in self._filterConnections if con.fromNode.effect == effect or con.toNode.effect == effect
-        ]
-        for con in connections:
-            self._filterConnections.remove(con)
+        for con in node._incomingConnections + node._outgoingConnections:
+            self._removeConnection(con)
         # Remove Node
-        node = next(node for node in self._filterNodes if node.effect == effect)
-        if node is not None:
-            self._filterNodes.remove(node)
-            if node == self._outputNode:
-                self._outputNode = None
-            if node in self._processOrder:
-                self._processOrder.remove(node)
-                self._updateProcessOrder()
+        self._filterNodes.remove(node)
+        if self._filterNodesByUid.get(node.uid) is node:
+            del self._filterNodesByUid[node.uid]
+        if node == self._outputNode:
+            self._outputNode = None
+        self._bufferPool.release(effect)
+        if node in self._processOrder:
+            self._processOrder.remove(node)
+            self._updateProcessOrder()
+        self._processPlan = None
 
     def addConnection(self, fromEffect, fromEffectChannel, toEffect, toEffectChannel):
         """Adds a connection between two filters
@@ -260,13 +485,7 @@ class FilterGraph(Updateable):
         fromNode = next(node for node in self._filterNodes if node.effect == fromEffect)
         # find toNode
         toNode = next(node for node in self._filterNodes if node.effect == toEffect)
-        # construct connection
-        newConnection = Connection(fromNode, fromEffectChannel, toNode, toEffectChannel)
-        newConnection.uid = uuid.uuid4().hex
-        if self._connectionWillMakeGraphCyclic(newConnection):
-            raise RuntimeError("Connection would make graph cyclic")
-        self._filterConnections.append(newConnection)
-        toNode._incomingConnections.append(newConnection)
+        newConnection = self._addConnection(fromNode, fromEffectChannel, toNode, toEffectChannel, uuid.uuid4().hex)
         self._updateProcessOrder()
         return newConnection
 
@@ -275,15 +494,21 @@ class FilterGraph(Updateable):
         """
         #print("add node connection from {} channel {} to {} channel {}".format(fromNodeUid, fromEffectChannel,
         #                                                                       toNodeUid, toEffectChannel))
-        fromNode = next(node for node in self._filterNodes if node.uid == fromNodeUid)
-        toNode = next(node for node in self._filterNodes if node.uid == toNodeUid)
+        fromNode = self._getNodeByUid(fromNodeUid)
+        toNode = self._getNodeByUid(toNodeUid)
+        newConnection = self._addConnection(fromNode, fromEffectChannel, toNode, toEffectChannel, uuid.uuid4().hex)
+        self._updateProcessOrder()
+        return newConnection
+
+    def _addConnection(self, fromNode, fromEffectChannel, toNode, toEffectChannel, uid):
+        # construct connection
         newConnection = Connection(fromNode, fromEffectChannel, toNode, toEffectChannel)
-        newConnection.uid = uuid.uuid4().hex
+        newConnection.uid = uid
         if self._connectionWillMakeGraphCyclic(newConnection):
             raise RuntimeError("Connection would make graph cyclic")
         self._filterConnections.append(newConnection)
         toNode._incomingConnections.append(newConnection)
-        self._updateProcessOrder()
+        fromNode._outgoingConnections.append(newConnection)
         return newConnection
 
     def removeConnection(self, fromEffect, fromEffectChannel, toEffect, toEffectChannel):
@@ -294,83 +519,68 @@ class FilterGraph(Updateable):
                    if con.fromNode.effect == fromEffect and con.toNode.effect == toEffect
                    and con.fromChannel == fromEffectChannel and con.toChannel == toEffectChannel)
         if con is not None:
-            self._filterConnections.remove(con)
-            con.toNode._incomingConnections.remove(con)
-        None
+            self._removeConnection(con)
+
+    def _removeConnection(self, con):
+        self._filterConnections.remove(con)
+        con.toNode._incomingConnections.remove(con)
+        con.fromNode._outgoingConnections.remove(con)
+        self._processPlan = None
+
+    def _getNodeByUid(self, uid):
+        node = self._filterNodesByUid.get(uid)
+        if node is None or node.uid != uid:
+            # uid may have been changed from outside, search nodes and rebuild index
+            node = next(node for node in self._filterNodes if node.uid == uid)
+            self._filterNodesByUid = {n.uid: n for n in self._filterNodes}
+        return node
 
     def getLEDOutput(self):
         return self._outputNode
 
     def _updateProcessOrder(self):
-        processOrder = []
+        # topology changed, process plan needs to be recompiled
+        self._processPlan = None
         if self._outputNode is None:
             print("No output node")
             return
 
         #print("Updating process order")
 
-        unprocessedNodes = self._filterNodes.copy()
-        processOrder.append(self._outputNode)
-        unprocessedNodes.remove(self._outputNode)
-
-        fatalError = False
-        while not fatalError and len(unprocessedNodes) > 0:
-            sizeBefore = len(unprocessedNodes)
-            for node in unprocessedNodes.copy():
-                # find connections
-                cons = [con for con in self._filterConnections if con.fromNode == node]
-                # check all nodes after this node have been processed
-                satisfied = True
-                for con in cons:
-                    if con.toNode not in processOrder:
-                        satisfied = False
-                        continue
-
-                if satisfied:
-                    #print("Appending {}".format(node.effect))
-                    processOrder.append(node)
-                    unprocessedNodes.remove(node)
-            sizeAfter = len(unprocessedNodes)
-            fatalError = sizeAfter == sizeBefore
-
-        #print("{} nodes total, {} nodes have not been processed".format(len(processOrder), len(unprocessedNodes)))
-
-        # Check remaining unprocessed nodes for circular connections
-        # for node in unprocessedNodes:
-        #     cons = [con for con in self._filterConnections if con.fromNode == node]
-        #     for con in cons:
-        #         if con.toNode in self._processOrder:
-        #             raise RuntimeError("Circular connection detected")
-
-        processOrder.reverse()
+        # Kahn's algorithm on the reversed graph, starting from the output node:
+        # A node is ready once all nodes consuming its output have been ordered
+        numPendingSuccessors = {node: len(node._outgoingConnections) for node in self._filterNodes}
+        ready = deque([self._outputNode])
+        ready.extend(
+            node for node in self._filterNodes if node is not self._outputNode and numPendingSuccessors[node] == 0)
+        processOrder = []
+        while ready:
+            node = ready.popleft()
+            processOrder.append(node)
+            for con in node._incomingConnections:
+                iNode = con.fromNode
+                numPendingSuccessors[iNode] -= 1
+                if numPendingSuccessors[iNode] == 0 and iNode is not self._outputNode:
+                    ready.append(iNode)
 
         # Reset number of pixels
         for node in self._filterNodes:
             if node is not self.getLEDOutput():
                 node.effect.setNumOutputPixels(None)
-        # Propagate num pixels and num cols
-        for node in reversed(processOrder):
-            # find connections to the current node
-            inputConnections = [con for con in self._filterConnections if con.toNode == node]
-            # print("{} input connections found for node {}".format(len(inputConnections), node.effect))
-            for con in inputConnections:
+        # Propagate num pixels and num cols, starting at the output node
+        for node in processOrder:
+            for con in node._incomingConnections:
                 num_pixels = node.effect.getNumInputPixels(con.toChannel)
                 num_rows = node.effect.getNumInputRows(con.toChannel)
-                # find node
-                iNode = con.fromNode
                 # propagate pixels
-                if iNode is not None:
-                    #print("setting {} pixels with {} rows for {}".format(num_pixels, num_rows, iNode.effect))
-                    iNode.effect.setNumOutputRows(num_rows)
-                    iNode.effect.setNumOutputPixels(num_pixels)
-
-        # Debug output
-        for node in processOrder.copy():
-            #print("{} with {} pixels".format(node.effect, node.effect._num_pixels))
-            if node.effect._num_pixels is None:
-                processOrder.remove(node)
-        # persist
-        self._processOrder = processOrder
+                #print("setting {} pixels with {} rows for {}".format(num_pixels, num_rows, con.fromNode.effect))
+                con.fromNode.effect.setNumOutputRows(num_rows)
+                con.fromNode.effect.setNumOutputPixels(num_pixels)
+
+        processOrder.reverse()
+
+        # persist, skip nodes without pixel information
+        self._processOrder = [node for node in processOrder if node.effect._num_pixels is not None]
 
     def __getstate__(self):
         state = {}
@@ -388,14 +598,21 @@ class FilterGraph(Updateable):
         self.recordTimings = state['recordTimings']
         nodes = state['nodes']
         for node in nodes:
-            newnode = self.addEffectNode(node.effect)
-            newnode.uid = node.uid
+            self._addEffectNode(node.effect, node.uid)
         connections = state['connections']
         for con in connections:
             fromChannel = con['from_node_channel']
             toChannel = con['to_node_channel']
-            newcon = self.addNodeConnection(con['from_node_uid'], fromChannel, con['to_node_uid'], toChannel)
-            newcon.uid = con['uid']
+            self._addConnection(
+                self._getNodeByUid(con['from_node_uid']), fromChannel, self._getNodeByUid(con['to_node_uid']),
+                toChannel, con['uid'])
+        # update process order once the whole graph is restored
+        self._updateProcessOrder()
+
+    def close(self):
+        """Closes all effects, called when the FilterGraph isn't used anymore"""
+        for node in self._filterNodes:
+            node.effect.close()
 
     def propagateNumPixels(self, num_pixels, num_rows=1):
         if self.getLEDOutput() is not None:
@@ -409,22 +626,18 @@ class FilterGraph(Updateable):
         if targetNode == curNode:
             return True
         # traverse predecessors and check if connection.toNode is one of them
-        return self._checkHasPredecessor(curNode, targetNode, [])
+        return self._checkHasPredecessor(curNode, targetNode)
 
-    def _checkHasPredecessor(self, curNode, targetNode, visitedNodes):
+    def _checkHasPredecessor(self, curNode, targetNode):
         #print("Checking {} for {}".format(curNode, targetNode))
-        if targetNode == curNode:
-            return True
-        predecessors = [con for con in self._filterConnections if con.toNode == curNode]
-        furtherNodes = []
-        for con in predecessors:
-            node = con.fromNode
+        visitedNodes = set([curNode])
+        stack = [curNode]
+        while stack:
+            node = stack.pop()
             if node is targetNode:
                 return True
-            if node not in visitedNodes:
-                furtherNodes.append(node)
-        visitedNodes.append(curNode)
-        for node in furtherNodes:
-            if self._checkHasPredecessor(node, targetNode, visitedNodes):
-                return True
+            for con in node._incomingConnections:
+                if con.fromNode not in visitedNodes:
+                    visitedNodes.add(con.fromNode)
+                    stack.append(con.fromNode)
         return False
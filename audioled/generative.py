@@ -2,7 +2,6 @@ from __future__ import (absolute_import, division, print_function, unicode_liter
 
 import math
 import random
-import threading
 from collections import OrderedDict
 import os.path
 
@@ -19,6 +18,15 @@ wave_modes = ['sin', 'sawtooth', 'sawtooth_reversed', 'square']
 wave_mode_default = 'sin'
 sortby = ['red', 'green', 'blue', 'brightness']
 sortbydefault = 'red'
+max_stars = 100
+
+
+def renderStars(num_pixels, thickness, spawnSpot, brightness):
+    """Renders stars of the given thickness starting at spawnSpot into one array by adding up their brightness"""
+    index = (np.asarray(spawnSpot)[:, np.newaxis] + np.arange(thickness)).ravel()
+    weights = np.repeat(brightness, thickness)
+    valid = index < num_pixels
+    return np.bincount(index[valid], weights=weights[valid], minlength=num_pixels)
 
 
 class SwimmingPool(Effect):
@@ -100,23 +108,24 @@ class SwimmingPool(Effect):
 
     def _SinArray(self, _spread, _wavehight):
         # Create array for a single wave
-        _CArray = []
-        _spread = min(int(self._num_pixels / 2) - 1, _spread)
-        for i in range(-_spread, _spread + 1):
-            _CArray.append(math.sin((math.pi / _spread) * i) * _wavehight)
-        _output = np.zeros(self._num_pixels)
-        _output[:len(_CArray)] = _CArray
+        return self._SinWaves(np.array([_spread]), np.array([_wavehight]))[0]
+
+    def _SinWaves(self, _spread, _wavehight):
+        # Create matrix with one wave per row
+        _spread = np.minimum(int(self._num_pixels / 2) - 1, _spread)[:, np.newaxis]
+        _index = np.arange(self._num_pixels)
+        _output = np.where(_index <= 2 * _spread,
+                           np.sin((math.pi / _spread) * (_index - _spread)) * _wavehight[:, np.newaxis], 0.0)
         # Move somewhere
-        _output = np.roll(_output, np.random.randint(0, self._num_pixels), axis=0)
+        _offset = np.random.randint(0, self._num_pixels, len(_output))
+        _output = _output[np.arange(len(_output))[:, np.newaxis], (_index - _offset[:, np.newaxis]) % self._num_pixels]
         return _output.clip(0.0, 255.0)
 
     def _CreateWaves(self, num_waves, wavespread_low=10, wavespread_high=50, max_speed=30):
-        _WaveArray = []
         _wavespread = np.random.randint(wavespread_low, wavespread_high, num_waves)
         _WaveArraySpecSpeed = np.random.randint(-max_speed, max_speed, num_waves)
         _WaveArraySpecHeight = np.random.rand(num_waves)
-        for i in range(0, num_waves):
-            _WaveArray.append(self._SinArray(_wavespread[i], _WaveArraySpecHeight[i]))
+        _WaveArray = self._SinWaves(_wavespread, _WaveArraySpecHeight)
         return _WaveArray, _WaveArraySpecSpeed
 
     def numInputChannels(self):
@@ -153,23 +162,22 @@ class SwimmingPool(Effect):
         if self._inputBuffer is None or self._outputBuffer is None:
             return
         if not self._inputBufferValid(0):
-            color = np.ones(self._num_pixels) * np.array([[255], [255], [255]])
+            color = self._getDefaultColor()
         else:
             color = self._inputBuffer[0]
 
-        
-        all_waves = np.zeros(self._num_pixels)
-        for i in range(0, self.num_waves):
-            fact = 1.0
-            if i == 0:
-                fact = (self._rotate_counter / 30)
-            if i == self.num_waves - 1:
-                fact = (1.0 - self._rotate_counter / 30)
-            if i < len(self._Wave) and i < len(self._WaveSpecSpeed):
-                step = np.roll(self._Wave[i], int(self._t * self._WaveSpecSpeed[i]), axis=0) * self.scale * fact
-                all_waves += step
-        
-        self._outputBuffer[0] = np.multiply(color, all_waves).clip(0, 255.0)
+        num_waves = min(self.num_waves, len(self._Wave), len(self._WaveSpecSpeed))
+        # Fade in first and fade out last wave
+        fact = np.full(num_waves, self.scale)
+        fact[0] = self.scale * self._rotate_counter / 30
+        if num_waves == self.num_waves:
+            fact[-1] = self.scale * (1.0 - self._rotate_counter / 30)
+        # Shift all waves at once, equivalent to np.roll for every wave
+        shift = (self._t * self._WaveSpecSpeed[:num_waves]).astype(int)
+        index = (np.arange(self._num_pixels) - shift[:, np.newaxis]) % self._num_pixels
+        all_waves = np.dot(fact, self._Wave[np.arange(num_waves)[:, np.newaxis], index])
+
+        self._outputBuffer[0] = np.clip(np.multiply(color, all_waves), 0, 255.0, out=self._getOutBuffer())
 
 
 class DefenceMode(Effect):
@@ -207,7 +215,7 @@ class DefenceMode(Effect):
             else:
                 self._output = np.zeros(self._num_pixels) * np.array([[0.0], [0.0], [0.0]])
 
-            self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class MidiKeyboard(Effect):
@@ -256,6 +264,13 @@ class MidiKeyboard(Effect):
             print(self.midiPort)
         self._on_notes = []
 
+    def close(self):
+        # release the MIDI port, it is opened again when the effect is restored
+        try:
+            self._midi.close()
+        except Exception:
+            pass
+
     def numInputChannels(self):
         return 1  # color
 
@@ -353,7 +368,7 @@ class MidiKeyboard(Effect):
         if self._inputBuffer is None or self._outputBuffer is None:
             return
         if not self._inputBufferValid(0):
-            col = np.ones(self._num_pixels) * np.array([[255], [255], [255]])
+            col = self._getDefaultColor()
         else:
             col = self._inputBuffer[0]
 
@@ -418,12 +433,11 @@ class Breathing(Effect):
     def process(self):
         color = self._inputBuffer[0]
         if color is None:
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         if self._outputBuffer is not None:
             brightness = self.oneStar(self._t, self.cycle)
-            self._output = np.multiply(color,
-                                       np.ones(self._num_pixels) * np.array([[brightness], [brightness], [brightness]]))
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._output = np.multiply(color, brightness, out=self._getOutBuffer('output'))
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class Heartbeat(Effect):
@@ -479,12 +493,11 @@ class Heartbeat(Effect):
     def process(self):
         color = self._inputBuffer[0]
         if color is None:
-            color = np.ones(self._num_pixels) * np.array([[255.0], [0.0], [0.0]])
+            color = self._getDefaultColor(255.0, 0.0, 0.0)
         if self._outputBuffer is not None:
             brightness = self.oneStar(self._t, self.speed)
-            self._output = np.multiply(color,
-                                       np.ones(self._num_pixels) * np.array([[brightness], [brightness], [brightness]]))
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._output = np.multiply(color, brightness, out=self._getOutBuffer('output'))
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class FallingStars(Effect):
@@ -503,11 +516,12 @@ class FallingStars(Effect):
         self.__initstate__()
 
     def __initstate__(self):
-        # state
-        self._t0Array = []
-        self._spawnArray = []
+        # state, stars are stored in ring buffers
+        self._t0Array = np.zeros(max_stars)
+        self._spawnArray = np.zeros(max_stars, dtype=np.int64)
+        self._starIndex = 0
         self._starCounter = 0
-        self._spawnflag = True
+        self._lastSpawnTime = None
         super(FallingStars, self).__initstate__()
 
     @staticmethod
@@ -550,34 +564,30 @@ class FallingStars(Effect):
     def numOutputChannels(self):
         return 1
 
-    def spawnStar(self):
-        self._starCounter += 1
-        self._t0Array.append(self._t)
-        self._spawnArray.append(random.randint(0, self._num_pixels - self.thickness))
-        if self._starCounter > 100:
-            self._starCounter -= 1
-            self._t0Array.pop(0)
-            self._spawnArray.pop(0)
-        threading.Timer(self.spawntime, self.spawnStar).start()  # executes itself every *spawnTime* seconds
+    def spawnStar(self, t0):
+        self._t0Array[self._starIndex] = t0
+        self._spawnArray[self._starIndex] = random.randint(0, max(0, self._num_pixels - self.thickness))
+        self._starIndex = (self._starIndex + 1) % max_stars
+        self._starCounter = min(self._starCounter + 1, max_stars)
 
     def allStars(self, t, dim_speed, thickness, t0, spawnSpot):
-        controlArray = []
-        for i in range(0, self._starCounter):
-            oneStarArray = np.zeros(self._num_pixels)
-            for j in range(0, thickness):
-                if i < len(spawnSpot):
-                    index = spawnSpot[i] + j
-                    if index < self._num_pixels:
-                        oneStarArray[index] = math.exp(-(100 / dim_speed) * (self._t - t0[i]))
-            controlArray.append(oneStarArray)
-        return controlArray
+        brightness = np.exp(-(100 / dim_speed) * (t - t0[:self._starCounter]))
+        return renderStars(self._num_pixels, thickness, spawnSpot[:self._starCounter], brightness)
 
     def starControl(self, spawnTime):
-        if self._spawnflag is True:
-            self.spawnStar()
-            self._spawnflag = False
-        outputArray = self.allStars(self._t, self.dim_speed, self.thickness, self._t0Array, self._spawnArray)
-        return np.sum(outputArray, axis=0)
+        # spawn stars for the time passed since the last frame
+        if self._lastSpawnTime is None:
+            self._lastSpawnTime = self._t
+            self.spawnStar(self._t)
+        numSpawns = int((self._t - self._lastSpawnTime) / spawnTime)
+        if numSpawns > max_stars:
+            # older stars would be overwritten anyway
+            self._lastSpawnTime += (numSpawns - max_stars) * spawnTime
+            numSpawns = max_stars
+        for i in range(numSpawns):
+            self._lastSpawnTime += spawnTime
+            self.spawnStar(self._lastSpawnTime)
+        return self.allStars(self._t, self.dim_speed, self.thickness, self._t0Array, self._spawnArray)
 
     async def update(self, dt):
         await super().update(dt)
@@ -585,13 +595,12 @@ class FallingStars(Effect):
     def process(self):
         color = self._inputBuffer[0]
         if color is None:
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         if self._outputBuffer is not None:
-            self._output = np.multiply(
-                color,
-                self.starControl(self.spawntime) * np.array([[self.max_brightness * 1.0], [self.max_brightness * 1.0],
-                                                             [self.max_brightness * 1.0]]))
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._output = np.multiply(color,
+                                       self.starControl(self.spawntime) * self.max_brightness,
+                                       out=self._getOutBuffer('output'))
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class Pendulum(Effect):
@@ -695,7 +704,7 @@ class Pendulum(Effect):
             color = self._inputBuffer[0]
         else:
             # default: all white
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         if self.heightactivator is True:
             if self.lightflip is True:
                 lightconfig = -1.0
@@ -705,7 +714,7 @@ class Pendulum(Effect):
         else:
             configArray = np.array([[1.0], [1.0], [1.0]])
         self._output = np.multiply(color, self.controlBlobs() * configArray)
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class RandomPendulums(Effect):
@@ -811,9 +820,10 @@ class RandomPendulums(Effect):
             color = self._inputBuffer[0]
         else:
             # default: all white
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
 
-        self._output = np.zeros(self._num_pixels) * np.array([[0.0], [0.0], [0.0]])
+        self._output = self._getOutBuffer('output')
+        self._output.fill(0.0)
         for i in range(self.num_pendulums):
             if self._heightactivator[i] is True:
                 if self._lightflip[i] is True:
@@ -828,7 +838,7 @@ class RandomPendulums(Effect):
                 color,
                 self.controlBlobs(self._spread[i], self._location[i], self._displacement[i], self._offset[i],
                                   self._swingspeed[i]) * configArray)
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class StaticBlob(Effect):
@@ -904,10 +914,10 @@ class StaticBlob(Effect):
             color = self._inputBuffer[0]
         else:
             # default: all white
-            color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+            color = self._getDefaultColor()
         self._output = np.multiply(color, self.createBlob(self.spread, self.location) * np.array([[1.0], [1.0], [1.0]]))
 
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+        self._outputBuffer[0] = np.clip(self._output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class GenerateWaves(Effect):
@@ -1011,15 +1021,20 @@ class GenerateWaves(Effect):
         if self._outputBuffer is not None:
             color = self._inputBuffer[0]
             if color is None:
-                color = np.ones(self._num_pixels) * np.array([[255.0], [255.0], [255.0]])
+                color = self._getDefaultColor()
 
             output = np.multiply(color, self._wavearray * np.array([[1.0], [1.0], [1.0]]))
 
-            self._outputBuffer[0] = output.clip(0.0, 255.0)
+            self._outputBuffer[0] = np.clip(output, 0.0, 255.0, out=self._getOutBuffer())
 
 
 class Sorting(Effect):
-    """Effect for sorting an input by color or brightness."""
+    """Effect for sorting an input by color or brightness.
+
+    Pixels are sorted by odd-even transposition: every round swaps all neighbouring pixels
+    that are in the wrong order. The target order is computed once with argsort,
+    the rounds are spread over the duration of the sorting.
+    """
 
     @staticmethod
     def getEffectDescription():
@@ -1031,17 +1046,23 @@ class Sorting(Effect):
             sortby=sortbydefault,
             reversed=False,
             looping=True,
+            duration=5.0,
     ):
 
         self.sortby = sortby
         self.reversed = reversed
         self.looping = looping
+        self.duration = duration
         self.__initstate__()
 
     def __initstate__(self):
         # state
         self._output = None
         self._sorting_done = True
+        self._order = None
+        self._ranks = None
+        self._round = 0
+        self._sortTime = 0.0
         super(Sorting, self).__initstate__()
 
     @staticmethod
@@ -1052,7 +1073,8 @@ class Sorting(Effect):
                 # default, min, max, stepsize
                 ("sortby", sortby),
                 ("reversed", False),
-                ("looping", True)
+                ("looping", True),
+                ("duration", [5.0, 0.5, 60.0, 0.5]),
             ])
         }
         return definition
@@ -1067,7 +1089,9 @@ class Sorting(Effect):
                 "Flips the parameter which is sorted by.",
                 "looping":
                 "If activated, the effect randomly picks another parameter to sort by. "
-                "If deactivated, the effects spawns a new pattern after sorting."
+                "If deactivated, the effects spawns a new pattern after sorting.",
+                "duration":
+                "Time in seconds to sort all pixels, independent of the number of pixels."
             }
         }
         return help
@@ -1077,68 +1101,43 @@ class Sorting(Effect):
         definition['parameters']['sortby'] = [self.sortby] + [x for x in sortby if x != self.sortby]
         definition['parameters']['reversed'] = self.reversed
         definition['parameters']['looping'] = self.looping
+        definition['parameters']['duration'][0] = self.duration
         return definition
 
     def disorder(self):
-        self._output = np.ones(self._num_pixels) * np.array([[1.0], [1.0], [1.0]])
-        for i in range(self._num_pixels):
-            for j in range(len(self._output)):
-                self._output[j][i] = random.randint(0.0, 255.0)
+        self._output = np.random.randint(0, 256, size=(3, self._num_pixels)).astype(float)
         return self._output
 
-    def bubble(self, inputArray, sortby, reversed, looping):
-        if sortby == 'red':
-            sortindex = 0
-        elif sortby == 'green':
-            sortindex = 1
-        elif sortby == 'blue':
-            sortindex = 2
-        elif sortby == 'brightness':
-            sortindex = 3
+    def _startSorting(self):
+        # target position of every pixel
+        if self.sortby == 'red':
+            key = self._output[0]
+        elif self.sortby == 'green':
+            key = self._output[1]
+        elif self.sortby == 'blue':
+            key = self._output[2]
+        elif self.sortby == 'brightness':
+            key = np.sum(self._output, axis=0)
         else:
             raise NotImplementedError("Sorting not implemented.")
-
-        if reversed:
-            flip_index = -1
-        else:
-            flip_index = 1
-
-        for passnum in range(len(inputArray[0]) - 1, 0, -1):
-            check = 0
-            for i in range(passnum):
-                if sortindex == 0 or sortindex == 1 or sortindex == 2:  # sorting by color
-                    if inputArray[sortindex][i] > inputArray[sortindex][i + 1 * flip_index]:
-                        temp = np.array([[1.0], [1.0], [1.0]])
-                        for j in range(len(inputArray)):
-                            temp[j] = inputArray[j][i]
-                            inputArray[j][i] = inputArray[j][i + 1 * flip_index]
-                            inputArray[j][i + 1 * flip_index] = temp[j]
-                    else:
-                        check += 1
-                        if check == passnum:
-                            if looping is True:
-                                self.sortby = random.choice(['red', 'green', 'blue', 'brightness'])
-                                self.reversed = random.choice([True, False])
-                            else:
-                                self._sorting_done = True
-
-                elif sortindex == 3:  # sorting by brightness
-                    tempArray = np.sum(inputArray, axis=0)
-                    if tempArray[i] > tempArray[i + 1 * flip_index]:
-                        temp = np.array([[1.0], [1.0], [1.0]])
-                        for j in range(len(inputArray)):
-                            temp[j] = inputArray[j][i]
-                            inputArray[j][i] = inputArray[j][i + 1 * flip_index]
-                            inputArray[j][i + 1 * flip_index] = temp[j]
-                    else:
-                        check += 1
-                        if check == passnum:
-                            if looping is True:
-                                self.sortby = random.choice(['red', 'green', 'blue', 'brightness'])
-                                self.reversed = random.choice([True, False])
-                            else:
-                                self._sorting_done = True
-            return inputArray
+        order = np.argsort(key, kind='stable')
+        if self.reversed:
+            order = order[::-1]
+        self._ranks = np.empty(len(order), dtype=np.int64)
+        self._ranks[order] = np.arange(len(order))
+        self._order = np.arange(len(order))
+        self._round = 0
+        self._sortTime = 0.0
+
+    def _sortRounds(self, numRounds):
+        n = len(self._ranks)
+        for r in range(self._round, self._round + numRounds):
+            left = np.arange(r % 2, n - 1, 2)
+            left = left[self._ranks[left] > self._ranks[left + 1]]
+            right = left + 1
+            self._ranks[left], self._ranks[right] = self._ranks[right], self._ranks[left]
+            self._order[left], self._order[right] = self._order[right], self._order[left]
+        self._round += numRounds
 
     def numInputChannels(self):
         return 0
@@ -1151,6 +1150,8 @@ class Sorting(Effect):
         if self._output is None or np.size(self._output, 1) != self._num_pixels:
             self._output = self.disorder()
             self._sorting_done = False
+            self._ranks = None
+        self._sortTime += dt
 
     def process(self):
         if self._inputBuffer is None or self._outputBuffer is None:
@@ -1159,9 +1160,27 @@ class Sorting(Effect):
         if self._sorting_done is True:
             self._output = self.disorder()
             self._sorting_done = False
-
-        self._output = self.bubble(self._output, self.sortby, self.reversed, self.looping)
-        self._outputBuffer[0] = self._output.clip(0.0, 255.0)
+            self._ranks = None
+        if self._ranks is None:
+            self._startSorting()
+
+        # odd-even transposition sort is done after n rounds
+        n = len(self._ranks)
+        targetRound = min(n, int(np.ceil(n * self._sortTime / max(self.duration, 1e-3))))
+        if targetRound > self._round:
+            self._sortRounds(targetRound - self._round)
+        output = np.take(self._output, self._order, axis=1)
+
+        if self._round >= n or np.all(self._ranks[:-1] < self._ranks[1:]):
+            # sorted
+            self._output = output
+            self._ranks = None
+            if self.looping is True:
+                self.sortby = random.choice(['red', 'green', 'blue', 'brightness'])
+                self.reversed = random.choice([True, False])
+            else:
+                self._sorting_done = True
+        self._outputBuffer[0] = output.clip(0.0, 255.0)
 
 
 class GIFPlayer(Effect):
@@ -1236,11 +1255,17 @@ class GIFPlayer(Effect):
             return
         if self._filterGraph is not None and self._filterGraph._project is not None and self._filterGraph._project._contentRoot is not None:
             adjustedFile = os.path.join(self._filterGraph._project._contentRoot, self.file)
+        self.close()
         try:
             self._gif = Image.open(adjustedFile)
         except Exception:
             print("Cannot open file {}".format(adjustedFile))
 
+    def close(self):
+        if self._gif is not None:
+            self._gif.close()
+            self._gif = None
+
     async def update(self, dt):
         await super().update(dt)
         if self._t - self._last_t > 1.0 / self.fps:
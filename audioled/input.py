@@ -4,6 +4,11 @@ from audioled import effect, opc_server
 
 
 class CandyServer(effect.Effect):
+    @staticmethod
+    def getEffectDescription():
+        return \
+            "CandyServer receives pixels from an Open Pixel Control client."
+
     def __init__(self, num_pixels=300, host='', port=7891):
         self.num_pixels = num_pixels
         self.host = host
@@ -32,6 +37,16 @@ class CandyServer(effect.Effect):
         }
         return definition
 
+    @staticmethod
+    def getParameterHelp():
+        help = {
+            "parameters": {
+                "num_pixels": "Number of pixels to receive.",
+                "port": "Port the Open Pixel Control server listens on."
+            }
+        }
+        return help
+
     def getParameter(self):
         definition = self.getParameterDefinition()
         definition['parameters']['num_pixels'][0] = self.num_pixels
@@ -43,3 +58,7 @@ class CandyServer(effect.Effect):
             return
         pixels = self._server.get_pixels()
         self._outputBuffer[0] = pixels
+
+    def close(self):
+        # stop listening, the port is opened again when the effect is restored
+        self._server.stop()
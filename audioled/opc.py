@@ -27,6 +27,8 @@ Recommended use:
 
 import socket
 
+import numpy as np
+
 
 class Client(object):
     def __init__(self, server_ip_port, long_connection=True, verbose=False):
@@ -55,6 +57,11 @@ class Client(object):
 
         self._socket = None  # will be None when we're not connected
 
+        # preallocated message for put_pixels_array
+        self._message = None
+        self._message_pixels = None
+        self._message_scratch = None
+
     def _debug(self, m):
         if self.verbose:
             print('    %s' % str(m))
@@ -114,12 +121,6 @@ class Client(object):
         with the first LED.  It's not possible to send a color just to one
         LED at a time (unless it's the first one).
         """
-        self._debug('put_pixels: connecting')
-        is_connected = self._ensure_connected()
-        if not is_connected:
-            self._debug('put_pixels: not connected.  ignoring these pixels.')
-            return False
-
         # build OPC message
         len_hi_byte = int(len(pixels) * 3 / 256)
         len_lo_byte = (len(pixels) * 3) % 256
@@ -136,6 +137,37 @@ class Client(object):
         else:
             message = bytes(map(ord, ''.join(pieces)))
 
+        return self._send_message(message)
+
+    def put_pixels_array(self, pixels, channel=0):
+        """Send a numpy array of pixel colors to the OPC server on the given channel.
+        pixels: Array of shape (3, num_pixels) holding the r, g, b rows.
+            Values are clamped to 0-255 and rounded down to integers.
+        The message buffer is allocated once and reused for every frame
+        with the same number of pixels and channel.
+        Return value is the same as for put_pixels.
+        """
+        num_pixels = pixels.shape[1]
+        if self._message is None or len(self._message) != 4 + 3 * num_pixels or self._message[0] != channel:
+            self._message = bytearray(4 + 3 * num_pixels)
+            self._message[0] = channel
+            self._message[1] = 0
+            self._message[2] = int(num_pixels * 3 / 256)
+            self._message[3] = (num_pixels * 3) % 256
+            # view on the pixel data, one row per pixel
+            self._message_pixels = np.frombuffer(self._message, dtype=np.uint8, offset=4).reshape(num_pixels, 3)
+            self._message_scratch = np.zeros((num_pixels, 3))
+        np.clip(pixels.T, 0, 255, out=self._message_scratch)
+        self._message_pixels[...] = self._message_scratch
+        return self._send_message(self._message)
+
+    def _send_message(self, message):
+        self._debug('put_pixels: connecting')
+        is_connected = self._ensure_connected()
+        if not is_connected:
+            self._debug('put_pixels: not connected.  ignoring these pixels.')
+            return False
+
         self._debug('put_pixels: sending pixels to server')
         try:
             self._socket.sendall(message)
@@ -287,7 +287,9 @@ class Server(object):
             self.all_threads.remove(self._thread)
 
     def stop(self):
-        self._stopThread()
+        if self._thread is not None:
+            self._stopThread()
+            self._thread = None
 
     def _clean_threads(self):
         toCleanup = []
@@ -1,6 +1,9 @@
 from audioled.effect import Effect
 from collections import OrderedDict
+from functools import lru_cache
 import numpy as np
+import os
+import threading
 
 
 class MakeSquare(Effect):
@@ -75,7 +78,7 @@ class MakeSquare(Effect):
 
     async def update(self, dt):
         await super().update(dt)
-        if self._mapMask is None or np.size(self._mapMask, 1) != self._num_pixels:
+        if self._mapMask is None or np.size(self._mapMask) != self._num_pixels:
             self._mapMask = self._genMapMask(self._num_pixels, self._num_rows, self.displacement,
                                              self.input_displacement)
 
@@ -85,37 +88,30 @@ class MakeSquare(Effect):
         if not self._inputBufferValid(0):
             self._outputBuffer[0] = None
             return
-        buffer = np.tile(self._inputBuffer[0], np.size(self._inputBuffer[0], axis=1))
-        self._outputBuffer[0] = buffer[self._mapMask[:, :, 0], self._mapMask[:, :, 1]]
+        # indices wrap around if the input is shorter than expected
+        self._outputBuffer[0] = np.take(self._inputBuffer[0], self._mapMask, axis=1, mode='wrap')
+
+    def getGatherMap(self, num_pixels):
+        return self._mapMask
 
     def _genMapMask(self, num_pixels, num_rows, displacement, input_displacement):
+        """Returns the input column for every output pixel as 1d array"""
         num_cols = int(num_pixels / num_rows)
         print("Generating map mask for {}x{} pixels".format(num_cols, num_rows))
         dp = int(displacement * num_cols)
-        mapMask = np.array([[[0, self._indexFor(i, j + dp, num_rows, num_cols, input_displacement)]
-                             for i, j in np.ndindex(num_rows, num_cols)],
-                            [[1, self._indexFor(i, j + dp, num_rows, num_cols, input_displacement)]
-                             for i, j in np.ndindex(num_rows, num_cols)],
-                            [[2, self._indexFor(i, j + dp, num_rows, num_cols, input_displacement)]
-                             for i, j in np.ndindex(num_rows, num_cols)]],
-                           dtype=np.int64)
-        return mapMask
+        rows, cols = np.indices((num_rows, num_cols))
+        mapMask = self._indexFor(rows, cols + dp, num_rows, num_cols, input_displacement)
+        return np.ravel(mapMask).astype(np.int32)
 
     def _indexFor(self, row, col, num_rows, num_cols, input_displacement=0.5):
-        adjusted_row = row
-        adjusted_col = col
+        """Returns the input column for the given rows and cols (numpy arrays)"""
+        adjusted_row, adjusted_col = _mirror(row, col, num_rows, num_cols)
         dp = int(input_displacement * num_cols)
-        # Mirror row at the center
-        if row >= num_rows / 2:
-            adjusted_row = num_rows - 1 - row
-        # Mirror col at the center
-        if col >= num_cols / 2:
-            adjusted_col = num_cols - 1 - col
 
-        row_offset = int(abs(num_rows / 2 - adjusted_row + 1))
-        col_offset = int(abs(num_cols / 2 - adjusted_col + 1))
-        index = min(max(0, int(max(num_rows, num_cols) / 2) - max(row_offset, col_offset) + dp), num_cols - 1)
-        return index
+        row_offset = np.abs(num_rows / 2 - adjusted_row + 1).astype(np.int64)
+        col_offset = np.abs(num_cols / 2 - adjusted_col + 1).astype(np.int64)
+        index = int(max(num_rows, num_cols) / 2) - np.maximum(row_offset, col_offset) + dp
+        return np.clip(index, 0, num_cols - 1)
 
 
 class MakeBatman(MakeSquare):
@@ -126,21 +122,14 @@ class MakeBatman(MakeSquare):
             "Effect that converts the pixel input into a batman sign shaped pattern if displayed on a panel."
 
     def _indexFor(self, row, col, num_rows, num_cols, input_displacement=0.5):
-        adjusted_row = row
-        adjusted_col = col
+        adjusted_row, adjusted_col = _mirror(row, col, num_rows, num_cols)
         dp = int(input_displacement * num_cols)
-        # Mirror row at the center
-        if row >= num_rows / 2:
-            adjusted_row = num_rows - 1 - row
-        # Mirror col at the center
-        if col >= num_cols / 2:
-            adjusted_col = num_cols - 1 - col
 
-        row_offset = int(abs(num_rows / 2 - adjusted_row - 1))
-        col_offset = int(abs(num_cols / 2 - adjusted_col - 1))
-        offset = min(row_offset, col_offset)
-        index = min(max(0, min(adjusted_col - offset, adjusted_row - offset) + dp), num_cols - 1)
-        return index
+        row_offset = np.abs(num_rows / 2 - adjusted_row - 1).astype(np.int64)
+        col_offset = np.abs(num_cols / 2 - adjusted_col - 1).astype(np.int64)
+        offset = np.minimum(row_offset, col_offset)
+        index = np.minimum(adjusted_col - offset, adjusted_row - offset) + dp
+        return np.clip(index, 0, num_cols - 1)
 
 
 class MakeRuby(MakeSquare):
@@ -151,21 +140,14 @@ class MakeRuby(MakeSquare):
             "Effect that converts the pixel input into a ruby shaped pattern if displayed on a panel."
 
     def _indexFor(self, row, col, num_rows, num_cols, input_displacement=0.5):
-        adjusted_row = row
-        adjusted_col = col
+        adjusted_row, adjusted_col = _mirror(row, col, num_rows, num_cols)
         dp = int(input_displacement * num_cols)
-        # Mirror row at the center
-        if row >= num_rows / 2:
-            adjusted_row = num_rows - 1 - row
-        # Mirror col at the center
-        if col >= num_cols / 2:
-            adjusted_col = num_cols - 1 - col
 
-        row_offset = int(abs(num_rows / 2 - adjusted_row - 1))
-        col_offset = int(abs(num_cols / 2 - adjusted_col - 1))
-        offset = max(row_offset, col_offset)
-        index = min(max(0, min(adjusted_col - offset, adjusted_row - offset) + dp), num_cols - 1)
-        return index
+        row_offset = np.abs(num_rows / 2 - adjusted_row - 1).astype(np.int64)
+        col_offset = np.abs(num_cols / 2 - adjusted_col - 1).astype(np.int64)
+        offset = np.maximum(row_offset, col_offset)
+        index = np.minimum(adjusted_col - offset, adjusted_row - offset) + dp
+        return np.clip(index, 0, num_cols - 1)
 
 
 class MakeDiamond(MakeSquare):
@@ -189,20 +171,20 @@ class MakeDiamond(MakeSquare):
             "Effect that converts the pixel input into a diamond shaped pattern if displayed on a panel."
 
     def _indexFor(self, row, col, num_rows, num_cols, input_displacement=0.5):
-        adjusted_row = row
-        adjusted_col = col
+        adjusted_row, adjusted_col = _mirror(row, col, num_rows, num_cols)
         dp = int(input_displacement * num_cols)
-        # Mirror row at the center
-        if row >= num_rows / 2:
-            adjusted_row = num_rows - 1 - row
-        # Mirror col at the center
-        if col >= num_cols / 2:
-            adjusted_col = num_cols - 1 - col
 
         # Apply row offset, so that index is decreased for each row more away from the center
-        row_offset = int(abs(num_rows / 2 - adjusted_row - 1))
-        index = min(max(0, adjusted_col - row_offset + dp), num_cols - 1)
-        return index
+        row_offset = np.abs(num_rows / 2 - adjusted_row - 1).astype(np.int64)
+        index = adjusted_col - row_offset + dp
+        return np.clip(index, 0, num_cols - 1)
+
+
+def _mirror(row, col, num_rows, num_cols):
+    # Mirror rows and cols at the center
+    adjusted_row = np.where(row >= num_rows / 2, num_rows - 1 - row, row)
+    adjusted_col = np.where(col >= num_cols / 2, num_cols - 1 - col, col)
+    return adjusted_row, adjusted_col
 
 
 def toIdx(row, col, num_cols):
@@ -221,9 +203,9 @@ def move(row, col, direction):
 
 
 def next_dir_possible(cur_dir, cur_row, cur_col, visited, pref_dir, allowed_row_range):
+    rows = np.size(visited, axis=0)
+    cols = np.size(visited, axis=1)
     for i in range(0, len(pref_dir)):
-        rows = np.size(visited, axis=0)
-        cols = np.size(visited, axis=1)
         r, c = move(cur_row, cur_col, pref_dir[i])
         # check out of bounds
         if r < 0 or c < 0 or r >= rows or c >= cols:
@@ -236,7 +218,6 @@ def next_dir_possible(cur_dir, cur_row, cur_col, visited, pref_dir, allowed_row_
         if r < allowed_row_range[0] or r > allowed_row_range[1]:
             continue
         # found new direction
-        print("next dir: {}, preference {}".format(pref_dir[i], i))
         return pref_dir[i]
     raise RuntimeError("Cannot determine new direction!")
 
@@ -255,6 +236,9 @@ def next_dir(cur_dir, cur_row, cur_col, visited, pref_dir, allowed_row_range):
 
 class MakeLabyrinth(Effect):
 
+    # Directory to persist generated masks, None keeps masks in memory only
+    maskCacheDirectory = None
+
     @staticmethod
     def getEffectDescription():
         return \
@@ -276,7 +260,7 @@ class MakeLabyrinth(Effect):
 
     async def update(self, dt):
         await super().update(dt)
-        if self._mapMask is None or np.size(self._mapMask, 1) != self._num_pixels:
+        if self._mapMask is None or np.size(self._mapMask) != self._num_pixels:
             self._mapMask = self._genMapMask(self._num_pixels, self._num_rows)
 
     def process(self):
@@ -285,88 +269,146 @@ class MakeLabyrinth(Effect):
         if not self._inputBufferValid(0):
             self._outputBuffer[0] = None
             return
-        buffer = self._inputBuffer[0]
-        self._outputBuffer[0] = buffer[self._mapMask[:, :, 0], self._mapMask[:, :, 1]]
+        self._outputBuffer[0] = np.take(self._inputBuffer[0], self._mapMask, axis=1)
+
+    def getGatherMap(self, num_pixels):
+        return self._mapMask
 
     def _genMapMask(self, num_pixels, num_rows):
+        return getLabyrinthMask(num_pixels, num_rows, self.maskCacheDirectory)
+
+
+# Labyrinth masks by (num_pixels, num_rows), shared between instances
+_labyrinthMasks = {}
+_labyrinthMasksLock = threading.Lock()
+
+
+def getLabyrinthMask(num_pixels, num_rows, cacheDirectory=None):
+    """Returns the (read-only) labyrinth mask for the panel geometry
+
+    Masks are generated once per geometry and kept in memory. If cacheDirectory is given,
+    masks are also read from and written to this directory.
+    """
+    key = (num_pixels, num_rows)
+    with _labyrinthMasksLock:
+        mapMask = _labyrinthMasks.get(key)
+        if mapMask is not None:
+            return mapMask
+        mapMask = _readLabyrinthMask(num_pixels, num_rows, cacheDirectory)
+        if mapMask is None:
+            print("Generating labyrinth mask for {} pixels on {} rows".format(num_pixels, num_rows))
+            mapMask = _genLabyrinthMask(num_pixels, num_rows)
+            _writeLabyrinthMask(mapMask, num_pixels, num_rows, cacheDirectory)
+        mapMask.setflags(write=False)
+        _labyrinthMasks[key] = mapMask
+        return mapMask
 
-        num_cols = int(num_pixels / num_rows)
-        mapMask = np.zeros((3, num_pixels, 2))
-        visited = np.zeros((num_rows, num_cols), dtype=np.int64)  # array holding information if pixel was visited
-        cur_idx_u = int(num_pixels / 2)  # current index counter upper half
-        cur_idx_l = int(num_pixels / 2)  # current index counter lower half
-        cur_row_u = int(num_rows / 2) - 1
-        cur_col_u = int(num_cols / 2)
-        cur_row_l = int(num_rows / 2)
-        cur_col_l = int(num_cols / 2) - 1
-        # visit first pixels
-        for i in range(0, 1):
-            mapMask[0, toIdx(cur_row_u, cur_col_u, num_cols), :] = [0, cur_idx_u]
-            mapMask[1, toIdx(cur_row_u, cur_col_u, num_cols), :] = [1, cur_idx_u]
-            mapMask[2, toIdx(cur_row_u, cur_col_u, num_cols), :] = [2, cur_idx_u]
-            visited[cur_row_u, cur_col_u] = 1
-            cur_idx_u -= 1
-            cur_col_u -= 1
-        for i in range(0, 1):
-            mapMask[0, toIdx(cur_row_l, cur_col_l, num_cols), :] = [0, cur_idx_l]
-            mapMask[1, toIdx(cur_row_l, cur_col_l, num_cols), :] = [1, cur_idx_l]
-            mapMask[2, toIdx(cur_row_l, cur_col_l, num_cols), :] = [2, cur_idx_l]
-            visited[cur_row_l, cur_col_l] = 1
-            cur_idx_l += 1
-            cur_col_l += 1
-        dir_u = 'u'
-        dir_l = 'd'
-        last_hor_u = 'l'
-        last_hor_l = 'r'
-        allowed_range_u = [0, int(num_rows / 2) - 1]
-        allowed_range_l = [int(num_rows / 2), num_rows - 1]
-        for p in range(0, int(num_pixels / 2) - 2):
-            # adjust indices
-            cur_idx_u = int(cur_idx_u - 1)
-            cur_idx_l = int(cur_idx_l + 1)
-            # move
-            cur_row_u, cur_col_u = move(cur_row_u, cur_col_u, dir_u)
-            cur_row_l, cur_col_l = move(cur_row_l, cur_col_l, dir_l)
-            # set new value
-            mapMask[0, toIdx(cur_row_u, cur_col_u, num_cols), :] = [0, cur_idx_u]
-            mapMask[1, toIdx(cur_row_u, cur_col_u, num_cols), :] = [1, cur_idx_u]
-            mapMask[2, toIdx(cur_row_u, cur_col_u, num_cols), :] = [2, cur_idx_u]
-            visited[cur_row_u, cur_col_u] = 1
-            mapMask[0, toIdx(cur_row_l, cur_col_l, num_cols), :] = [0, cur_idx_l]
-            mapMask[1, toIdx(cur_row_l, cur_col_l, num_cols), :] = [1, cur_idx_l]
-            mapMask[2, toIdx(cur_row_l, cur_col_l, num_cols), :] = [2, cur_idx_l]
-            visited[cur_row_l, cur_col_l] = 1
-            # determine new direction upper
-            try:
-                cur_dir = dir_u
-                if last_hor_u == 'l':
-                    dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'r', 'u', 'l'], allowed_range_u)
-                elif last_hor_u == 'r':
-                    dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'l', 'u', 'r'], allowed_range_u)
-                else:
-                    dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'r', 'l', 'u'], allowed_range_u)
-                if dir_u == 'd' and (cur_dir == 'l' or cur_dir == 'r'):
-                    last_hor_u = cur_dir
-            except RuntimeError:
-                # reset allowed range
-                allowed_range_u = [0, num_rows]
-
-            # determine new direction lower
-            try:
-                cur_dir = dir_l
-                if last_hor_l == 'l':
-                    dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'r', 'd', 'l'], allowed_range_l)
-                elif last_hor_l == 'r':
-                    dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'l', 'd', 'r'], allowed_range_l)
-                else:
-                    dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'l', 'r', 'd'], allowed_range_l)
-                if dir_l == 'u' and (cur_dir == 'l' or cur_dir == 'r'):
-                    last_hor_l = cur_dir
-            except RuntimeError:
-                # reset allowed range
-                allowed_range_l = [0, num_rows]
-
-        return mapMask.astype(np.int64)
+
+def _labyrinthMaskFile(num_pixels, num_rows, cacheDirectory):
+    return os.path.join(cacheDirectory, "labyrinth_{}_{}.npy".format(num_pixels, num_rows))
+
+
+def _readLabyrinthMask(num_pixels, num_rows, cacheDirectory):
+    if cacheDirectory is None:
+        return None
+    filename = _labyrinthMaskFile(num_pixels, num_rows, cacheDirectory)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        mapMask = np.load(filename)
+    except (IOError, ValueError) as e:
+        print("Cannot read labyrinth mask {}: {}".format(filename, e))
+        return None
+    if mapMask.shape != (num_pixels, ) or mapMask.dtype != np.int32:
+        return None
+    return mapMask
+
+
+def _writeLabyrinthMask(mapMask, num_pixels, num_rows, cacheDirectory):
+    if cacheDirectory is None:
+        return
+    filename = _labyrinthMaskFile(num_pixels, num_rows, cacheDirectory)
+    try:
+        os.makedirs(cacheDirectory, exist_ok=True)
+        tmpFile = filename + ".tmp"
+        with open(tmpFile, "wb") as f:
+            np.save(f, mapMask)
+        os.replace(tmpFile, filename)
+    except OSError as e:
+        print("Cannot write labyrinth mask {}: {}".format(filename, e))
+
+
+def _genLabyrinthMask(num_pixels, num_rows):
+    """Walks the labyrinth from the center and returns the input index for every output pixel"""
+    num_cols = int(num_pixels / num_rows)
+    mapMask = np.zeros(num_pixels, dtype=np.int32)
+    visited = np.zeros((num_rows, num_cols), dtype=np.int64)  # array holding information if pixel was visited
+    cur_idx_u = int(num_pixels / 2)  # current index counter upper half
+    cur_idx_l = int(num_pixels / 2)  # current index counter lower half
+    cur_row_u = int(num_rows / 2) - 1
+    cur_col_u = int(num_cols / 2)
+    cur_row_l = int(num_rows / 2)
+    cur_col_l = int(num_cols / 2) - 1
+    # visit first pixels
+    for i in range(0, 1):
+        mapMask[toIdx(cur_row_u, cur_col_u, num_cols)] = cur_idx_u
+        visited[cur_row_u, cur_col_u] = 1
+        cur_idx_u -= 1
+        cur_col_u -= 1
+    for i in range(0, 1):
+        mapMask[toIdx(cur_row_l, cur_col_l, num_cols)] = cur_idx_l
+        visited[cur_row_l, cur_col_l] = 1
+        cur_idx_l += 1
+        cur_col_l += 1
+    dir_u = 'u'
+    dir_l = 'd'
+    last_hor_u = 'l'
+    last_hor_l = 'r'
+    allowed_range_u = [0, int(num_rows / 2) - 1]
+    allowed_range_l = [int(num_rows / 2), num_rows - 1]
+    for p in range(0, int(num_pixels / 2) - 2):
+        # adjust indices
+        cur_idx_u = int(cur_idx_u - 1)
+        cur_idx_l = int(cur_idx_l + 1)
+        # move
+        cur_row_u, cur_col_u = move(cur_row_u, cur_col_u, dir_u)
+        cur_row_l, cur_col_l = move(cur_row_l, cur_col_l, dir_l)
+        # set new value
+        mapMask[toIdx(cur_row_u, cur_col_u, num_cols)] = cur_idx_u
+        visited[cur_row_u, cur_col_u] = 1
+        mapMask[toIdx(cur_row_l, cur_col_l, num_cols)] = cur_idx_l
+        visited[cur_row_l, cur_col_l] = 1
+        # determine new direction upper
+        try:
+            cur_dir = dir_u
+            if last_hor_u == 'l':
+                dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'r', 'u', 'l'], allowed_range_u)
+            elif last_hor_u == 'r':
+                dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'l', 'u', 'r'], allowed_range_u)
+            else:
+                dir_u = next_dir(dir_u, cur_row_u, cur_col_u, visited, ['d', 'r', 'l', 'u'], allowed_range_u)
+            if dir_u == 'd' and (cur_dir == 'l' or cur_dir == 'r'):
+                last_hor_u = cur_dir
+        except RuntimeError:
+            # reset allowed range
+            allowed_range_u = [0, num_rows]
+
+        # determine new direction lower
+        try:
+            cur_dir = dir_l
+            if last_hor_l == 'l':
+                dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'r', 'd', 'l'], allowed_range_l)
+            elif last_hor_l == 'r':
+                dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'l', 'd', 'r'], allowed_range_l)
+            else:
+                dir_l = next_dir(dir_l, cur_row_l, cur_col_l, visited, ['u', 'l', 'r', 'd'], allowed_range_l)
+            if dir_l == 'u' and (cur_dir == 'l' or cur_dir == 'r'):
+                last_hor_l = cur_dir
+        except RuntimeError:
+            # reset allowed range
+            allowed_range_l = [0, num_rows]
+
+    return mapMask
 
 
 class FlipRows(Effect):
@@ -421,27 +463,33 @@ class FlipRows(Effect):
 
     async def update(self, dt):
         await super().update(dt)
-    
+
     def process(self):
         if self._inputBuffer is None or self._outputBuffer is None:
             return
         if not self._inputBufferValid(0):
             self._outputBuffer[0] = None
             return
-        buffer = self._inputBuffer[0]
-
-        cols = int(self._num_pixels / self._num_rows)
-        for row in range(self._num_rows - 1):
-            if row % 2 == 0:
-                if self.flip_even_rows:
-                    buffer[:, row * cols:(row + 1) * cols] = self._inputBuffer[0][:, row * cols:(row + 1) * cols][:, ::-1]
-                else:
-                    buffer[:, row * cols:(row + 1) * cols] = self._inputBuffer[0][:, row * cols:(row + 1) * cols]
-            else:
-                if self.flip_odd_rows:
-                    buffer[:, row * cols:(row + 1) * cols] = self._inputBuffer[0][:, row * cols:(row + 1) * cols][:, ::-1]
-                else:
-                    buffer[:, row * cols:(row + 1) * cols] = self._inputBuffer[0][:, row * cols:(row + 1) * cols]
-        
-        self._outputBuffer[0] = buffer
-
+        # write into own buffer, the input belongs to the previous node
+        buffer = self._inputBuffer[0].astype(float, copy=False)
+        permutation = self.getGatherMap(np.size(buffer, 1))
+        self._outputBuffer[0] = np.take(buffer, permutation, axis=1, mode='clip', out=self._getOutBuffer())
+
+    def getGatherMap(self, num_pixels):
+        if self._num_pixels is None:
+            return None
+        return flipRowsPermutation(self._num_pixels, self._num_rows, self.flip_odd_rows, self.flip_even_rows)
+
+
+@lru_cache(maxsize=16)
+def flipRowsPermutation(num_pixels, num_rows, flip_odd_rows, flip_even_rows):
+    """Returns the (read-only) pixel index for every output pixel with flipped rows"""
+    num_cols = int(num_pixels / num_rows)
+    permutation = np.arange(num_pixels, dtype=np.int32)
+    rows = permutation[:num_rows * num_cols].reshape(num_rows, num_cols)
+    flip = np.zeros(num_rows, dtype=bool)
+    flip[0::2] = flip_even_rows
+    flip[1::2] = flip_odd_rows
+    rows[flip] = rows[flip, ::-1]
+    permutation.setflags(write=False)
+    return permutation
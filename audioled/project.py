@@ -1,9 +1,37 @@
 import asyncio
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import jsonpickle
 
 from audioled.filtergraph import (FilterGraph, Updateable)
 
+# worker to prepare slots in the background
+_prewarmExecutor = None
+
+
+def _getPrewarmExecutor():
+    global _prewarmExecutor
+    if _prewarmExecutor is None:
+        _prewarmExecutor = ThreadPoolExecutor(max_workers=1)
+    return _prewarmExecutor
+
 
 class Project(Updateable):
+    """Project with up to 127 slots of FilterGraphs
+
+    Slots are kept serialized until they are used. Only the maxLiveSlots recently used
+    slots are kept as FilterGraph, other slots are serialized and released.
+
+    Slots can be prepared on a worker thread (prewarmSlot), the active slot is switched
+    between two frames.
+    """
+
+    # Maximum number of slots kept as FilterGraph
+    maxLiveSlots = 8
+
     def __init__(self, name='Empty project', description='', device=None):
         self.slots = [None for i in range(127)]
         self.activeSlotId = 0
@@ -12,6 +40,36 @@ class Project(Updateable):
         self.id = None
         self._device = device
         self._contentRoot = None
+        self.__initstate__()
+
+    def __initstate__(self):
+        try:
+            self._slotData
+        except AttributeError:
+            self._slotData = {}
+        try:
+            self._liveSlots
+        except AttributeError:
+            self._liveSlots = OrderedDict()
+        try:
+            self._slotLock
+        except AttributeError:
+            self._slotLock = threading.RLock()
+        try:
+            self._releasingSlots
+        except AttributeError:
+            # slots that are released but not yet serialized
+            self._releasingSlots = {}
+        try:
+            self._device
+        except AttributeError:
+            self._device = None
+        try:
+            self._contentRoot
+        except AttributeError:
+            self._contentRoot = None
+        # slot of the current frame, updated at the beginning of every frame
+        self._frameSlotId = None
 
     def __cleanState__(self, stateDict):
         """
@@ -32,9 +90,11 @@ class Project(Updateable):
 
     def __setstate__(self, state):
         self.__dict__.update(state)
-        for slot in self.slots:
+        self.__initstate__()
+        for slotId, slot in enumerate(self.slots):
             if slot is not None:
                 slot._project = self
+                self._liveSlots[slotId] = True
 
 
     def setDevice(self, device):
@@ -42,11 +102,13 @@ class Project(Updateable):
 
     def update(self, dt, event_loop=asyncio.get_event_loop()):
         """Update active FilterGraph
-        
+
         Arguments:
             dt {[float]} -- Time since last update
         """
-        activeFilterGraph = self.getSlot(self.activeSlotId)
+        # switch slots only between frames
+        self._frameSlotId = self.activeSlotId
+        activeFilterGraph = self.getSlot(self._frameSlotId)
         if activeFilterGraph is not None:
             # Propagate num pixels from server configuration
             if self._device is not None and activeFilterGraph.getLEDOutput() is not None:
@@ -59,7 +121,7 @@ class Project(Updateable):
     def process(self):
         """Process active FilterGraph
         """
-        activeFilterGraph = self.getSlot(self.activeSlotId)
+        activeFilterGraph = self.getSlot(self.activeSlotId if self._frameSlotId is None else self._frameSlotId)
         if activeFilterGraph is not None:
             if self._device is not None and activeFilterGraph.getLEDOutput() is not None:
                 activeFilterGraph.process()
@@ -69,15 +131,210 @@ class Project(Updateable):
     def setFiltergraphForSlot(self, slotId, filterGraph):
         print("Set {} for slot {}".format(filterGraph, slotId))
         if isinstance(filterGraph, FilterGraph):
-            filterGraph._project = self
-            self.slots[slotId] = filterGraph
+            with self._slotLock:
+                filterGraph._project = self
+                self.slots[slotId] = filterGraph
+                self._slotData.pop(slotId, None)
+                self._releasingSlots.pop(slotId, None)
+                released = self._useSlot(slotId)
+            self._releaseSlots(released)
 
     def activateSlot(self, slotId):
         self.activeSlotId = slotId
-        print("Activate slot {} with {}".format(slotId, self.slots[slotId]))
-        return self.getSlot(slotId)
+        filterGraph = self.getSlot(slotId)
+        print("Activate slot {} with {}".format(slotId, filterGraph))
+        return filterGraph
+
+    def prewarmSlot(self, slotId, filterGraph=None):
+        """Prepares a slot on a worker thread
+
+        The slot is restored, the number of pixels is propagated and the FilterGraph is
+        updated and processed once, so the first frame after activation is not delayed.
+        Slots that are active or already in use are not touched.
+
+        Arguments:
+            slotId {int} -- Slot to prepare
+
+        Keyword Arguments:
+            filterGraph {FilterGraph} -- FilterGraph to set for the slot (default: {None}, use the slot's FilterGraph)
+
+        Returns:
+            concurrent.futures.Future -- Future with the prepared FilterGraph
+        """
+        future = _getPrewarmExecutor().submit(self._prewarmSlot, slotId, filterGraph)
+        future.add_done_callback(_logPrewarmError)
+        return future
+
+    def activateSlotWhenReady(self, slotId, filterGraph=None):
+        """Prepares the slot on a worker thread and activates it afterwards
+
+        Returns:
+            concurrent.futures.Future -- Future with the activated FilterGraph
+        """
+        future = _getPrewarmExecutor().submit(self._prewarmAndActivateSlot, slotId, filterGraph)
+        future.add_done_callback(_logPrewarmError)
+        return future
+
+    def _prewarmAndActivateSlot(self, slotId, filterGraph):
+        # errors are raised by the future, the active slot stays unchanged in this case
+        filterGraph = self._prewarmSlot(slotId, filterGraph)
+        with self._slotLock:
+            self.activeSlotId = slotId
+        print("Activate slot {}".format(slotId))
+        return filterGraph
+
+    def _prewarmSlot(self, slotId, filterGraph):
+        restored = filterGraph is None
+        if restored:
+            with self._slotLock:
+                inUse = (slotId == self.activeSlotId or self.slots[slotId] is not None
+                         or slotId in self._releasingSlots)
+                data = self._slotData.get(slotId)
+            if inUse:
+                # the render thread may be using the graph, it doesn't need to be prepared anyway
+                return self.getSlot(slotId)
+            # restore outside the lock, so the active slot isn't blocked
+            filterGraph = jsonpickle.unpickler.Unpickler().restore(data) if data is not None else FilterGraph()
+        filterGraph._project = self
+        device = self._device
+        if device is not None and filterGraph.getLEDOutput() is not None:
+            filterGraph.propagateNumPixels(device.getNumPixels(), device.getNumRows())
+            event_loop = asyncio.new_event_loop()
+            try:
+                filterGraph.update(0.0, event_loop)
+                filterGraph.process()
+            finally:
+                event_loop.close()
+        with self._slotLock:
+            current = self.slots[slotId]
+            if current is None:
+                current = self._releasingSlots.get(slotId)
+            discarded = restored and current is not None
+            if not discarded:
+                print("Set {} for slot {}".format(filterGraph, slotId))
+                self.slots[slotId] = filterGraph
+                self._slotData.pop(slotId, None)
+                self._releasingSlots.pop(slotId, None)
+                released = self._useSlot(slotId)
+        if discarded:
+            # slot was restored elsewhere in the meantime, keep that one
+            filterGraph.close()
+            return self.getSlot(slotId)
+        self._releaseSlots(released)
+        return filterGraph
 
     def getSlot(self, slotId):
-        if self.slots[slotId] is None:
-            self.slots[slotId] = FilterGraph()
-        return self.slots[slotId]
+        with self._slotLock:
+            if self.slots[slotId] is None:
+                if slotId in self._releasingSlots:
+                    # still being serialized, keep using the graph
+                    filterGraph = self._releasingSlots.pop(slotId)
+                elif slotId in self._slotData:
+                    print("Restoring slot {}".format(slotId))
+                    filterGraph = jsonpickle.unpickler.Unpickler().restore(self._slotData.pop(slotId))
+                else:
+                    filterGraph = FilterGraph()
+                filterGraph._project = self
+                self.slots[slotId] = filterGraph
+            filterGraph = self.slots[slotId]
+            released = self._useSlot(slotId)
+        self._releaseSlots(released)
+        return filterGraph
+
+    def getSlotData(self, slotId):
+        """Returns the slot as flattened jsonpickle data, None if the slot is empty"""
+        with self._slotLock:
+            filterGraph = self.slots[slotId]
+            if filterGraph is None:
+                filterGraph = self._releasingSlots.get(slotId)
+            if filterGraph is None:
+                return self._slotData.get(slotId)
+        return jsonpickle.pickler.Pickler().flatten(filterGraph)
+
+    def _useSlot(self, slotId):
+        # mark slot as recently used and take the least recently used slots out of the project,
+        # returns the released slots, which have to be passed to _releaseSlots outside of the lock
+        self._liveSlots[slotId] = True
+        self._liveSlots.move_to_end(slotId)
+        # the active slot, the slot of the current frame and the requested slot are never released
+        keep = [self.activeSlotId, self._frameSlotId, slotId]
+        releasable = [s for s in self._liveSlots if s not in keep]
+        released = []
+        for oldest in releasable[:max(0, len(self._liveSlots) - self.maxLiveSlots)]:
+            print("Releasing slot {}".format(oldest))
+            filterGraph = self.slots[oldest]
+            self.slots[oldest] = None
+            del self._liveSlots[oldest]
+            self._releasingSlots[oldest] = filterGraph
+            released.append((oldest, filterGraph))
+        return released
+
+    def _releaseSlots(self, released):
+        # serialize outside of the lock, so the render thread isn't blocked
+        for slotId, filterGraph in released:
+            data = jsonpickle.pickler.Pickler().flatten(filterGraph)
+            with self._slotLock:
+                if self._releasingSlots.get(slotId) is not filterGraph:
+                    # slot was used or replaced in the meantime
+                    continue
+                self._slotData[slotId] = data
+                del self._releasingSlots[slotId]
+            filterGraph.close()
+
+
+def _logPrewarmError(future):
+    error = future.exception()
+    if error is not None:
+        print("Error preparing slot: {}".format(error))
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+
+def _containsReferences(data):
+    if isinstance(data, dict):
+        return 'py/id' in data or any(_containsReferences(v) for v in data.values())
+    if isinstance(data, list):
+        return any(_containsReferences(v) for v in data)
+    return False
+
+
+class ProjectHandler(jsonpickle.handlers.BaseHandler):
+    """Serializes every slot of a project as self-contained document, so slots can be restored lazily"""
+
+    # Marks projects with self-contained slots, older files use references across the whole document
+    slotFormat = 1
+
+    def flatten(self, obj, data):
+        state = obj.__getstate__()
+        state.pop('slots', None)
+        data['py/state'] = self.context.flatten(state, reset=False)
+        data['py/state']['slots'] = [obj.getSlotData(i) for i in range(len(obj.slots))]
+        data['py/state']['slotFormat'] = self.slotFormat
+        return data
+
+    def restore(self, obj):
+        state = dict(obj['py/state'])
+        slots = state.pop('slots', [])
+        slotFormat = state.pop('slotFormat', None)
+        proj = Project.__new__(Project)
+        restored = self.context.restore(state, reset=False)
+        if slotFormat is None and _containsReferences(slots):
+            # legacy format: references are numbered across the whole document, restore all slots at once
+            restored['slots'] = self.context.restore(slots, reset=False)
+            proj.__setstate__(restored)
+            # keep only the active slot, so the first frames don't release all other slots at once
+            for slotId, filterGraph in enumerate(proj.slots):
+                if filterGraph is None or slotId == proj.activeSlotId:
+                    continue
+                proj._slotData[slotId] = jsonpickle.pickler.Pickler().flatten(filterGraph)
+                proj.slots[slotId] = None
+                del proj._liveSlots[slotId]
+                filterGraph.close()
+        else:
+            # every slot has its own references and is restored with its own Unpickler in getSlot
+            restored['slots'] = [None for i in range(len(slots))]
+            proj.__setstate__(restored)
+            proj._slotData = {slotId: data for slotId, data in enumerate(slots) if data is not None}
+        return proj
+
+
+ProjectHandler.handles(Project)
@@ -0,0 +1,94 @@
+import threading
+import time
+
+POLICY_SKIP = 'skip'
+POLICY_CATCH_UP = 'catchup'
+
+
+class FrameScheduler(object):
+    """Calls a frame callback at a fixed frame rate from a single long-lived thread
+
+    Frame deadlines are absolute times on a monotonic clock, so the time spent in
+    the callback doesn't add up as drift.
+    If a frame finishes after the deadline of the next frame, the frame is counted as late.
+    Depending on the policy, missed frames are either skipped (POLICY_SKIP) or
+    rendered back-to-back until the schedule is met again (POLICY_CATCH_UP).
+    """
+
+    def __init__(self, callback, fps=100, policy=POLICY_SKIP, max_catch_up=5, clock=time.monotonic, wait=None):
+        """Constructor
+
+        Arguments:
+            callback {function} -- Function to call once per frame
+
+        Keyword Arguments:
+            fps {float} -- Target frame rate (default: {100})
+            policy {str} -- Policy for late frames, POLICY_SKIP or POLICY_CATCH_UP (default: {POLICY_SKIP})
+            max_catch_up {int} -- Maximum number of frames to catch up before skipping (default: {5})
+            clock {function} -- Monotonic clock in seconds (default: {time.monotonic})
+            wait {function} -- Waits for the given number of seconds, returns True if the scheduler
+                               was stopped in the meantime (default: {None}, wait on the stop event)
+        """
+        if policy not in [POLICY_SKIP, POLICY_CATCH_UP]:
+            raise ValueError("Invalid policy {}".format(policy))
+        self._callback = callback
+        self._period = 1.0 / fps
+        self._policy = policy
+        self._max_catch_up = max_catch_up
+        self._thread = None
+        self._stopEvent = threading.Event()
+        self._clock = clock
+        self._wait = wait if wait is not None else self._stopEvent.wait
+        self.numFrames = 0
+        self.numLateFrames = 0
+        self.numSkippedFrames = 0
+
+    def setFps(self, fps):
+        self._period = 1.0 / fps
+
+    def getFps(self):
+        return 1.0 / self._period
+
+    def start(self):
+        """Start the scheduler thread"""
+        if self._thread is not None:
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._process_thread, name='FrameScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=1):
+        """Stop the scheduler thread
+        Raises TimeoutError """
+        if self._thread is None:
+            return
+        self._stopEvent.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=timeout)
+            if self._thread.is_alive():
+                raise TimeoutError("thread.join timed out")
+        self._thread = None
+
+    def _process_thread(self):
+        deadline = self._clock()
+        while not self._stopEvent.is_set():
+            waitTime = deadline - self._clock()
+            if waitTime > 0 and self._wait(waitTime):
+                break
+            self._callback()
+            self.numFrames += 1
+            deadline = self._nextDeadline(deadline, self._clock())
+
+    def _nextDeadline(self, deadline, now):
+        deadline += self._period
+        if now <= deadline:
+            return deadline
+        self.numLateFrames += 1
+        missed = int((now - deadline) / self._period)
+        if self._policy == POLICY_CATCH_UP and missed < self._max_catch_up:
+            # render missed frames without waiting
+            return deadline
+        # skip missed frames and stay on the frame grid
+        self.numSkippedFrames += missed
+        return deadline + missed * self._period
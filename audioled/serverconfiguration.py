@@ -5,6 +5,8 @@ import json
 import os.path
 import hashlib
 import io
+import queue
+import threading
 
 CONFIG_NUM_PIXELS = 'num_pixels'
 CONFIG_NUM_ROWS = 'num_rows'
@@ -15,6 +17,90 @@ CONFIG_ACTIVE_PROJECT = 'active_project'
 CONFIG_DEVICE_PANEL_MAPPING = 'device.panel.mapping'
 
 
+def writeFileAtomic(filename, content):
+    """Writes content to a temporary file and renames it, so the file is never partially written"""
+    tmpFile = "{}.tmp".format(filename)
+    with open(tmpFile, "w", encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, filename)
+
+
+def projectHash(projData):
+    """Returns the hash of the compact, canonical encoding of a flattened project"""
+    projJson = json.dumps(projData, sort_keys=True, separators=(',', ':'))
+    mp = hashlib.md5()
+    mp.update(projJson.encode('utf-8'))
+    return mp.hexdigest()
+
+
+class ProjectWriter(object):
+    """Serializes and writes projects to disk on a persistent background thread
+
+    Projects are flattened (see jsonpickle.pickler.Pickler.flatten) and hashed on the writer
+    thread, so the render loop isn't blocked while projects are saved.
+    The hashes of the written projects and write errors are reported back via getResults().
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._results = queue.Queue()
+        self._lastHashes = {}
+        self._thread = threading.Thread(target=self._writeLoop, name='ProjectWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, key, revision, proj, projFile):
+        """Queues a project for writing"""
+        self._queue.put((key, revision, proj, projFile))
+
+    def getResults(self):
+        """Returns (key, revision, hash, error) for all projects processed since the last call
+
+        error is None if the project was written, otherwise hash is None.
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def flush(self):
+        """Waits until all queued projects are written"""
+        self._queue.join()
+
+    def stop(self, timeout=5):
+        """Writes all queued projects and stops the writer thread"""
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+
+    def _writeLoop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                key, revision, proj, projFile = item
+                projData = jsonpickle.pickler.Pickler().flatten(proj)
+                projHash = projectHash(projData)
+                # skip writing if the content didn't change
+                if self._lastHashes.get(key) != projHash:
+                    print("Writing project to {}".format(projFile))
+                    path = os.path.dirname(projFile)
+                    if not os.path.exists(path):
+                        os.makedirs(path)
+                    writeFileAtomic(projFile, json.dumps(projData, indent=4, sort_keys=True))
+                    self._lastHashes[key] = projHash
+                self._results.put((key, revision, projHash, None))
+            except Exception as e:
+                print("Error writing project: {}".format(e))
+                self._results.put((key, revision, None, e))
+            finally:
+                self._queue.task_done()
+
+
 class ServerConfiguration:
     def __init__(self):
         self._config = {}
@@ -28,6 +114,11 @@ class ServerConfiguration:
         self._projectMetadatas = {}
         self._activeProject = None
         self._reusableDevice = None
+        # revision counters to track modified projects
+        self._projectRevisions = {}
+        self._storedRevisions = {}
+        # revisions passed to the writer, but not yet written
+        self._pendingRevisions = {}
 
     @staticmethod
     def getConfigurationParameters():
@@ -48,6 +139,8 @@ class ServerConfiguration:
                 CONFIG_DEVICE_PANEL_MAPPING
         ]:
             print("Renewing device")
+            if isinstance(self._reusableDevice, devices.AsyncDeviceWrapper):
+                self._reusableDevice.stop()
             self._reusableDevice = None
             self.getActiveProjectOrDefault().setDevice(self._createOrReuseOutputDevice())
 
@@ -59,6 +152,19 @@ class ServerConfiguration:
     def getFullConfiguration(self):
         return self._config
 
+    def markProjectDirty(self, uid):
+        """Marks the project as modified, so it is written by the next store()"""
+        self._projectRevisions[uid] = self._projectRevisions.get(uid, 0) + 1
+
+    def getDirtyProjects(self):
+        """Returns the revisions of all loaded projects that were modified since they were stored or queued"""
+        return {
+            uid: rev
+            for uid, rev in self._projectRevisions.items()
+            if uid in self._projects and self._storedRevisions.get(uid) != rev
+            and self._pendingRevisions.get(uid) != rev
+        }
+
     def getActiveProjectOrDefault(self):
         activeProjectUid = self.getConfiguration(CONFIG_ACTIVE_PROJECT)
         if activeProjectUid is None:
@@ -92,6 +198,7 @@ class ServerConfiguration:
         proj.id = projectUid
         self._projects[projectUid] = proj
         self._projectMetadatas[projectUid] = self._metadataForProject(proj, projectUid)
+        self.markProjectDirty(projectUid)
         self._config[CONFIG_ACTIVE_PROJECT] = projectUid
         activeProjectUid = projectUid
         return activeProjectUid
@@ -109,6 +216,9 @@ class ServerConfiguration:
             self._projects.pop(uid)
         if uid in self._projectMetadatas:
             self._projectMetadatas.pop(uid)
+        self._projectRevisions.pop(uid, None)
+        self._storedRevisions.pop(uid, None)
+        self._pendingRevisions.pop(uid, None)
 
     def activateProject(self, uid):
         #if self._activeProject is not None:
@@ -134,6 +244,7 @@ class ServerConfiguration:
         projectUid = uuid.uuid4().hex
         self._projects[projectUid] = proj
         self._projectMetadatas[projectUid] = self._metadataForProject(proj, projectUid)
+        self.markProjectDirty(projectUid)
         return self.getProjectMetadata(projectUid)
 
     def importProject(self, json):
@@ -145,12 +256,13 @@ class ServerConfiguration:
         proj.setDevice(self._createOrReuseOutputDevice())
         self._projects[projectUid] = proj
         self._projectMetadatas[projectUid] = self._metadataForProject(proj, projectUid)
+        self.markProjectDirty(projectUid)
         return self.getProjectMetadata(projectUid)
 
-    def updateMd5HashFromFiles(self):
+    def postStore(self):
         pass
 
-    def postStore(self):
+    def close(self):
         pass
 
     def _store(self):
@@ -163,6 +275,9 @@ class ServerConfiguration:
         if self._reusableDevice is not None:
             return self._reusableDevice
         device = self.createOutputDevice()
+        if device is not None:
+            # send frames on a separate thread, so rendering and I/O overlap
+            device = devices.AsyncDeviceWrapper(device)
         self._reusableDevice = device
         return device
 
@@ -224,6 +339,8 @@ class PersistentConfiguration(ServerConfiguration):
         self.need_write = False
         self._lastHash = None
         self._lastProjectHashs = {}
+        self._projectIndex = {}
+        self._writer = None
         self._load()
 
     def setConfiguration(self, key, value):
@@ -244,11 +361,16 @@ class PersistentConfiguration(ServerConfiguration):
             return
         projMeta = self._projectMetadatas[uid]
         projFile = projMeta['location']
+        if self._writer is not None:
+            # make sure the project isn't written after deletion
+            self._writer.flush()
         if os.path.isfile(projFile):
             os.remove(projFile)
         path = os.path.dirname(projFile)
         if os.path.isdir(path):
             os.removedirs(path)
+        if self._projectIndex.pop(uid, None) is not None:
+            self._writeProjectIndex()
         super().deleteProject(uid)
 
     def getProject(self, uid):
@@ -261,13 +383,15 @@ class PersistentConfiguration(ServerConfiguration):
         else:
             # Load the project from disk
             proj = self._readProject(uid)
-            # Update hash
-            projHash = self._getProjectHash(proj)
-            self._lastProjectHashs[uid] = projHash
             self._projects[uid] = proj
             return super().getProject(uid)
 
     def store(self):
+        """Writes the configuration and passes all modified projects to the writer thread
+
+        Projects are serialized on the writer thread. Changes made in the meantime mark the
+        project dirty again, so they are written with the next store().
+        """
         # Check and write configuration
         value = self._getStoreConfig()
         m = hashlib.md5()
@@ -280,33 +404,42 @@ class PersistentConfiguration(ServerConfiguration):
             if not os.path.exists(self.storageLocation):
                 os.makedirs(self.storageLocation)
             print("Writing configuration to {}".format(os.path.join(self.storageLocation, "configuration.json")))
-            with open(os.path.join(self.storageLocation, 'configuration.json'), "w") as f:
-                f.write(value)
+            writeFileAtomic(os.path.join(self.storageLocation, 'configuration.json'), value)
             self.need_write = False
             self._lastHash = curHash
 
-        # Check and write projects
-        for key, proj in self._projects.items():
-            projMeta = self._projectMetadatas[key]
+        # Snapshot modified projects, each project is serialized only once
+        for key, revision in self.getDirtyProjects().items():
+            projMeta = self._projectMetadatas.get(key)
             if projMeta is None:
                 print("No metadata found. Can't write project {}".format(key))
                 continue
-            lastProjHash = None
-            if key in self._lastProjectHashs:
-                lastProjHash = self._lastProjectHashs[key]
-            # get hash we have read and check if project needs to be written
-            projHash = self._getProjectHash(proj)
-            needProjWrite = lastProjHash is None or lastProjHash != projHash
-            # Write project
-            if not self.no_store and needProjWrite:
-                projFile = projMeta['location']
-                path = os.path.dirname(projFile)
-                if not os.path.exists(path):
-                    os.makedirs(path)
-                self._writeProject(proj, projFile)
-                self._lastProjectHashs[key] = projHash
+            if self.no_store:
+                self._storedRevisions[key] = revision
+                continue
+            # the revision is stored once the writer reports success, see postStore()
+            self._pendingRevisions[key] = revision
+            self._getWriter().write(key, revision, self._projects[key], projMeta['location'])
 
     def postStore(self):
+        # Hashes of written projects
+        if self._writer is not None:
+            results = self._writer.getResults()
+            for key, revision, projHash, error in results:
+                if self._pendingRevisions.get(key) == revision:
+                    del self._pendingRevisions[key]
+                if error is not None:
+                    # project stays dirty and is written again with the next store()
+                    print("Project {} was not written: {}".format(key, error))
+                    continue
+                if self._storedRevisions.get(key, 0) < revision:
+                    self._storedRevisions[key] = revision
+                self._lastProjectHashs[key] = projHash
+                projMeta = self._projectMetadatas.get(key)
+                if projMeta is not None and os.path.isfile(projMeta['location']):
+                    self._projectIndex[key] = self._projectIndexEntry(projMeta, os.stat(projMeta['location']), projHash)
+            if any(error is None for key, revision, projHash, error in results):
+                self._writeProjectIndex()
         for key, proj in self._projects.items():
             projMeta = self._projectMetadatas[key]
             if projMeta is None:
@@ -315,15 +448,16 @@ class PersistentConfiguration(ServerConfiguration):
                 print("Adjusting content root for project {}".format(key))
                 proj._contentRoot = os.path.dirname(projMeta['location'])
 
-    def updateMd5HashFromFiles(self):
-        for key, proj in self._projects.items():
-            projMeta = self._projectMetadatas[key]
-            fname = projMeta['location']
-            hash_md5 = hashlib.md5()
-            with open(fname, "rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            self._lastProjectHashs[key] = hash_md5.hexdigest()
+    def close(self):
+        """Writes pending projects and stops the writer thread"""
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
+    def _getWriter(self):
+        if self._writer is None:
+            self._writer = ProjectWriter()
+        return self._writer
 
     def getProjectAsset(self, projectUid, location):
         projMeta = self._projectMetadatas[projectUid]
@@ -375,7 +509,9 @@ class PersistentConfiguration(ServerConfiguration):
             print("Moving project {} to folder".format(f))
             os.makedirs(os.path.join(projPath, projUid))
             os.rename(os.path.join(projPath, f), os.path.join(os.path.join(projPath, projUid), f))
-        # Read projects from subfolders
+        # Read projects from subfolders, metadata of unchanged files is taken from the index
+        index = self._readProjectIndex()
+        indexChanged = False
         onlyfolders = [f for f in os.listdir(projPath) if os.path.isdir(os.path.join(projPath, f))]
         for p in onlyfolders:
             path = os.path.join(projPath, p)
@@ -385,20 +521,78 @@ class PersistentConfiguration(ServerConfiguration):
             ]
             if len(jsonFiles) == 1:
                 f = os.path.basename(jsonFiles[0])
-                print("Reading project metadata from {}/{}".format(path, f))
                 projUid = os.path.splitext(os.path.basename(f))[0]
-                try:
-                    data = self._readProjectMetadata(os.path.join(path, f), projUid)
-                    self._projectMetadatas[projUid] = data
-                except RuntimeError:
-                    pass
+                filepath = os.path.join(path, f)
+                stat = os.stat(filepath)
+                entry = index.get(projUid)
+                if self._isIndexEntryValid(entry, os.path.join(p, f), stat):
+                    data = {
+                        'name': entry['name'],
+                        'description': entry['description'],
+                        'id': entry['id'],
+                        'location': filepath
+                    }
+                else:
+                    print("Reading project metadata from {}/{}".format(path, f))
+                    try:
+                        data, projHash = self._readProjectMetadata(filepath, projUid)
+                    except RuntimeError:
+                        continue
+                    entry = self._projectIndexEntry(data, stat, projHash)
+                    indexChanged = True
+                self._projectMetadatas[projUid] = data
+                self._projectIndex[projUid] = entry
+                self._lastProjectHashs[projUid] = entry['hash']
             else:
                 print("Couldn't read project from {}, only one json file expected".format(p))
+        if indexChanged or len(index) != len(self._projectIndex):
+            self._writeProjectIndex()
 
     def _getProjectPath(self):
         return os.path.join(self.storageLocation, "projects")
 
+    def _getProjectIndexPath(self):
+        return os.path.join(self.storageLocation, "projects.index.json")
+
+    def _readProjectIndex(self):
+        """Returns the project index, an empty index if it doesn't exist or can't be read"""
+        indexFile = self._getProjectIndexPath()
+        if not os.path.isfile(indexFile):
+            return {}
+        try:
+            with open(indexFile, "r", encoding='utf-8') as f:
+                return json.loads(f.read())
+        except (ValueError, OSError) as e:
+            print("Error reading project index {}: {}".format(indexFile, e))
+            return {}
+
+    def _writeProjectIndex(self):
+        if self.no_store:
+            return
+        if not os.path.exists(self.storageLocation):
+            os.makedirs(self.storageLocation)
+        writeFileAtomic(self._getProjectIndexPath(), json.dumps(self._projectIndex, indent=4, sort_keys=True))
+
+    def _isIndexEntryValid(self, entry, relPath, stat):
+        """Checks whether the index entry still describes the file"""
+        if entry is None or any(key not in entry
+                                for key in ['name', 'description', 'id', 'file', 'mtime', 'size', 'hash']):
+            return False
+        return entry['file'] == relPath and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size
+
+    def _projectIndexEntry(self, projMeta, stat, projHash):
+        return {
+            'name': projMeta['name'],
+            'description': projMeta['description'],
+            'id': projMeta['id'],
+            'file': os.path.relpath(projMeta['location'], self._getProjectPath()),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': projHash
+        }
+
     def _readProjectMetadata(self, filepath, fallbackUid):
+        """Returns the metadata and the content hash of the project file"""
         with open(filepath, "r", encoding='utf-8') as fc:
             projData = json.loads(fc.read())
             p = projData.get("py/state")
@@ -410,7 +604,7 @@ class PersistentConfiguration(ServerConfiguration):
                 , 'description' : p.get('description', '')
                 , 'id'          : p.get('id', fallbackUid)
                 , 'location'    : filepath
-            }
+            }, projectHash(projData)
 
     def _metadataForProject(self, project, projectUid):
         projData = super()._metadataForProject(project, projectUid)
@@ -433,16 +627,3 @@ class PersistentConfiguration(ServerConfiguration):
             proj._contentRoot = os.path.dirname(filepath)
             proj.setDevice(self._createOrReuseOutputDevice())
             return proj
-
-    def _writeProject(self, proj, projFile):
-        print("Writing project to {}".format(projFile))
-        projJson = json.dumps(json.loads(jsonpickle.encode(proj)), indent=4, sort_keys=True)
-        with open(projFile, "w") as f:
-            f.write(projJson)
-
-    def _getProjectHash(self, proj):
-        projJson = json.dumps(json.loads(jsonpickle.encode(proj)), indent=4, sort_keys=True)
-        mp = hashlib.md5()
-        mp.update(projJson.encode('utf-8'))
-        projHash = mp.hexdigest()
-        return projHash
@@ -9,7 +9,6 @@ import json
 import os.path
 import threading
 import time
-import multiprocessing
 import io
 import traceback
 from timeit import default_timer as timer
@@ -20,19 +19,20 @@ from flask import Flask, abort, jsonify, request, send_from_directory, redirect,
 from apscheduler.schedulers.background import BackgroundScheduler
 from werkzeug.serving import is_running_from_reloader
 
-from audioled import audio, devices, effects, filtergraph, serverconfiguration
+from audioled import audio, devices, effects, filtergraph, panelize, project, scheduler, serverconfiguration
 
 proj = None
 default_values = {}
 record_timings = False
 serverconfig = None
 
-POOL_TIME = 0.0  # Seconds
+target_fps = 100
+frame_policy = scheduler.POLICY_SKIP
 
 # lock to control access to variable
 dataLock = threading.Lock()
 # thread handler
-ledThread = threading.Thread()
+ledThread = None
 event_loop = None
 # timing
 current_time = None
@@ -47,22 +47,22 @@ count = 0
 #     return app.send_static_file('index.html')
 
 
-def multiprocessing_func(sc):
-    sc.store()
-
-
 def create_app():
     app = Flask(__name__, static_url_path='/')
 
     def store_configuration():
         global serverconfig
-        p = multiprocessing.Process(target=multiprocessing_func, args=(serverconfig, ))
-        p.start()
-        p.join()
-        # Update MD5 hashes from file, since data was written in separate process
-        serverconfig.updateMd5HashFromFiles()
+        # only projects modified through the API are written
+        # modified projects are collected between frames, serialized and written on the writer thread
+        with dataLock:
+            serverconfig.store()
         serverconfig.postStore()
 
+    def markProjectDirty():
+        global proj
+        global serverconfig
+        serverconfig.markProjectDirty(proj.id)
+
     sched = BackgroundScheduler(daemon=True)
     sched.add_job(store_configuration, 'interval', seconds=5)
     sched.start()
@@ -70,9 +70,13 @@ def create_app():
     def interrupt():
         print('cancelling LED thread')
         global ledThread
-        ledThread.cancel()
-        ledThread.join()
+        if ledThread is not None:
+            ledThread.stop()
         print('LED thread cancelled')
+        if serverconfig is not None:
+            # write pending changes before exiting
+            serverconfig.store()
+            serverconfig.close()
 
     @app.after_request
     def add_header(response):
@@ -111,6 +115,7 @@ def create_app():
         try:
             node = next(node for node in fg._filterNodes if node.uid == nodeUid)
             fg.removeEffectNode(node.effect)
+            markProjectDirty()
             return "OK"
         except StopIteration:
             abort(404, "Node not found")
@@ -126,6 +131,7 @@ def create_app():
             # data =  json.loads(request.json)
             print(request.json)
             node.effect.updateParameter(request.json)
+            markProjectDirty()
             return jsonpickle.encode(node)
         except StopIteration:
             abort(404, "Node not found")
@@ -167,6 +173,7 @@ def create_app():
         class_ = getattr(importlib.import_module(module_name), class_name)
         instance = class_(**parameters)
         node = fg.addEffectNode(instance)
+        markProjectDirty()
         return jsonpickle.encode(node)
 
     @app.route('/slot/<int:slotId>/connections', methods=['GET'])
@@ -185,7 +192,7 @@ def create_app():
         json = request.json
         connection = fg.addNodeConnection(json['from_node_uid'], int(json['from_node_channel']), json['to_node_uid'],
                                           int(json['to_node_channel']))
-
+        markProjectDirty()
         return jsonpickle.encode(connection)
 
     @app.route('/slot/<int:slotId>/connection/<connectionUid>', methods=['DELETE'])
@@ -196,6 +203,7 @@ def create_app():
             connection = next(connection for connection in fg._filterConnections if connection.uid == connectionUid)
             fg.removeConnection(connection.fromNode.effect, connection.fromChannel, connection.toNode.effect,
                                 connection.toChannel)
+            markProjectDirty()
             return "OK"
         except StopIteration:
             abort(404, "Node not found")
@@ -217,6 +225,7 @@ def create_app():
         if not isinstance(newGraph, filtergraph.FilterGraph):
             raise RuntimeError("Not a FilterGraph")
         proj.setFiltergraphForSlot(slotId, newGraph)
+        markProjectDirty()
         return "OK"
 
     @app.route('/effects', methods=['GET'])
@@ -317,7 +326,20 @@ def create_app():
             abort(400)
         value = request.json['slot']
         # print("Activating slot {}".format(value))
-        proj.activateSlot(value)
+        # slot is prepared in the background and switched between two frames
+        future = proj.activateSlotWhenReady(value)
+        # mark the project that was activated, not the current one once the future is done
+        projectId = proj.id
+        future.add_done_callback(lambda f: serverconfig.markProjectDirty(projectId))
+        return "OK"
+
+    @app.route('/project/prewarmSlot', methods=['POST'])
+    def project_prewarmSlot_post():
+        global proj
+        if not request.json:
+            abort(400)
+        value = request.json['slot']
+        proj.prewarmSlot(value)
         return "OK"
 
     @app.route('/project/activeSlot', methods=['GET'])
@@ -440,7 +462,9 @@ def create_app():
         if os.path.isfile(filename):
             with open(filename, "r") as f:
                 fg = jsonpickle.decode(f.read())
-                proj.setFiltergraphForSlot(proj.activeSlotId, fg)
+                future = proj.activateSlotWhenReady(proj.activeSlotId, fg)
+                projectId = proj.id
+                future.add_done_callback(lambda f: serverconfig.markProjectDirty(projectId))
                 return "OK"
         else:
             print("Favorite not found: {}".format(filename))
@@ -449,7 +473,6 @@ def create_app():
 
     def processLED():
         global proj
-        global ledThread
         global event_loop
         global last_time
         global current_time
@@ -480,18 +503,15 @@ def create_app():
             print("Unknown error: {}".format(e))
             traceback.print_tb(e.__traceback__)
         finally:
-            # Set the next thread to happen
             real_process_time = timer() - current_time
-            timeToWait = max(POOL_TIME, 0.01 - real_process_time)
             if count == 100:
                 if record_timings:
                     proj.getSlot(proj.activeSlotId).printProcessTimings()
                     proj.getSlot(proj.activeSlotId).printUpdateTimings()
                     print("Process time: {}".format(real_process_time))
-                    print("Waiting {}".format(timeToWait))
+                    print("Frames: {}, late: {}, skipped: {}".format(ledThread.numFrames, ledThread.numLateFrames,
+                                                                     ledThread.numSkippedFrames))
                 count = 0
-            ledThread = threading.Timer(timeToWait, processLED, ())
-            ledThread.start()
 
     def startLEDThread():
         # Do initialisation stuff here
@@ -500,8 +520,8 @@ def create_app():
         global current_time
         # Create your thread
         current_time = timer()
-        ledThread = threading.Timer(POOL_TIME, processLED, ())
-        print('starting LED thread')
+        ledThread = scheduler.FrameScheduler(processLED, fps=target_fps, policy=frame_policy)
+        print('starting LED thread with {} fps'.format(target_fps))
         ledThread.start()
 
     # Initiate
@@ -572,6 +592,26 @@ if __name__ == '__main__':
         action='store_true',
         default=False,
         help='Print process timing')
+    parser.add_argument(
+        '--process_workers',
+        dest='process_workers',
+        type=int,
+        default=None,
+        help='Number of threads to process independent effects in parallel (default: 0, sequential)')
+    parser.add_argument(
+        '--max_live_slots',
+        dest='max_live_slots',
+        type=int,
+        default=None,
+        help='Number of recently used slots kept in memory (default: {})'.format(project.Project.maxLiveSlots))
+    parser.add_argument(
+        '--fps', dest='fps', type=float, default=None, help='Target frame rate (default: {})'.format(target_fps))
+    parser.add_argument(
+        '--frame_policy',
+        dest='frame_policy',
+        default=None,
+        choices=[scheduler.POLICY_SKIP, scheduler.POLICY_CATCH_UP],
+        help='Handling of late frames: skip missed frames or catch up (default: {})'.format(frame_policy))
     parser.add_argument(
         '--strand', dest='strand', action='store_true', default=False, help="Perform strand test at start of server.")
 
@@ -592,6 +632,8 @@ if __name__ == '__main__':
     else:
         print("Using configuration from {}".format(config_location))
         serverconfig = serverconfiguration.PersistentConfiguration(config_location, args.no_store)
+        if not args.no_store:
+            panelize.MakeLabyrinth.maskCacheDirectory = os.path.join(config_location, 'cache')
 
     print("Applying arguments")
 
@@ -622,6 +664,18 @@ if __name__ == '__main__':
     if args.process_timing:
         record_timings = True
 
+    if args.process_workers is not None:
+        filtergraph.FilterGraph.numProcessWorkers = args.process_workers
+
+    if args.max_live_slots is not None:
+        project.Project.maxLiveSlots = args.max_live_slots
+
+    if args.fps is not None:
+        target_fps = args.fps
+
+    if args.frame_policy is not None:
+        frame_policy = args.frame_policy
+
     # Adjust from configuration
 
     # Audio
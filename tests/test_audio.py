@@ -0,0 +1,72 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import asyncio
+import unittest
+from audioled import audio
+import numpy as np
+
+
+class Test_Audio(unittest.TestCase):
+    def test_ringBuffer_readSinceCursor(self):
+        audio.GlobalAudio.initRingBuffer(10)
+        data, cursor = audio.GlobalAudio.read(None)
+        self.assertEqual(len(data), 0)
+        audio.GlobalAudio.writeSamples(np.arange(4, dtype=np.float32))
+        audio.GlobalAudio.writeSamples(np.arange(4, 8, dtype=np.float32))
+        data, cursor = audio.GlobalAudio.read(cursor)
+        np.testing.assert_array_equal(data, np.arange(8))
+        # nothing new
+        data, cursor = audio.GlobalAudio.read(cursor)
+        self.assertEqual(len(data), 0)
+        # wrap around
+        audio.GlobalAudio.writeSamples(np.arange(8, 12, dtype=np.float32))
+        data, cursor = audio.GlobalAudio.read(cursor)
+        np.testing.assert_array_equal(data, np.arange(8, 12))
+        np.testing.assert_array_equal(audio.GlobalAudio.buffer, np.arange(8, 12))
+
+    def test_ringBuffer_readerFallsBehind(self):
+        audio.GlobalAudio.initRingBuffer(10)
+        data, cursor = audio.GlobalAudio.read(None)
+        for i in range(5):
+            audio.GlobalAudio.writeSamples(np.arange(i * 4, i * 4 + 4, dtype=np.float32))
+        # only the last 10 samples are available
+        data, cursor = audio.GlobalAudio.read(cursor)
+        np.testing.assert_array_equal(data, np.arange(10, 20))
+        self.assertEqual(cursor, 20)
+
+    def test_ringBuffer_getLatest(self):
+        audio.GlobalAudio.initRingBuffer(10)
+        for i in range(3):
+            audio.GlobalAudio.writeSamples(np.arange(i * 4, i * 4 + 4, dtype=np.float32))
+        np.testing.assert_array_equal(audio.GlobalAudio.getLatest(6), np.arange(6, 12))
+        # new reader starts with the latest chunk
+        data, cursor = audio.GlobalAudio.read(None)
+        np.testing.assert_array_equal(data, np.arange(8, 12))
+
+    def test_audioInput_noNewChunk_outputsEmptyAudio(self):
+        audio.GlobalAudio.initRingBuffer(16)
+        audio.GlobalAudio.writeSamples(np.arange(4, dtype=np.float32))
+        chunkRate = audio.GlobalAudio.chunk_rate
+        audio.GlobalAudio.chunk_rate = 60
+        try:
+            effect = audio.AudioInput(num_channels=2)
+        finally:
+            audio.GlobalAudio.chunk_rate = chunkRate
+        effect.setInputBuffer([])
+        effect.setOutputBuffer([None, None])
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(effect.update(0.01))
+        effect.process()
+        np.testing.assert_array_equal(effect._outputBuffer[0], [0, 2])
+        np.testing.assert_array_equal(effect._outputBuffer[1], [1, 3])
+        # no new chunk, the old chunk must not be passed on again
+        loop.run_until_complete(effect.update(0.01))
+        effect.process()
+        self.assertEqual(len(effect._outputBuffer[0]), 0)
+        self.assertEqual(len(effect._outputBuffer[1]), 0)
+        audio.GlobalAudio.writeSamples(np.arange(4, 8, dtype=np.float32))
+        loop.run_until_complete(effect.update(0.01))
+        effect.process()
+        np.testing.assert_array_equal(effect._outputBuffer[0], [4, 6])
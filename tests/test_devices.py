@@ -0,0 +1,110 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import unittest
+import threading
+import time
+from audioled import devices
+import numpy as np
+
+
+class Test_Devices(unittest.TestCase):
+    def test_asyncDeviceWrapper_sendsLatestFrame(self):
+        device = MockDevice(10, delay=0.05)
+        wrapper = devices.AsyncDeviceWrapper(device)
+        pixels = np.zeros((3, 10))
+        for i in range(10):
+            pixels[0, 0] = i
+            wrapper.show(pixels)
+        # frame was copied
+        pixels[0, 0] = -1
+        time.sleep(0.2)
+        wrapper.stop()
+        self.assertEqual(device.shown[-1][0, 0], 9)
+        self.assertTrue(wrapper.getNumDroppedFrames() > 0)
+        self.assertEqual(len(device.shown) + wrapper.getNumDroppedFrames(), 10)
+
+    def test_asyncDeviceWrapper_doesNotBlock(self):
+        device = MockDevice(10, delay=0.2)
+        wrapper = devices.AsyncDeviceWrapper(device)
+        start = time.time()
+        for i in range(5):
+            wrapper.show(np.ones((3, 10)) * i)
+        self.assertTrue(time.time() - start < 0.2)
+        wrapper.stop()
+
+    def test_asyncDeviceWrapper_raisesDeviceError(self):
+        device = MockDevice(10, delay=0.0)
+        device.error = RuntimeError("Device unplugged")
+        wrapper = devices.AsyncDeviceWrapper(device)
+        wrapper.show(np.zeros((3, 10)))
+        time.sleep(0.1)
+        with self.assertRaises(RuntimeError):
+            wrapper.show(np.zeros((3, 10)))
+        # error is only reported once
+        device.error = None
+        wrapper.show(np.zeros((3, 10)))
+        wrapper.stop()
+
+    def test_asyncDeviceWrapper_usesDevicePixels(self):
+        device = MockDevice(10, delay=0.0)
+        wrapper = devices.AsyncDeviceWrapper(device)
+        device.setNumPixels(20)
+        device.setNumRows(2)
+        self.assertEqual(wrapper.num_pixels, 20)
+        self.assertEqual(wrapper.getNumRows(), 2)
+        wrapper.num_pixels = 30
+        self.assertEqual(device.getNumPixels(), 30)
+
+    def test_raspberryPi_encodesPixels(self):
+        device = devices.RaspberryPi(4)
+        device._strip = MockStrip()
+        pixels = np.array([[255, 0, 0, 300], [0, 255, 0, 12.7], [0, 0, 255, -1]])
+        expected = [0xff0000, 0x00ff00, 0x0000ff, 0xff0100]
+        # fallback: pixels are set one by one
+        device.show(pixels)
+        self.assertEqual(device._strip.pixels, expected)
+        # bulk write into LED buffer
+        device._ledBuffer = np.zeros(4, dtype=np.uint32)
+        device.show(pixels)
+        self.assertEqual(device._ledBuffer.tolist(), expected)
+
+    def test_blinkStick_encodesGRB(self):
+        device = devices.BlinkStick.__new__(devices.BlinkStick)
+        devices.LEDController.__init__(device, 2)
+        device.stick = MockStick()
+        device.show(np.array([[255, 0], [0, 255], [255, 0]]))
+        self.assertEqual(device.stick.data, [0, 255, 255, 255, 0, 0])
+
+
+class MockStrip(object):
+    def __init__(self):
+        self.pixels = []
+
+    def setPixelColor(self, i, color):
+        self.pixels.append(color)
+
+    def show(self):
+        pass
+
+
+class MockStick(object):
+    def set_led_data(self, channel, data):
+        self.data = data
+
+
+class MockDevice(devices.LEDController):
+    def __init__(self, num_pixels, delay):
+        super().__init__(num_pixels)
+        self.delay = delay
+        self.error = None
+        self.shown = []
+        self._lock = threading.Lock()
+
+    def show(self, pixels):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        with self._lock:
+            self.shown.append(pixels.copy())
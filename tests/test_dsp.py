@@ -4,6 +4,7 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 import unittest
 import numpy as np
+from scipy.signal import lfilter, resample_poly
 from audioled import dsp
 
 
@@ -113,6 +114,110 @@ class TestDSP(unittest.TestCase):
         signal = np.array(list(signal))
         self.assertTrue((signal == 0).all())
 
+    def test_audioAnalysis_matchesPreprocess(self):
+        chunks = [np.random.normal(size=100) for i in range(5)]
+        # preprocess consumes the first chunk twice for initialization
+        audio, fs = dsp.preprocess((chunk for chunk in chunks[:1] * 2 + chunks), fs=1000, fmax=250, n_overlaps=3)
+        analysis = dsp.AudioAnalysis()
+        for i, chunk in enumerate(chunks):
+            y = next(audio)
+            pow_spectrum, n_fft, ds_fs = analysis.powerSpectrum('source', i, chunk, 1000, 250, 3)
+            self.assertEqual(ds_fs, fs)
+            self.assertEqual(n_fft, len(y))
+            if i >= 2:
+                # rolling window is filled with the same chunks
+                np.testing.assert_allclose(pow_spectrum, dsp.power_spectrum(y))
+
+    def test_audioAnalysis_computesOncePerFrame(self):
+        analysis = dsp.AudioAnalysis()
+        chunk = np.random.normal(size=64)
+        first, _, _ = analysis.powerSpectrum('source', 1, chunk, 1000, 500, 2)
+        second, _, _ = analysis.powerSpectrum('source', 1, chunk, 1000, 500, 2)
+        self.assertIs(first, second)
+        # new frame pushes the chunk into the rolling window
+        third, _, _ = analysis.powerSpectrum('source', 2, chunk, 1000, 500, 2)
+        self.assertIsNot(first, third)
+        # other sources are analysed independently
+        other, _, _ = analysis.powerSpectrum('other', 2, chunk, 1000, 500, 2)
+        np.testing.assert_allclose(other, first)
+        self.assertEqual(analysis.rms('source', 1, chunk), dsp.rms(chunk))
+        self.assertEqual(analysis.rms('source', 1, chunk * 2), dsp.rms(chunk))
+
+    def test_filter_bank_matchesDenseFilters(self):
+        for scale in ['mel', 'bark']:
+            filters, f_hz = dsp.filter_bank(24, 512, 11025, 32.7, 5000.0, scale)
+            self.assertEqual(filters.shape, (24, 257))
+            # reference implementation
+            bins = np.floor(513. * _filterFrequencies(24, 32.7, 5000.0, scale) / 11025)
+            expected = np.zeros((24, 257))
+            for m in range(1, 25):
+                for k in range(int(bins[m - 1]), int(bins[m])):
+                    expected[m - 1, k] = (k - bins[m - 1]) / (bins[m] - bins[m - 1])
+                for k in range(int(bins[m]), int(bins[m + 1])):
+                    expected[m - 1, k] = (bins[m + 1] - k) / (bins[m + 1] - bins[m])
+            np.testing.assert_allclose(filters.toarray(), expected)
+            y = np.random.normal(size=512)
+            np.testing.assert_allclose(
+                dsp.warped_psd(y, 24, 11025, [32.7, 5000.0], scale), np.dot(dsp.power_spectrum(y), expected.T))
+
+    def test_filter_bank_cacheIsBounded(self):
+        dsp.filter_bank.cache_clear()
+        for n_filters in range(1, 100):
+            dsp.filter_bank(n_filters, 256, 11025, 32.7, 5000.0, 'bark')
+        self.assertLessEqual(dsp.filter_bank.cache_info().currsize, 32)
+
+    def test_bandSplit_matchesLFilter(self):
+        # use well conditioned bands, transfer function coefficients lose precision for narrow low bands
+        split = dsp.BandSplit(fs=44100)
+        self.assertEqual(split.getBandIndex(500.0, 2000.0), 0)
+        self.assertEqual(split.getBandIndex(2000.0, 8000.0), 1)
+        self.assertEqual(split.getBandIndex(500.0, 2000.0), 0)
+        filters = [dsp.design_filter(500.0, 2000.0, 44100), dsp.design_filter(2000.0, 8000.0, 44100)]
+        zi = [f[2] for f in filters]
+        for i in range(3):
+            x = np.random.normal(size=512)
+            output = split.process(x)
+            self.assertEqual(output.shape, (2, 512))
+            for band, (b, a, _) in enumerate(filters):
+                expected, zi[band] = lfilter(b, a, x, zi=zi[band])
+                np.testing.assert_allclose(output[band], expected, atol=1e-8)
+
+    def test_audioAnalysis_bandpassOncePerFrame(self):
+        analysis = dsp.AudioAnalysis()
+        x = np.random.normal(size=256)
+        low = analysis.bandpass('source', 1, x, 50.0, 200.0, 44100)
+        high = analysis.bandpass('source', 1, x, 200.0, 1000.0, 44100)
+        self.assertIs(analysis.bandpass('source', 1, x, 50.0, 200.0, 44100), low)
+        split = analysis._bandSplits[('source', 44100, 3)]
+        self.assertEqual(split.numBands(), 2)
+        reference = dsp.BandSplit(44100)
+        reference.getBandIndex(200.0, 1000.0)
+        np.testing.assert_allclose(high, reference.process(x)[0])
+        # bands not used in the last frame are removed
+        analysis.bandpass('source', 2, x, 200.0, 1000.0, 44100)
+        analysis.bandpass('source', 3, x, 200.0, 1000.0, 44100)
+        self.assertEqual(split.numBands(), 1)
+
+    def test_resample_usesCachedTaps(self):
+        dsp.design_resample_filter.cache_clear()
+        x = np.random.normal(size=1024)
+        y = dsp.resample(x, 44)
+        self.assertEqual(y.shape, (44, ))
+        # same filter as the default of resample_poly
+        np.testing.assert_allclose(y, resample_poly(x, 11, 256))
+        dsp.resample(np.random.normal(size=1024), 44, smoothing=2.0)
+        dsp.resample(np.random.normal(size=1024), 44, smoothing=2.0)
+        self.assertEqual(dsp.design_resample_filter.cache_info().misses, 2)
+        self.assertEqual(dsp.resample(x, 1024).shape, (1024, ))
+
+
+def _filterFrequencies(n_filters, fmin_hz, fmax_hz, scale):
+    if scale == 'mel':
+        f_mel = np.linspace(2595. * np.log10(1 + fmin_hz / 700.), 2595. * np.log10(1 + fmax_hz / 700.), n_filters + 2)
+        return 700. * (np.exp(f_mel / 1127.) - 1.)
+    f_bark = np.linspace(6.0 * np.arcsinh(fmin_hz / 600.0), 6.0 * np.arcsinh(fmax_hz / 600.0), n_filters + 2)
+    return 600.0 * np.sinh(f_bark / 6.0)
+
 
 if __name__ == '__main__':
     unittest.main()
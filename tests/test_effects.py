@@ -2,8 +2,11 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import unicode_literals
 from __future__ import absolute_import
+import asyncio
 import unittest
+import numpy as np
 from audioled import effects, audio, audioreactive, colors, generative  # noqa: F401
+from audioled.effect import constantColor
 
 
 class Test_Effects(unittest.TestCase):
@@ -35,6 +38,48 @@ class Test_Effects(unittest.TestCase):
         self.assertEqual([], effectsWithMissingParameterDescription)
 
 
+    def test_audioEffectsWithoutNewAudio_keepLevel(self):
+        effect = audioreactive.VUMeterPeak()
+        effect.setNumOutputPixels(10)
+        effect.setInputBuffer([np.ones(100) * 0.5, np.ones((3, 10)) * 255.0])
+        effect.setOutputBuffer([None])
+        effect.process()
+        output = np.copy(effect._outputBuffer[0])
+        # no new chunk since the last frame, level of the previous chunk is shown
+        effect.setInputBuffer([np.zeros(0), np.ones((3, 10)) * 255.0])
+        effect.process()
+        np.testing.assert_array_equal(effect._outputBuffer[0], output)
+
+    def test_audioEffectsWithoutNewAudio_keepMoving(self):
+        loop = asyncio.get_event_loop()
+        effect = audioreactive.MovingLight(fs=44100, speed=10.0)
+        effect.setNumOutputPixels(10)
+        effect.setOutputBuffer([None])
+        effect.setInputBuffer([np.sin(np.arange(1000) * 0.02), np.ones((3, 10)) * 255.0])
+        loop.run_until_complete(effect.update(0.01))
+        effect.process()
+        output = np.copy(effect._outputBuffer[0])
+        # no new chunk since the last frame, the light still moves and dims
+        effect.setInputBuffer([np.zeros(0), np.ones((3, 10)) * 255.0])
+        loop.run_until_complete(effect.update(0.2))
+        effect.process()
+        self.assertFalse(np.array_equal(effect._outputBuffer[0], output))
+        self.assertTrue(np.sum(effect._outputBuffer[0][:, 1:]) > 0)
+
+    def test_afterGlow_doesNotModifyInput(self):
+        effect = effects.AfterGlow(glow_time=1.0)
+        effect.setNumOutputPixels(4)
+        effect.setOutputBuffer([None])
+        effect.setInputBuffer([constantColor(4, 255.0, 255.0, 255.0)])
+        effect.process()
+        # darker input keeps the glowing pixels, the read-only input stays untouched
+        dark = np.zeros((3, 4))
+        effect.setInputBuffer([dark])
+        asyncio.get_event_loop().run_until_complete(effect.update(0.5))
+        effect.process()
+        np.testing.assert_array_equal(dark, np.zeros((3, 4)))
+        np.testing.assert_array_almost_equal(effect._outputBuffer[0], np.ones((3, 4)) * 127.5)
+
 def inheritors(klass):
     subclasses = set()
     work = [klass]
@@ -3,7 +3,9 @@ from __future__ import division
 from __future__ import unicode_literals
 from __future__ import absolute_import
 import unittest
-from audioled import filtergraph, devices
+import asyncio
+import numpy as np
+from audioled import filtergraph, devices, effects, generative, panelize
 
 
 class Test_FilterGraph(unittest.TestCase):
@@ -82,6 +84,44 @@ class Test_FilterGraph(unittest.TestCase):
         fg.addConnection(ef3, 0, led, 0)
         self.assertRaises(RuntimeError, fg.addConnection, ef3, 0, ef1, 0)
 
+    def test_circularConnectionsOnBranches_raisesError(self):
+        fg = filtergraph.FilterGraph()
+        ef1 = MockEffect()
+        ef2 = MockEffect()
+        ef3 = MockEffect()
+        ef4 = MockEffect()
+        for ef in [ef1, ef2, ef3, ef4]:
+            fg.addEffectNode(ef)
+        fg.addConnection(ef1, 0, ef2, 0)
+        fg.addConnection(ef1, 0, ef3, 0)
+        fg.addConnection(ef2, 0, ef4, 0)
+        fg.addConnection(ef3, 0, ef4, 1)
+        self.assertRaises(RuntimeError, fg.addConnection, ef4, 0, ef1, 1)
+        self.assertRaises(RuntimeError, fg.addConnection, ef4, 0, ef4, 1)
+        # not cyclic
+        fg.addConnection(ef2, 1, ef3, 1)
+
+    def test_setState_restoresGraph(self):
+        fg = filtergraph.FilterGraph()
+        ef1 = MockEffect()
+        ef2 = MockEffect()
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+        fg.addEffectNode(ef1)
+        fg.addEffectNode(ef2)
+        fg.addEffectNode(led)
+        con1 = fg.addConnection(ef1, 0, ef2, 0)
+        con2 = fg.addConnection(ef2, 0, led, 0)
+        state = fg.__getstate__()
+
+        restored = filtergraph.FilterGraph()
+        restored.__setstate__(state)
+        self.assertEqual([n.uid for n in restored._processOrder], [n.uid for n in fg._processOrder])
+        self.assertEqual([c.uid for c in restored._filterConnections], [con1.uid, con2.uid])
+        n2 = restored._getNodeByUid(con1.toNode.uid)
+        self.assertEqual(len(n2._incomingConnections), 1)
+        self.assertEqual(len(n2._outgoingConnections), 1)
+
     def test_outputBuffer_works(self):
         fg = filtergraph.FilterGraph()
         ef1 = MockEffect()
@@ -130,6 +170,200 @@ class Test_FilterGraph(unittest.TestCase):
         self.assertEqual(n1._outputBuffer[0], 'test')
         self.assertEqual(n2._outputBuffer[1], 'test')
 
+    def test_processPlan_recompiledOnTopologyChange(self):
+        fg = filtergraph.FilterGraph()
+        ef1 = MockEffect('test')
+        ef2 = MockEffect()
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+
+        fg.addEffectNode(ef1)
+        n2 = fg.addEffectNode(ef2)
+        fg.addEffectNode(led)
+        fg.addConnection(ef1, 0, ef2, 1)
+        fg.addConnection(ef2, 0, led, 0)
+
+        fg.process()
+        self.assertIsNotNone(fg._processPlan)
+        self.assertEqual(n2._outputBuffer[1], 'test')
+
+        fg.removeConnection(ef1, 0, ef2, 1)
+        self.assertIsNone(fg._processPlan)
+        fg.process()
+        # Input is not connected anymore and has to be reset
+        self.assertIsNone(n2._inputBuffer[1])
+        self.assertEqual(n2._outputBuffer[1], 1)
+
+    def test_outBuffer_isReusedAndReleased(self):
+        fg = filtergraph.FilterGraph()
+        ef1 = generative.StaticBlob()
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+        fg.addEffectNode(ef1)
+        fg.addEffectNode(led)
+        fg.addConnection(ef1, 0, led, 0)
+        fg.process()
+        out = ef1._outputBuffer[0]
+        self.assertEqual(out.shape, (3, 100))
+        fg.process()
+        self.assertIs(ef1._outputBuffer[0], out)
+        # buffer is resized when pixels change
+        fg.propagateNumPixels(50)
+        fg.process()
+        self.assertEqual(ef1._outputBuffer[0].shape, (3, 50))
+        fg.removeEffectNode(ef1)
+        self.assertEqual(len(fg._bufferPool._buffers), 0)
+
+    def test_processLevels_groupIndependentNodes(self):
+        fg = filtergraph.FilterGraph()
+        ef1 = MockEffect(1)
+        ef2 = MockEffect(2)
+        ef3 = MockEffect()
+        ef4 = MockEffect()
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+        n1 = fg.addEffectNode(ef1)
+        n2 = fg.addEffectNode(ef2)
+        n3 = fg.addEffectNode(ef3)
+        n4 = fg.addEffectNode(ef4)
+        fg.addEffectNode(led)
+        fg.addConnection(ef1, 0, ef3, 0)
+        fg.addConnection(ef2, 0, ef4, 0)
+        fg.addConnection(ef3, 0, ef4, 1)
+        fg.addConnection(ef4, 0, led, 0)
+        fg.process()
+        levels = [set(step[0] for step in level) for level in fg._processLevels]
+        self.assertEqual(levels[0], set([n1, n2]))
+        self.assertEqual(levels[1], set([n3]))
+        self.assertEqual(levels[2], set([n4]))
+
+    def test_parallelProcess_works(self):
+        fg = filtergraph.FilterGraph()
+        fg.numProcessWorkers = 4
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+        fg.addEffectNode(led)
+        effects = [MockEffect(i) for i in range(5)]
+        combine = MockEffect()
+        fg.addEffectNode(combine)
+        fg.addConnection(combine, 0, led, 0)
+        for i, ef in enumerate(effects):
+            fg.addEffectNode(ef)
+            fg.addConnection(ef, 0, combine, i)
+        fg.process()
+        self.assertEqual(len(fg._processLevels[0]), 5)
+        self.assertEqual(combine._outputBuffer, [0, 1, 2, 3, 4])
+
+    def test_parallelProcess_raisesNodeException(self):
+        fg = filtergraph.FilterGraph()
+        fg.numProcessWorkers = 2
+        ef1 = MockEffect('a')
+        ef2 = MockEffect('b')
+        ef2.process = None
+        combine = MockEffect()
+        led = devices.LEDOutput()
+        led.setNumOutputPixels(100)
+        for ef in [ef1, ef2, combine, led]:
+            fg.addEffectNode(ef)
+        fg.addConnection(ef1, 0, combine, 0)
+        fg.addConnection(ef2, 0, combine, 1)
+        fg.addConnection(combine, 0, led, 0)
+        with self.assertRaises(filtergraph.NodeException) as cm:
+            fg.process()
+        self.assertIs(cm.exception.node.effect, ef2)
+
+    def test_gatherEffects_areFused(self):
+        fg = filtergraph.FilterGraph()
+        blob = generative.StaticBlob()
+        mirror = effects.Mirror(mirror_lower=False, recursion=1)
+        flip = panelize.FlipRows(flip_odd_rows=True)
+        square = panelize.MakeSquare(displacement=0.25)
+        led = devices.LEDOutput()
+        for ef in [blob, mirror, flip, square, led]:
+            fg.addEffectNode(ef)
+        fg.addConnection(blob, 0, mirror, 0)
+        fg.addConnection(mirror, 0, flip, 0)
+        fg.addConnection(flip, 0, square, 0)
+        fg.addConnection(square, 0, led, 0)
+        fg.propagateNumPixels(64, 8)
+        fg.update(0.1, asyncio.get_event_loop())
+        fg.process()
+        self.assertEqual(len(fg._processPlan), 3)
+        chain = fg._gatherChains[fg._processOrder[-2]]
+        self.assertEqual([node.effect for node in chain.nodes], [mirror, flip, square])
+        fused = led._outputBuffer[0].copy()
+        # intermediate outputs are skipped
+        self.assertIsNone(mirror._outputBuffer[0])
+        self.assertIsNone(flip._outputBuffer[0])
+        # same result without fusion
+        fg.fuseGatherEffects = False
+        fg._processPlan = None
+        fg.process()
+        self.assertEqual(len(fg._processPlan), 5)
+        np.testing.assert_array_equal(led._outputBuffer[0], fused)
+
+    def test_gatherEffects_fusedWithDifferentInputSize(self):
+        fg = filtergraph.FilterGraph()
+        # source outputs more pixels than the graph is configured for
+        source = FixedSizeSource(24)
+        mirror = effects.Mirror(mirror_lower=True)
+        flip = panelize.FlipRows(flip_odd_rows=True)
+        led = devices.LEDOutput()
+        for ef in [source, mirror, flip, led]:
+            fg.addEffectNode(ef)
+        fg.addConnection(source, 0, mirror, 0)
+        fg.addConnection(mirror, 0, flip, 0)
+        fg.addConnection(flip, 0, led, 0)
+        fg.propagateNumPixels(16, 2)
+        fg.update(0.1, asyncio.get_event_loop())
+        fg.process()
+        self.assertEqual(len(fg._gatherChains), 1)
+        self.assertIsNone(mirror._outputBuffer[0])
+        fused = led._outputBuffer[0].copy()
+        fg.fuseGatherEffects = False
+        fg._processPlan = None
+        fg.process()
+        np.testing.assert_array_equal(led._outputBuffer[0], fused)
+
+    def test_gatherEffects_notFusedWithBranches(self):
+        fg = filtergraph.FilterGraph()
+        blob = generative.StaticBlob()
+        mirror = effects.Mirror()
+        flip = panelize.FlipRows()
+        combine = MockEffect()
+        led = devices.LEDOutput()
+        for ef in [blob, mirror, flip, combine, led]:
+            fg.addEffectNode(ef)
+        fg.addConnection(blob, 0, mirror, 0)
+        fg.addConnection(mirror, 0, flip, 0)
+        fg.addConnection(mirror, 0, combine, 1)
+        fg.addConnection(flip, 0, combine, 0)
+        fg.addConnection(combine, 0, led, 0)
+        fg.propagateNumPixels(64, 8)
+        fg.process()
+        self.assertEqual(fg._gatherChains, {})
+        self.assertEqual(len(fg._processPlan), 5)
+
+
+class FixedSizeSource(effects.Effect):
+    @staticmethod
+    def getEffectDescription():
+        return "Outputs a fixed number of pixels."
+
+    def __init__(self, size=24):
+        self.size = size
+        self.__initstate__()
+
+    def numInputChannels(self):
+        return 0
+
+    def numOutputChannels(self):
+        return 1
+
+    def process(self):
+        pixels = np.arange(3 * self.size, dtype=float).reshape((3, self.size))
+        self._outputBuffer[0] = pixels
+
 
 class MockEffect(object):
     def __init__(self, outputValue=None):
@@ -0,0 +1,120 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import unittest
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from audioled import generative
+from PIL import Image
+import numpy as np
+
+
+class Test_Generative(unittest.TestCase):
+    def test_swimmingPool_sumsRolledWaves(self):
+        num_pixels = 300
+        effect = generative.SwimmingPool(num_waves=30)
+        effect.setOutputBuffer([None])
+        effect.setInputBuffer([None])
+        effect.setNumOutputPixels(num_pixels)
+        loop = asyncio.get_event_loop()
+        for i in range(40):
+            loop.run_until_complete(effect.update(0.013))
+            effect.process()
+            self.assertEqual(effect._Wave.shape, (30, num_pixels))
+            # reference: roll every wave separately
+            expected = np.zeros(num_pixels)
+            for w in range(effect.num_waves):
+                fact = 1.0
+                if w == 0:
+                    fact = effect._rotate_counter / 30
+                if w == effect.num_waves - 1:
+                    fact = 1.0 - effect._rotate_counter / 30
+                expected += np.roll(effect._Wave[w], int(effect._t * effect._WaveSpecSpeed[w])) * effect.scale * fact
+            expected = (255.0 * expected).clip(0, 255.0)
+            np.testing.assert_array_almost_equal(effect._outputBuffer[0][0], expected)
+
+    def test_swimmingPool_sinArray_works(self):
+        effect = generative.SwimmingPool()
+        effect.setNumOutputPixels(100)
+        wave = effect._SinArray(10, 0.5)
+        self.assertEqual(wave.shape, (100, ))
+        # half of the sine wave is clipped
+        self.assertEqual(np.count_nonzero(wave > 1e-9), 9)
+        self.assertAlmostEqual(np.max(wave), 0.5)
+
+    def test_renderStars_addsOverlappingStars(self):
+        stars = generative.renderStars(10, 3, np.array([0, 2, 8]), np.array([1.0, 0.5, 0.25]))
+        np.testing.assert_array_almost_equal(stars, [1.0, 1.0, 1.5, 0.5, 0.5, 0, 0, 0, 0.25, 0.25])
+
+    def test_fallingStars_spawnsWithFrameTime(self):
+        effect = generative.FallingStars(spawntime=0.125, thickness=2)
+        effect.setOutputBuffer([None])
+        effect.setInputBuffer([None])
+        effect.setNumOutputPixels(50)
+        num_threads = threading.active_count()
+        loop = asyncio.get_event_loop()
+        effect.process()
+        self.assertEqual(effect._starCounter, 1)
+        for i in range(10):
+            loop.run_until_complete(effect.update(0.0625))
+            effect.process()
+        self.assertEqual(effect._starCounter, 6)
+        self.assertEqual(threading.active_count(), num_threads)
+        self.assertEqual(effect._outputBuffer[0].shape, (3, 50))
+        # ring buffer keeps the latest stars
+        for i in range(300):
+            loop.run_until_complete(effect.update(0.0625))
+            effect.process()
+        self.assertEqual(effect._starCounter, generative.max_stars)
+        self.assertAlmostEqual(np.max(effect._t0Array), effect._lastSpawnTime)
+
+    def test_sorting_finishesWithinDuration(self):
+        for num_pixels in [300, 2000]:
+            for sortby in ['red', 'brightness']:
+                effect = generative.Sorting(sortby=sortby, reversed=(sortby == 'red'), looping=False, duration=1.0)
+                effect.setOutputBuffer([None])
+                effect.setInputBuffer([])
+                effect.setNumOutputPixels(num_pixels)
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(effect.update(0.0))
+                effect.process()
+                start = effect._output.copy()
+                # sorted after at most one second
+                for i in range(20):
+                    loop.run_until_complete(effect.update(0.05))
+                    effect.process()
+                    if effect._sorting_done:
+                        break
+                self.assertTrue(effect._sorting_done)
+                output = effect._outputBuffer[0]
+                # same pixels in sorted order
+                if sortby == 'red':
+                    self.assertTrue(np.all(np.diff(output[0]) <= 0))
+                else:
+                    self.assertTrue(np.all(np.diff(np.sum(output, axis=0)) >= 0))
+                np.testing.assert_array_equal(np.sort(output[0]), np.sort(start[0]))
+
+    def test_gifPlayer_closesFile(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            gifFile = os.path.join(tmpDir, 'test.gif')
+            frames = [Image.new('RGB', (4, 2), (i * 50, 0, 0)) for i in range(3)]
+            frames[0].save(gifFile, save_all=True, append_images=frames[1:])
+            effect = generative.GIFPlayer(gifFile)
+            effect.setNumOutputPixels(8)
+            effect.setNumOutputRows(2)
+            loop = asyncio.get_event_loop()
+            for i in range(5):
+                # reopens the file after the last image
+                loop.run_until_complete(effect.update(0.1))
+            gif = effect._gif
+            self.assertIsNotNone(gif)
+            effect.close()
+            self.assertIsNone(effect._gif)
+            self.assertIsNone(gif.fp)
+        finally:
+            shutil.rmtree(tmpDir)
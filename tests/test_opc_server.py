@@ -32,6 +32,24 @@ class Test_OPC_Server(unittest.TestCase):
             print("Pixels received: {}".format(pixels_out))
             np.testing.assert_array_equal(pixels_in, pixels_out)
 
+    def test_serverReceivesArray(self):
+        # create server
+        server = opc_server.Server('127.0.0.1', 7893)
+        # start receiving without blocking
+        server.get_pixels(block=False)
+
+        # construct client
+        client = opc.Client('127.0.0.1:7893', long_connection=True)
+
+        # transfer some data, values out of range are clamped
+        for i in range(2):
+            pixels_in = np.random.uniform(-10.0, 300.0, (3, 10))
+            client.put_pixels_array(pixels_in)
+            # give some time for networking
+            time.sleep(0.1)
+            pixels_out = server.get_pixels(block=False)
+            np.testing.assert_array_equal(pixels_in.clip(0, 255).astype(int), pixels_out)
+
     def test_serverClosesSocket(self):
         # create server
         server = opc_server.Server('127.0.0.1', 7892)
@@ -4,6 +4,9 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 import unittest
 import asyncio
+import os
+import shutil
+import tempfile
 from audioled import panelize
 import numpy as np
 
@@ -44,6 +47,8 @@ class Test_Panelize(unittest.TestCase):
         loop = asyncio.get_event_loop()
         loop.run_until_complete(effect.update(0))
         self.assertIsNotNone(effect._mapMask)
+        self.assertEqual(effect._mapMask.shape, (num_pixels, ))
+        self.assertEqual(effect._mapMask.dtype, np.int32)
         effect.process()
         self.assertIsNotNone(effect._outputBuffer)
         self.assertEqual(len(effect._outputBuffer), 1)
@@ -55,6 +60,57 @@ class Test_Panelize(unittest.TestCase):
                 print(index)
                 self.assertEqual(input[0, index], output[0, j + i * num_cols])
 
+    def test_makeLabyrinth_sharesAndStoresMasks(self):
+        cacheDirectory = tempfile.mkdtemp()
+        try:
+            panelize._labyrinthMasks.clear()
+            mask = panelize.getLabyrinthMask(44 * 22, 22, cacheDirectory)
+            self.assertEqual(mask.shape, (44 * 22, ))
+            self.assertEqual(mask.dtype, np.int32)
+            self.assertEqual(os.listdir(cacheDirectory), ['labyrinth_968_22.npy'])
+            self.assertIs(panelize.getLabyrinthMask(44 * 22, 22, cacheDirectory), mask)
+            # masks are read from disk
+            panelize._labyrinthMasks.clear()
+            stored = panelize.getLabyrinthMask(44 * 22, 22, cacheDirectory)
+            self.assertIsNot(stored, mask)
+            np.testing.assert_array_equal(stored, mask)
+            # mask is shared between instances
+            effect = panelize.MakeLabyrinth()
+            effect.setNumOutputPixels(44 * 22)
+            effect.setNumOutputRows(22)
+            input = np.random.rand(3, 44 * 22)
+            effect._inputBuffer = [input]
+            effect._outputBuffer = [None]
+            asyncio.get_event_loop().run_until_complete(effect.update(0))
+            self.assertIs(effect._mapMask, stored)
+            effect.process()
+            np.testing.assert_array_equal(effect._outputBuffer[0], input[:, mask])
+        finally:
+            panelize._labyrinthMasks.clear()
+            shutil.rmtree(cacheDirectory)
+
+    def test_flipRows_flipsAllRows(self):
+        effect = panelize.FlipRows(flip_odd_rows=False, flip_even_rows=True)
+        effect.setNumOutputPixels(12)
+        effect.setNumOutputRows(3)
+        input = np.tile(np.arange(12, dtype=float), (3, 1))
+        effect._inputBuffer = [input]
+        effect._outputBuffer = [None]
+        effect.process()
+        expected = np.array([3, 2, 1, 0, 4, 5, 6, 7, 11, 10, 9, 8])
+        np.testing.assert_array_equal(effect._outputBuffer[0], np.tile(expected, (3, 1)))
+        # input of the previous node is not modified
+        np.testing.assert_array_equal(input, np.tile(np.arange(12), (3, 1)))
+        effect.flip_odd_rows = True
+        effect.flip_even_rows = False
+        effect.process()
+        expected = np.array([0, 1, 2, 3, 7, 6, 5, 4, 8, 9, 10, 11])
+        np.testing.assert_array_equal(effect._outputBuffer[0], np.tile(expected, (3, 1)))
+        # integer input
+        effect._inputBuffer = [np.tile(np.arange(12), (3, 1))]
+        effect.process()
+        np.testing.assert_array_equal(effect._outputBuffer[0], np.tile(expected, (3, 1)))
+
     def _indexFor(self, row, col, num_rows, num_cols, input_displacement=0.5):
         adjusted_row = row
         adjusted_col = col
@@ -0,0 +1,231 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import contextlib
+import io
+import threading
+import unittest
+import jsonpickle
+from audioled import project, filtergraph, generative, devices
+
+
+class Test_Project(unittest.TestCase):
+    def createProject(self, numSlots):
+        proj = project.Project('test', 'description')
+        for slotId in range(numSlots):
+            proj.setFiltergraphForSlot(slotId, createGraph())
+        return proj
+
+    def test_decode_restoresSlotsLazily(self):
+        proj = self.createProject(3)
+        proj.activateSlot(1)
+        restored = jsonpickle.decode(jsonpickle.encode(proj))
+        self.assertEqual(restored.name, 'test')
+        self.assertEqual(restored.activeSlotId, 1)
+        self.assertEqual(restored.slots, [None for i in range(127)])
+        self.assertEqual(set(restored._slotData.keys()), set([0, 1, 2]))
+        # unused slots are written without being restored
+        self.assertEqual(jsonpickle.encode(restored), jsonpickle.encode(proj))
+        fg = restored.getSlot(2)
+        self.assertIsInstance(fg, filtergraph.FilterGraph)
+        self.assertIs(fg._project, restored)
+        self.assertEqual(len(fg._filterNodes), 2)
+        self.assertNotIn(2, restored._slotData)
+
+    def test_getSlot_releasesLeastRecentlyUsedSlots(self):
+        proj = self.createProject(0)
+        proj.maxLiveSlots = 2
+        proj.activateSlot(0)
+        for slotId in range(4):
+            proj.setFiltergraphForSlot(slotId, createGraph())
+        # active slot is kept
+        self.assertEqual([s is not None for s in proj.slots[:4]], [True, False, False, True])
+        self.assertEqual(set(proj._slotData.keys()), set([1, 2]))
+        fg = proj.getSlot(1)
+        self.assertEqual(len(fg._filterNodes), 2)
+        self.assertEqual([s is not None for s in proj.slots[:4]], [True, True, False, False])
+
+    def test_getSlot_keepsSlotOfCurrentFrame(self):
+        proj = self.createProject(0)
+        proj.maxLiveSlots = 2
+        proj.activateSlot(0)
+        proj.setFiltergraphForSlot(0, createGraph())
+        proj.update(0.0)
+        # slot is switched in the middle of the frame
+        proj.activeSlotId = 1
+        for slotId in range(1, 4):
+            proj.setFiltergraphForSlot(slotId, createGraph())
+        self.assertIsNotNone(proj.slots[0])
+        self.assertNotIn(0, proj._slotData)
+
+    def test_decode_restoresReferencesPerSlot(self):
+        proj = self.createProject(0)
+        for slotId in range(2):
+            fg = createGraph()
+            # effects sharing a list are encoded with a reference
+            shared = [slotId, 'shared']
+            for node in fg._filterNodes:
+                node.effect.custom = shared
+            proj.setFiltergraphForSlot(slotId, fg)
+        restored = jsonpickle.decode(jsonpickle.encode(proj))
+        for slotId in range(2):
+            fg = restored.getSlot(slotId)
+            effects = [node.effect for node in fg._filterNodes]
+            self.assertIsInstance(effects[0], generative.StaticBlob)
+            self.assertIsInstance(effects[1], devices.LEDOutput)
+            self.assertEqual(effects[0].custom, [slotId, 'shared'])
+            self.assertIs(effects[0].custom, effects[1].custom)
+
+    def test_releaseSlot_closesEffectsOutsideOfLock(self):
+        proj = self.createProject(0)
+        proj.maxLiveSlots = 1
+        proj.activateSlot(0)
+        blob = ClosingBlob(proj)
+        fg = createGraph()
+        fg.addEffectNode(blob)
+        proj.setFiltergraphForSlot(1, fg)
+        self.assertFalse(blob.closed)
+        proj.setFiltergraphForSlot(2, createGraph())
+        self.assertTrue(blob.closed)
+        # flattened without holding the slot lock
+        self.assertEqual(blob.lockAvailable, [True])
+        self.assertIsNone(proj.slots[1])
+        self.assertEqual(proj._releasingSlots, {})
+        self.assertEqual(len(proj.getSlot(1)._filterNodes), 3)
+
+    def test_decode_oldProjectFormat(self):
+        proj = self.createProject(2)
+        # projects used to be encoded with all slots in one document, references span slots
+        shared = ['shared']
+        for slotId in range(2):
+            for node in proj.getSlot(slotId)._filterNodes:
+                node.effect.custom = shared
+        jsonpickle.handlers.unregister(project.Project)
+        try:
+            encoded = jsonpickle.encode(proj)
+        finally:
+            project.ProjectHandler.handles(project.Project)
+        restored = jsonpickle.decode(encoded)
+        # only the active slot is kept restored
+        self.assertEqual([s is not None for s in restored.slots[:2]], [True, False])
+        self.assertEqual(list(restored._liveSlots.keys()), [0])
+        self.assertEqual(set(restored._slotData.keys()), set([1]))
+        for slotId in range(2):
+            fg = restored.getSlot(slotId)
+            self.assertEqual(len(fg._filterNodes), 2)
+            self.assertEqual(fg._filterNodes[0].effect.custom, ['shared'])
+            self.assertIs(fg._filterNodes[0].effect.custom, fg._filterNodes[1].effect.custom)
+
+    def test_prewarmSlot_preparesSlotWithoutActivation(self):
+        proj = self.createProject(2)
+        proj.maxLiveSlots = 1
+        proj.activateSlot(0)
+        proj.setDevice(MockDevice(10, 2))
+        proj.getSlot(0)
+        self.assertIsNone(proj.slots[1])
+        fg = proj.prewarmSlot(1).result()
+        self.assertIs(proj.slots[1], fg)
+        self.assertEqual(proj.activeSlotId, 0)
+        self.assertEqual(fg.getLEDOutput().effect.getNumOutputPixels(), 10)
+        self.assertEqual(fg.getLEDOutput().effect.getNumOutputRows(), 2)
+        self.assertIsNotNone(fg.getLEDOutput()._outputBuffer[0])
+
+    def test_prewarmSlot_skipsActiveSlot(self):
+        proj = self.createProject(1)
+        proj.activateSlot(0)
+        proj.setDevice(MockDevice(10, 2))
+        fg = proj.prewarmSlot(0).result()
+        self.assertIs(fg, proj.slots[0])
+        # graph of the render thread is not touched
+        self.assertIsNone(fg.getLEDOutput().effect.getNumOutputPixels())
+        self.assertIsNone(fg._processPlan)
+
+    def test_prewarmSlot_logsErrors(self):
+        proj = self.createProject(0)
+        proj.setDevice(MockDevice(10, 2))
+        fg = createGraph()
+        fg.getLEDOutput().effect.process = None
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            future = proj.prewarmSlot(1, fg)
+            with self.assertRaises(filtergraph.NodeException):
+                future.result()
+            # callbacks run after result() returns
+            project._getPrewarmExecutor().submit(lambda: None).result()
+        self.assertIn("Error preparing slot", output.getvalue())
+
+    def test_activateSlotWhenReady_switchesBetweenFrames(self):
+        proj = self.createProject(2)
+        device = MockDevice(10, 1)
+        proj.setDevice(device)
+        proj.update(0.01)
+        fg = createGraph()
+        proj.activateSlotWhenReady(1, fg).result()
+        self.assertEqual(proj.activeSlotId, 1)
+        self.assertIs(proj.getSlot(1), fg)
+        # frame started before activation is finished with the previous slot
+        proj.process()
+        self.assertIs(device.shown, proj.getSlot(0).getLEDOutput()._outputBuffer[0])
+        proj.update(0.01)
+        proj.process()
+        self.assertIs(device.shown, fg.getLEDOutput()._outputBuffer[0])
+
+
+    def test_activateSlotWhenReady_keepsActiveSlotOnError(self):
+        proj = self.createProject(2)
+        proj.setDevice(MockDevice(10, 1))
+        fg = createGraph()
+        fg.getLEDOutput().effect.process = None
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(filtergraph.NodeException):
+                proj.activateSlotWhenReady(1, fg).result()
+            project._getPrewarmExecutor().submit(lambda: None).result()
+        self.assertEqual(proj.activeSlotId, 0)
+
+class ClosingBlob(generative.StaticBlob):
+    def __init__(self, proj):
+        super().__init__()
+        self._proj = proj
+        self.closed = False
+        self.lockAvailable = []
+
+    def __getstate__(self):
+        # check from another thread if the slot lock is held
+        def tryLock():
+            if self._proj._slotLock.acquire(blocking=False):
+                self._proj._slotLock.release()
+                self.lockAvailable.append(True)
+            else:
+                self.lockAvailable.append(False)
+
+        thread = threading.Thread(target=tryLock)
+        thread.start()
+        thread.join()
+        return super().__getstate__()
+
+    def close(self):
+        self.closed = True
+
+
+class MockDevice(devices.LEDController):
+    def __init__(self, num_pixels, num_rows):
+        super().__init__(num_pixels, num_rows)
+        self.shown = None
+
+    def show(self, pixels):
+        self.shown = pixels
+
+
+def createGraph():
+    fg = filtergraph.FilterGraph()
+    blob = generative.StaticBlob()
+    led = devices.LEDOutput()
+    fg.addEffectNode(blob)
+    fg.addEffectNode(led)
+    fg.addConnection(blob, 0, led, 0)
+    return fg
+
+
+if __name__ == '__main__':
+    unittest.main()
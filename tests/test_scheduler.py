@@ -0,0 +1,94 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import threading
+import unittest
+from audioled import scheduler
+
+
+class Test_Scheduler(unittest.TestCase):
+    def test_callsAtTargetFps(self):
+        clock = FakeClock()
+        calls = []
+
+        def frame():
+            calls.append(clock.now)
+            if len(calls) == 10:
+                sched._stopEvent.set()
+
+        sched = scheduler.FrameScheduler(frame, fps=50, clock=clock.time, wait=clock.wait)
+        sched._process_thread()
+        self.assertEqual(len(calls), 10)
+        for i, t in enumerate(calls):
+            self.assertAlmostEqual(t, i * 0.02)
+        self.assertEqual(sched.numFrames, 10)
+        self.assertEqual(sched.numLateFrames, 0)
+
+    def test_lateFrame_skipsToFrameGrid(self):
+        clock = FakeClock()
+        calls = []
+
+        def frame():
+            calls.append(clock.now)
+            if len(calls) == 3:
+                # frame took 35 ms instead of 10 ms
+                clock.now += 0.035
+            if len(calls) == 5:
+                sched._stopEvent.set()
+
+        sched = scheduler.FrameScheduler(frame,
+                                         fps=100,
+                                         policy=scheduler.POLICY_SKIP,
+                                         clock=clock.time,
+                                         wait=clock.wait)
+        sched._process_thread()
+        expected = [0.0, 0.01, 0.02, 0.055, 0.06]
+        for t, e in zip(calls, expected):
+            self.assertAlmostEqual(t, e)
+        self.assertEqual(sched.numLateFrames, 1)
+        self.assertEqual(sched.numSkippedFrames, 2)
+
+    def test_start_runsOnThread(self):
+        calls = threading.Event()
+        sched = scheduler.FrameScheduler(calls.set, fps=100)
+        sched.start()
+        self.assertTrue(calls.wait(1))
+        sched.stop()
+
+    def test_skipPolicy_skipsMissedFrames(self):
+        sched = scheduler.FrameScheduler(None, fps=100, policy=scheduler.POLICY_SKIP)
+        # frame took 35 ms instead of 10 ms
+        deadline = sched._nextDeadline(1.0, 1.035)
+        self.assertEqual(sched.numLateFrames, 1)
+        self.assertEqual(sched.numSkippedFrames, 2)
+        self.assertAlmostEqual(deadline, 1.03)
+        # in time
+        deadline = sched._nextDeadline(deadline, 1.035)
+        self.assertAlmostEqual(deadline, 1.04)
+        self.assertEqual(sched.numLateFrames, 1)
+
+    def test_catchUpPolicy_rendersMissedFrames(self):
+        sched = scheduler.FrameScheduler(None, fps=100, policy=scheduler.POLICY_CATCH_UP, max_catch_up=5)
+        deadline = sched._nextDeadline(1.0, 1.035)
+        self.assertAlmostEqual(deadline, 1.01)
+        self.assertEqual(sched.numSkippedFrames, 0)
+        # too far behind, skip
+        deadline = sched._nextDeadline(1.0, 1.505)
+        self.assertEqual(sched.numSkippedFrames, 49)
+        self.assertAlmostEqual(deadline, 1.5)
+
+    def test_invalidPolicy_raisesError(self):
+        self.assertRaises(ValueError, scheduler.FrameScheduler, None, 100, 'invalid')
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def wait(self, timeout):
+        self.now += timeout
+        return False
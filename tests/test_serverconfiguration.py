@@ -0,0 +1,153 @@
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from audioled import serverconfiguration
+
+
+class Test_ServerConfiguration(unittest.TestCase):
+    def setUp(self):
+        self.storageLocation = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storageLocation)
+
+    def createConfiguration(self):
+        sc = serverconfiguration.PersistentConfiguration(self.storageLocation, False)
+        # no output device in tests
+        sc.setConfiguration(serverconfiguration.CONFIG_DEVICE, 'None')
+        return sc
+
+    def storeAndWait(self, sc):
+        sc.store()
+        if sc._writer is not None:
+            sc._writer.flush()
+        sc.postStore()
+
+    def test_store_writesOnlyDirtyProjects(self):
+        sc = self.createConfiguration()
+        uid = sc.createEmptyProject('test', 'description')['id']
+        self.assertEqual(sc.getDirtyProjects(), {uid: 1})
+        self.storeAndWait(sc)
+        projFile = sc._projectMetadatas[uid]['location']
+        self.assertTrue(os.path.isfile(projFile))
+        self.assertIn(uid, sc._lastProjectHashs)
+        self.assertEqual(sc.getDirtyProjects(), {})
+        # nothing changed
+        os.remove(projFile)
+        self.storeAndWait(sc)
+        self.assertFalse(os.path.isfile(projFile))
+        # marked dirty without changes, content hash is unchanged
+        sc.markProjectDirty(uid)
+        self.storeAndWait(sc)
+        self.assertFalse(os.path.isfile(projFile))
+        # modified project is written again
+        sc.getProject(uid).activateSlot(3)
+        sc.markProjectDirty(uid)
+        self.storeAndWait(sc)
+        self.assertTrue(os.path.isfile(projFile))
+        sc.close()
+
+    def test_store_failedWriteKeepsProjectDirty(self):
+        sc = self.createConfiguration()
+        uid = sc.createEmptyProject('test', 'description')['id']
+        projFile = sc._projectMetadatas[uid]['location']
+        # a file where the project directory should be
+        blocker = os.path.join(self.storageLocation, 'blocker')
+        with open(blocker, 'w') as f:
+            f.write('')
+        sc._projectMetadatas[uid]['location'] = os.path.join(blocker, 'test.json')
+        self.storeAndWait(sc)
+        self.assertEqual(sc.getDirtyProjects(), {uid: 1})
+        # written with the next store
+        sc._projectMetadatas[uid]['location'] = projFile
+        self.storeAndWait(sc)
+        self.assertTrue(os.path.isfile(projFile))
+        self.assertEqual(sc.getDirtyProjects(), {})
+        sc.close()
+
+    def test_store_queuedProjectIsNotQueuedAgain(self):
+        sc = self.createConfiguration()
+        uid = sc.createEmptyProject('test', 'description')['id']
+        sc.store()
+        self.assertEqual(sc.getDirtyProjects(), {})
+        sc._writer.flush()
+        sc.postStore()
+        self.assertEqual(sc._storedRevisions[uid], 1)
+        sc.close()
+
+    def test_storedProject_canBeRead(self):
+        sc = self.createConfiguration()
+        uid = sc.createEmptyProject('test', 'description')['id']
+        sc.getProject(uid).activateSlot(5)
+        self.storeAndWait(sc)
+        sc.close()
+        restored = self.createConfiguration()
+        self.assertEqual(restored.getProjectMetadata(uid)['name'], 'test')
+        self.assertEqual(restored.getProject(uid).activeSlotId, 5)
+        self.assertEqual(restored.getDirtyProjects(), {})
+
+    def test_projectIndex_skipsUnchangedFiles(self):
+        sc = self.createConfiguration()
+        uid = sc.createEmptyProject('test', 'description')['id']
+        self.storeAndWait(sc)
+        sc.close()
+        self.assertTrue(os.path.isfile(os.path.join(self.storageLocation, 'projects.index.json')))
+        reads = []
+
+        class CountingConfiguration(serverconfiguration.PersistentConfiguration):
+            def _readProjectMetadata(self, filepath, fallbackUid):
+                reads.append(filepath)
+                return super()._readProjectMetadata(filepath, fallbackUid)
+
+        restored = CountingConfiguration(self.storageLocation, False)
+        self.assertEqual(reads, [])
+        self.assertEqual(restored.getProjectMetadata(uid)['name'], 'test')
+        self.assertEqual(restored.getProjectMetadata(uid)['location'], sc._projectMetadatas[uid]['location'])
+        # modified file is parsed again
+        projFile = sc._projectMetadatas[uid]['location']
+        with open(projFile) as f:
+            content = json.loads(f.read())
+        content['py/state']['name'] = 'renamed'
+        with open(projFile, 'w') as f:
+            f.write(json.dumps(content))
+        restored = CountingConfiguration(self.storageLocation, False)
+        self.assertEqual(reads, [projFile])
+        self.assertEqual(restored.getProjectMetadata(uid)['name'], 'renamed')
+
+    def test_projectWriter_writesAtomicallyAndReportsHash(self):
+        writer = serverconfiguration.ProjectWriter()
+        projFile = os.path.join(self.storageLocation, 'projects', 'a', 'a.json')
+        writer.write('a', 1, {'name': 'a'}, projFile)
+        writer.flush()
+        self.assertEqual(writer.getResults(), [('a', 1, serverconfiguration.projectHash({'name': 'a'}), None)])
+        self.assertEqual(writer.getResults(), [])
+        with open(projFile) as f:
+            self.assertEqual(json.loads(f.read()), {'name': 'a'})
+        self.assertEqual(os.listdir(os.path.dirname(projFile)), ['a.json'])
+        writer.stop()
+
+
+    def test_projectWriter_serializesOnWriterThread(self):
+        threads = []
+
+        class Snapshot(object):
+            def __getstate__(self):
+                threads.append(threading.current_thread())
+                return {'name': 'a'}
+
+        writer = serverconfiguration.ProjectWriter()
+        writer.write('a', 1, Snapshot(), os.path.join(self.storageLocation, 'a.json'))
+        writer.flush()
+        self.assertEqual(threads, [writer._thread])
+        self.assertIsNone(writer.getResults()[0][3])
+        writer.stop()
+
+if __name__ == '__main__':
+    unittest.main()